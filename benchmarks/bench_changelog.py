@@ -0,0 +1,158 @@
+"""
+Compares the old two-scan ChangeLog.parse_bodies against the single-pass parser
+over a corpus of synthetic PR bodies shaped like the ones our PR template produces.
+
+    python -m benchmarks.bench_changelog --bodies 10000
+"""
+import argparse
+import random
+import re
+import time
+from typing import List
+
+from rocket_releaser.changelog import ChangeLog
+
+TEMPLATE_COMMENT = """<!--
+Describe what this PR does. Lines under RELEASES end up in the release notes,
+lines under QA tell QA what to test. End each block with a blank line.
+-->"""
+
+WORDS = (
+    "add remove update refactor cache retry dashboard export report user admin "
+    "billing email search filter page modal button api endpoint timeout error"
+).split()
+
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))
+
+
+def make_body(rng: random.Random) -> str:
+    ticket = f"{rng.choice(['ENG', 'DEV', 'DS'])}-{rng.randint(1, 9999)}"
+    lines = [TEMPLATE_COMMENT, sentence(rng).capitalize() + ".", ""]
+
+    for _ in range(rng.randint(0, 6)):
+        lines.append(sentence(rng))
+    lines.append("")
+
+    if rng.random() < 0.8:
+        lines.append(rng.choice(["RELEASES", "Releases:", "release notes"]))
+        for _ in range(rng.randint(1, 4)):
+            kind = rng.random()
+            if kind < 0.3:
+                lines.append(f"- fixes [{ticket}] {sentence(rng)}")
+            elif kind < 0.6:
+                lines.append(f"- [{ticket}] {sentence(rng)}")
+            else:
+                lines.append(f"- {sentence(rng)}")
+        lines.append("")
+
+    if rng.random() < 0.6:
+        lines.append(rng.choice(["QA", "QA:", "qa notes"]))
+        for _ in range(rng.randint(1, 5)):
+            lines.append(f"- {sentence(rng)}")
+        lines.append("")
+
+    for _ in range(rng.randint(0, 20)):
+        lines.append(sentence(rng))
+
+    return "\r\n".join(lines) if rng.random() < 0.2 else "\n".join(lines)
+
+
+def make_pull_request_dicts(num_bodies: int, seed: int = 0) -> List[dict]:
+    rng = random.Random(seed)
+    return [{"number": i, "body": make_body(rng)} for i in range(num_bodies)]
+
+
+def old_parse_bodies(changelog: ChangeLog) -> ChangeLog:
+    """parse_bodies before it was single pass: one scan per block, string concatenation & re.sub per body"""
+    for pr_number, body in changelog.release_bodies:
+        lines = re.sub("<!--.+?>", "", body, flags=re.DOTALL)
+        lines = lines.strip().split("\n")
+        lines = list(map(lambda line_: line_.strip().lstrip("-").strip(), lines))
+
+        fixes = ""
+        noteworthy = ""
+        features = ""
+        collecting_releases = False
+        for line in lines:
+            if collecting_releases and not line:
+                break
+            if collecting_releases:
+                if changelog.is_fix(line):
+                    fixes = fixes + " " + line
+                elif changelog.is_noteworthy(line):
+                    noteworthy = noteworthy + " " + changelog.make_jira_id_bold(line)
+                else:
+                    features = features + " " + line
+            if not collecting_releases and line.lower().startswith("release"):
+                collecting_releases = True
+
+        qa_notes = ""
+        collecting_qa_notes = False
+        for line in lines:
+            if collecting_qa_notes and not line:
+                break
+            if collecting_qa_notes:
+                qa_notes = qa_notes + " " + line
+            if not collecting_qa_notes and line.lower().startswith("qa"):
+                collecting_qa_notes = True
+
+        for section, text in (
+            (changelog.fixes, fixes),
+            (changelog.noteworthy, noteworthy),
+            (changelog.features, features),
+            (changelog.qa_notes, qa_notes),
+        ):
+            if text:
+                section.append(
+                    changelog.linkify(
+                        changelog.org_name,
+                        changelog.repo_name,
+                        text,
+                        pr_number,
+                        changelog.jira_url,
+                    )
+                )
+
+    return changelog
+
+
+def measure(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bodies", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    pull_request_dicts = make_pull_request_dicts(args.bodies)
+
+    def changelog():
+        return ChangeLog(
+            pull_request_dicts, "org", "repo", jira_url="https://company.atlassian.net"
+        )
+
+    old = old_parse_bodies(changelog())
+    new = changelog().parse_bodies()
+    for section in ("fixes", "noteworthy", "features", "qa_notes"):
+        assert getattr(old, section) == getattr(new, section), section
+
+    old_seconds = min(
+        measure(lambda: old_parse_bodies(changelog())) for _ in range(args.repeat)
+    )
+    new_seconds = min(
+        measure(lambda: changelog().parse_bodies()) for _ in range(args.repeat)
+    )
+
+    print(f"{args.bodies} bodies, best of {args.repeat}")
+    print(f"two scans:   {old_seconds:.3f}s, {args.bodies / old_seconds:,.0f} bodies/s")
+    print(f"single pass: {new_seconds:.3f}s, {args.bodies / new_seconds:,.0f} bodies/s")
+
+
+if __name__ == "__main__":
+    main()
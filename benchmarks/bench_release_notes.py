@@ -0,0 +1,244 @@
+"""
+Runs release_notes end to end against a synthetic repo & local GitHub, Jira & Slack stand-ins
+(see fake_services), and reports how long each stage took, throughput & HTTP latency.
+
+    python -m benchmarks.bench_release_notes --commits 2000 --github_latency 0.05
+
+Save a run with --json & compare later runs against it with --baseline to catch regressions.
+Exits with 1 if a stage got more than --tolerance slower than in the baseline.
+"""
+import argparse
+import json
+import logging
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from rocket_releaser import stats
+from rocket_releaser.release_notes import release_notes
+
+from .bench_changelog import make_body
+from .fake_services import FakeGitHub, FakeJira, FakeSlack
+from .synthetic_repo import make_repo
+
+
+def make_prs_by_sha(
+    shas: List[str], commits_per_pr: int, num_tickets: int, seed: int = 0
+) -> Dict[str, List[dict]]:
+    """
+    makes a merged PR for every commits_per_pr commits, each mentioning one of num_tickets Jira tickets.
+    PR's are numbered from 1 in shas order.
+    """
+    rng = random.Random(seed)
+    prs_by_sha = {}
+    pr = None
+    for i, sha in enumerate(shas):
+        if i % commits_per_pr == 0:
+            number = i // commits_per_pr + 1
+            pr = {
+                "id": f"PR_{number}",
+                "title": f"[ENG-{rng.randint(1, num_tickets)}] Change {number}",
+                "number": number,
+                "body": make_body(rng),
+                "merged": True,
+            }
+        prs_by_sha[sha] = [pr]
+    return prs_by_sha
+
+
+def run(args) -> dict:
+    with tempfile.TemporaryDirectory() as repo_dir:
+        return run_in(args, repo_dir)
+
+
+def run_in(args, repo_dir: str) -> dict:
+    first_sha, last_sha = make_repo(
+        repo_dir,
+        args.commits,
+        cherry_pick_every=args.cherry_pick_every,
+        merge_every=args.merge_every,
+        commits_per_pr=args.commits_per_pr if args.squash_subjects else 0,
+    )
+    shas = (
+        subprocess.check_output(
+            ["git", "-C", repo_dir, "rev-list", "--reverse", "master"]
+        )
+        .decode()
+        .split()
+    )
+    # oldest first, so PR numbers match the squash subjects of a repo without merges
+    prs_by_sha = make_prs_by_sha(shas, args.commits_per_pr, args.tickets)
+
+    github = FakeGitHub(
+        prs_by_sha,
+        budget=args.github_budget,
+        budget_window=args.github_budget_window,
+        latency=args.github_latency,
+        rate_limit=args.github_rate_limit,
+    )
+    jira = FakeJira(latency=args.jira_latency, rate_limit=args.jira_rate_limit)
+    slack = FakeSlack(latency=args.slack_latency)
+
+    collector = stats.StatsCollector()
+    with github, jira, slack, stats.collecting(collector):
+        start = time.perf_counter()
+        release_notes(
+            "token",
+            first_sha,
+            last_sha,
+            "org",
+            "repo",
+            repo_dir=repo_dir,
+            slack_webhook_key="T000/B000/XXX",
+            env_name=args.env_name,
+            vpc_name=args.env_name,
+            jira_token="token",
+            jira_username="bench",
+            jira_url=jira.url,
+            fetch_before=False,
+            pr_chunk_size=args.pr_chunk_size,
+            max_concurrency=args.max_concurrency,
+            git_backend=args.git_backend,
+            label_concurrency=args.label_concurrency,
+            bulk_jira_labels=args.bulk_jira_labels,
+            pr_label_backend=args.pr_label_backend,
+            github_url=github.url,
+            slack_webhook_url=slack.url,
+            pr_discovery=args.pr_discovery,
+            pr_fields=args.pr_fields,
+            two_phase_prs=args.two_phase_prs,
+            post_before_labeling=args.post_before_labeling,
+        )
+        seconds = time.perf_counter() - start
+
+    assert slack.messages, "release notes weren't posted to slack"
+
+    num_prs = len({prs[0]["number"] for prs in prs_by_sha.values()})
+    return {
+        "args": vars(args),
+        "seconds": seconds,
+        "seconds_to_slack": slack.posted_at[0] - start,
+        "shas_per_second": len(shas) / seconds,
+        "prs_per_second": num_prs / seconds,
+        "prs": num_prs,
+        "jira_tickets": len(jira.issues),
+        "rate_limited": {"github": github.rate_limited, "jira": jira.rate_limited},
+        "stats": collector.to_dict(),
+        "summary": collector.summary(),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    :return: stages that got more than tolerance (ex: 0.2 for 20%) slower than in baseline
+    """
+    regressions = []
+    stages = dict(result["stats"]["stages"], total=result["seconds"])
+    baseline_stages = dict(baseline["stats"]["stages"], total=baseline["seconds"])
+    print("\nCompared to baseline:")
+    for name, seconds in stages.items():
+        if name not in baseline_stages:
+            continue
+        baseline_seconds = baseline_stages[name]
+        change = (
+            (seconds - baseline_seconds) / baseline_seconds if baseline_seconds else 0
+        )
+        regressed = change > tolerance
+        print(
+            f"  {name}: {seconds:.2f}s vs {baseline_seconds:.2f}s ({change:+.0%})"
+            + (" REGRESSION" if regressed else "")
+        )
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=2000)
+    parser.add_argument("--commits_per_pr", type=int, default=3)
+    parser.add_argument("--cherry_pick_every", type=int, default=20)
+    parser.add_argument("--merge_every", type=int, default=0)
+    parser.add_argument(
+        "--squash_subjects",
+        action="store_true",
+        help='give commits "Commit i (#N)" subjects naming their PR, like squash merges. '
+        "Only matches the fake GitHub's PR's without --merge_every",
+    )
+    parser.add_argument("--tickets", type=int, default=200)
+    parser.add_argument("--env_name", default="preview")
+    parser.add_argument(
+        "--github_latency", type=float, default=0.05, help="seconds per request"
+    )
+    parser.add_argument("--jira_latency", type=float, default=0.05)
+    parser.add_argument("--slack_latency", type=float, default=0.05)
+    parser.add_argument(
+        "--github_rate_limit",
+        type=float,
+        default=0,
+        help="requests per second, unlimited if 0",
+    )
+    parser.add_argument(
+        "--github_budget",
+        type=int,
+        default=0,
+        help="GitHub requests allowed per --github_budget_window, for REST & GraphQL each. Unlimited if 0",
+    )
+    parser.add_argument("--github_budget_window", type=float, default=60)
+    parser.add_argument("--jira_rate_limit", type=float, default=0)
+    parser.add_argument("--pr_chunk_size", type=int, default=50)
+    parser.add_argument("--max_concurrency", type=int, default=4)
+    parser.add_argument("--label_concurrency", type=int, default=4)
+    parser.add_argument("--bulk_jira_labels", action="store_true")
+    parser.add_argument("--pr_label_backend", default="rest")
+    parser.add_argument("--git_backend", default="subprocess")
+    parser.add_argument("--pr_discovery", default="associated")
+    parser.add_argument("--pr_fields", default="full")
+    parser.add_argument("--two_phase_prs", action="store_true")
+    parser.add_argument("--post_before_labeling", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="log everything")
+    parser.add_argument("--json", help="file to write the results to")
+    parser.add_argument("--baseline", help="results of an earlier run to compare to")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="how much slower a stage may get than in the baseline, ex: 0.2 for 20%%",
+    )
+    args = parser.parse_args()
+
+    # rocket_releaser logs every PR & ticket it labels
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.ERROR)
+
+    result = run(args)
+
+    print(
+        f"{args.commits} commits, {result['prs']} PRs, {result['jira_tickets']} jira tickets "
+        f"in {result['seconds']:.2f}s, first Slack message after {result['seconds_to_slack']:.2f}s"
+    )
+    print(
+        f"{result['shas_per_second']:,.0f} shas/s, {result['prs_per_second']:,.0f} PRs/s, "
+        f"rate limited {result['rate_limited']['github']} GitHub & {result['rate_limited']['jira']} Jira requests"
+    )
+    print(result["summary"])
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump(
+                {k: v for k, v in result.items() if k != "summary"},
+                results_file,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(result, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares reading all of rev-list's output at once against streaming it through SHAs.iter_shas,
+with and without compact mode.
+
+    python -m benchmarks.bench_shas --commits 100000
+"""
+import argparse
+import re
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import List
+
+from rocket_releaser.shas import SHAs
+
+from .synthetic_repo import make_repo
+
+
+def old_get_shas(shas: SHAs, from_revision: str, to_revision: str) -> List[str]:
+    """get_shas before it streamed: check_output, decode, split & re.match every line"""
+    commit_msgs = subprocess.check_output(
+        shas.base_args
+        + ["rev-list", from_revision + "..." + to_revision, "--format=%B"]
+    ).decode("utf-8")
+
+    found = []
+    for line in commit_msgs.split("\n"):
+        line = line.rstrip("\r")
+        if re.match(r"commit \w+$", line):
+            found.append(line.replace("commit ", ""))
+        if line.startswith("(cherry picked from commit "):
+            found.append(line.replace("(cherry picked from commit ", "").rstrip(")"))
+    return found
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commits", type=int, default=100000)
+    parser.add_argument("--body_lines", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as repo_dir:
+        run(args, repo_dir)
+
+
+def run(args, repo_dir: str):
+    first_sha, last_sha = make_repo(repo_dir, args.commits, body_lines=args.body_lines)
+    shas = SHAs(repo_dir, fetch_before=False)
+
+    old, old_seconds, old_peak = measure(
+        lambda: old_get_shas(shas, first_sha, last_sha)
+    )
+    new, new_seconds, new_peak = measure(
+        lambda: list(shas.iter_shas(first_sha, last_sha))
+    )
+    compact, compact_seconds, compact_peak = measure(
+        lambda: list(SHAs(repo_dir, False, compact=True).iter_shas(first_sha, last_sha))
+    )
+    assert old == new, "streaming parser returned different SHAs"
+    assert old == compact, "compact mode returned different SHAs"
+
+    print(f"{len(new)} shas from {args.commits} commits")
+    print(f"check_output + split: {old_seconds:.2f}s, peak {old_peak / 2**20:.1f} MiB")
+    print(f"streaming iter_shas:  {new_seconds:.2f}s, peak {new_peak / 2**20:.1f} MiB")
+    print(
+        f"compact iter_shas:    {compact_seconds:.2f}s, peak {compact_peak / 2**20:.1f} MiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+"""
+Local stand-ins for the GitHub, Jira & Slack APIs release_notes talks to, for benchmarking it end to end
+without a network or real accounts. Each service runs its own HTTP server on localhost with
+a configurable latency per request and an optional rate limit.
+
+Only the requests release_notes makes are answered, with just enough of each response for
+rocket_releaser, github3 & jira to read.
+"""
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+class RateLimit:
+    """
+    token bucket allowing requests_per_second on average, with bursts of up to burst requests.
+    Requests over the limit are answered with a 429 & a Retry-After header.
+    """
+
+    def __init__(self, requests_per_second: float, burst: int = 10):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> Optional[float]:
+        """
+        :return: None if a request may go ahead now, otherwise seconds until it may
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.requests_per_second,
+            )
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return None
+            return (1 - self._tokens) / self.requests_per_second
+
+
+class FakeService:
+    """
+    a threaded HTTP server answering requests with handle(method, path, query, body),
+    after sleeping latency seconds.
+
+    :param latency: seconds every request takes
+    :param rate_limit: requests per second allowed, unlimited if 0
+    """
+
+    def __init__(self, latency: float = 0.0, rate_limit: float = 0):
+        self.latency = latency
+        self.rate_limit = RateLimit(rate_limit) if rate_limit else None
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(
+        self, method: str, path: str, query: Dict[str, List[str]], body
+    ) -> Tuple[int, object]:
+        """
+        :param body: the request's JSON body, or None
+        :return: (status code, JSON response)
+        """
+        raise NotImplementedError
+
+    def budget(self, path: str) -> Tuple[bool, Dict[str, str]]:
+        """
+        spends a request of path's budget, for services with a budget per time window like GitHub's
+
+        :return: (whether the request is within budget, headers to answer with)
+        """
+        return True, {}
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw_body = self.rfile.read(length) if length else b""
+                with service._lock:
+                    service.requests += 1
+
+                time.sleep(service.latency)
+
+                url = urlparse(self.path)
+                within_budget, headers = service.budget(url.path)
+                retry_after = service.rate_limit and service.rate_limit.retry_after()
+                if retry_after:
+                    with service._lock:
+                        service.rate_limited += 1
+                    status, response = 429, {"message": "rate limit exceeded"}
+                    headers["Retry-After"] = f"{retry_after:.2f}"
+                elif not within_budget:
+                    with service._lock:
+                        service.rate_limited += 1
+                    status, response = 403, {"message": "API rate limit exceeded"}
+                else:
+                    try:
+                        body = json.loads(raw_body) if raw_body else None
+                    except ValueError:
+                        body = None
+                    status, response = service.handle(
+                        self.command, url.path, parse_qs(url.query), body
+                    )
+
+                content = json.dumps(response).encode("utf-8") if status != 204 else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = _respond
+
+        return Handler
+
+
+class FakeGitHub(FakeService):
+    """
+    GitHub Enterprise stand-in: GraphQL at /api/graphql & REST under /api/v3.
+    Pass its url as release_notes' github_url.
+
+    :param prs_by_sha: PR's (dicts of id, title, number, body & merged) associated with each commit.
+        Commits missing from it aren't found.
+    :param budget: requests allowed per budget_window seconds, for REST & GraphQL each, reported in
+        X-RateLimit-* headers & GraphQL rateLimit fields. Requests over it get a 403. Unlimited if 0.
+    """
+
+    ISSUE_PATH_RE = re.compile(
+        r"^/api/v3/repos/([^/]+)/([^/]+)/issues/(\d+)(/labels)?$"
+    )
+
+    def __init__(
+        self,
+        prs_by_sha: Dict[str, List[dict]],
+        budget: int = 0,
+        budget_window: float = 60,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.budget_limit = budget
+        self.budget_window = budget_window
+        # resource -> (requests spent, window reset time)
+        self._spent: Dict[str, Tuple[int, float]] = {}
+        self.prs_by_sha = prs_by_sha
+        self.prs_by_number = {
+            pr["number"]: pr for prs in prs_by_sha.values() for pr in prs
+        }
+        self.labels: Dict[int, List[str]] = {}
+
+    def handle(self, method, path, query, body):
+        if path == "/api/graphql" and method == "POST":
+            return self._graphql(body["query"], body.get("variables") or {})
+
+        match = self.ISSUE_PATH_RE.match(path)
+        if match:
+            owner, repo, number, labels = match.groups()
+            number = int(number)
+            if number not in self.prs_by_number:
+                return 404, {"message": "Not Found"}
+            if labels and method == "POST":
+                self._add_labels(number, body)
+                return 200, [
+                    self._label(owner, repo, name) for name in self.labels[number]
+                ]
+            return 200, self._issue(owner, repo, number)
+
+        return 404, {"message": "Not Found"}
+
+    def budget(self, path: str) -> Tuple[bool, Dict[str, str]]:
+        if not self.budget_limit:
+            return True, {}
+        resource = "graphql" if path == "/api/graphql" else "core"
+        with self._lock:
+            spent, reset_at = self._spent.get(resource, (0, 0.0))
+            if time.time() >= reset_at:
+                # GitHub's resets are whole seconds
+                spent, reset_at = 0, float(math.ceil(time.time() + self.budget_window))
+            within_budget = spent < self.budget_limit
+            if within_budget:
+                spent += 1
+            self._spent[resource] = (spent, reset_at)
+        return within_budget, {
+            "X-RateLimit-Limit": str(self.budget_limit),
+            "X-RateLimit-Remaining": str(self.budget_limit - spent),
+            "X-RateLimit-Reset": str(int(reset_at)),
+            "X-RateLimit-Resource": resource,
+        }
+
+    def _rate_limit_field(self) -> dict:
+        spent, reset_at = self._spent.get("graphql", (0, time.time()))
+        return {
+            "cost": 1,
+            "limit": self.budget_limit or 5000,
+            "remaining": self.budget_limit - spent if self.budget_limit else 5000,
+            "resetAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(reset_at)),
+        }
+
+    def _add_labels(self, number: int, names: List[str]):
+        with self._lock:
+            labels = self.labels.setdefault(number, [])
+            labels.extend(name for name in names if name not in labels)
+
+    def _graphql(self, query: str, variables: dict) -> Tuple[int, dict]:
+        # PR's only come with the fields asked for, which are on lines of their own
+        fields = set(re.findall(r"^\s+(\w+)$", query, re.MULTILINE))
+
+        if query.lstrip().startswith("query associatedPRs"):
+            data, errors = {}, []
+            for alias, sha in variables.items():
+                if not alias.startswith("sha"):
+                    continue
+                prs = self.prs_by_sha.get(sha)
+                if prs is None:
+                    data[alias] = None
+                    errors.append(
+                        {
+                            "message": f"Could not resolve to a commit with expression '{sha}'.",
+                            "path": ["repository", alias],
+                        }
+                    )
+                else:
+                    edges = [{"node": self._fields(pr, fields)} for pr in prs]
+                    data[alias] = {"associatedPullRequests": {"edges": edges}}
+            result = {"data": {"repository": data}}
+            if "rateLimit" in query:
+                result["data"]["rateLimit"] = self._rate_limit_field()
+            if errors:
+                result["errors"] = errors
+            return 200, result
+
+        if query.lstrip().startswith("query pullRequests"):
+            data, errors = {}, []
+            for alias, number in variables.items():
+                if not alias.startswith("pr"):
+                    continue
+                pr = self.prs_by_number.get(number)
+                if pr is None:
+                    data[alias] = None
+                    errors.append(
+                        {
+                            "type": "NOT_FOUND",
+                            "message": f"Could not resolve to a PullRequest with the number of {number}.",
+                            "path": ["repository", alias],
+                        }
+                    )
+                else:
+                    data[alias] = self._fields(pr, fields)
+            result = {"data": {"repository": data}}
+            if "rateLimit" in query:
+                result["data"]["rateLimit"] = self._rate_limit_field()
+            if errors:
+                result["errors"] = errors
+            return 200, result
+
+        if query.lstrip().startswith("query labelId"):
+            label = {"id": f"label-{variables['label']}"}
+            return 200, {"data": {"repository": {"label": label}}}
+
+        if query.lstrip().startswith("mutation addLabels"):
+            label = variables["labelIds"][0][len("label-") :]
+            data = {}
+            for alias, node_id in variables.items():
+                if alias.startswith("pr"):
+                    self._add_labels(int(node_id[len("PR_") :]), [label])
+                    data[alias] = {"clientMutationId": None}
+            return 200, {"data": data}
+
+        return 200, {"errors": [{"message": "unknown query"}]}
+
+    @staticmethod
+    def _fields(pr: dict, fields: set) -> dict:
+        return {field: value for field, value in pr.items() if field in fields}
+
+    def _label(self, owner: str, repo: str, name: str) -> dict:
+        return {
+            "id": abs(hash(name)),
+            "name": name,
+            "color": "ededed",
+            "description": "",
+            "url": f"{self.url}/api/v3/repos/{owner}/{repo}/labels/{name}",
+        }
+
+    def _user(self) -> dict:
+        login = "bench"
+        return {
+            "login": login,
+            "id": 1,
+            "node_id": "U_1",
+            "avatar_url": "",
+            "gravatar_id": "",
+            "url": f"{self.url}/api/v3/users/{login}",
+            "html_url": f"{self.url}/{login}",
+            "followers_url": "",
+            "following_url": "",
+            "gists_url": "",
+            "starred_url": "",
+            "subscriptions_url": "",
+            "organizations_url": "",
+            "repos_url": "",
+            "events_url": "",
+            "received_events_url": "",
+            "type": "User",
+            "site_admin": False,
+        }
+
+    def _issue(self, owner: str, repo: str, number: int) -> dict:
+        pr = self.prs_by_number[number]
+        repo_url = f"{self.url}/api/v3/repos/{owner}/{repo}"
+        return {
+            "id": number,
+            "node_id": pr["id"],
+            "number": number,
+            "title": pr["title"],
+            "body": pr["body"],
+            "body_html": pr["body"],
+            "body_text": pr["body"],
+            "state": "closed",
+            "locked": False,
+            "user": self._user(),
+            "assignee": None,
+            "assignees": [],
+            "labels": [
+                self._label(owner, repo, name) for name in self.labels.get(number, [])
+            ],
+            "milestone": None,
+            "comments": 0,
+            "comments_url": f"{repo_url}/issues/{number}/comments",
+            "events_url": f"{repo_url}/issues/{number}/events",
+            "labels_url": f"{repo_url}/issues/{number}/labels{{/name}}",
+            "repository_url": repo_url,
+            "url": f"{repo_url}/issues/{number}",
+            "html_url": f"{self.url}/{owner}/{repo}/pull/{number}",
+            "pull_request": {"url": f"{repo_url}/pulls/{number}"},
+            "author_association": "MEMBER",
+            "created_at": "2020-01-01T00:00:00Z",
+            "updated_at": "2020-01-01T00:00:00Z",
+            "closed_at": "2020-01-01T00:00:00Z",
+            "closed_by": None,
+        }
+
+
+class FakeJira(FakeService):
+    """
+    Jira Cloud stand-in for the REST v2 endpoints the jira package uses & the v3 bulk edit endpoints.
+    Every ticket exists & starts out "In Progress", with a "Code Review" transition to "In Review".
+    """
+
+    STATUS_TRANSITIONS = {
+        "In Progress": {"21": ("Code Review", "In Review")},
+        "In Review": {"31": ("Ready to Test", "Ready to Test")},
+    }
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.issues: Dict[str, dict] = {}
+        self._bulk_tasks = 0
+
+    def _get_issue(self, key: str) -> dict:
+        with self._lock:
+            if key not in self.issues:
+                self.issues[key] = {
+                    "labels": [],
+                    "status": "In Progress",
+                    "id": str(10000 + len(self.issues)),
+                }
+            return self.issues[key]
+
+    def _issue_json(self, key: str) -> dict:
+        issue = self._get_issue(key)
+        project = key.split("-")[0]
+        return {
+            "id": issue["id"],
+            "key": key,
+            "self": f"{self.url}/rest/api/2/issue/{issue['id']}",
+            "fields": {
+                "labels": list(issue["labels"]),
+                "status": {"name": issue["status"]},
+                "project": {"key": project, "name": project},
+                "issuetype": {"name": "Story"},
+            },
+        }
+
+    def _add_label(self, key: str, label: str):
+        issue = self._get_issue(key)
+        with self._lock:
+            if label not in issue["labels"]:
+                issue["labels"].append(label)
+
+    def _key(self, key_or_id: str) -> str:
+        for key, issue in list(self.issues.items()):
+            if issue["id"] == key_or_id:
+                return key
+        return key_or_id
+
+    def handle(self, method, path, query, body):
+        if path == "/rest/api/2/serverInfo":
+            return 200, {
+                "baseUrl": self.url,
+                "version": "1001.0.0",
+                "versionNumbers": [1001, 0, 0],
+                "deploymentType": "Cloud",
+            }
+
+        if path == "/rest/api/2/field":
+            return 200, [
+                {"id": field, "name": field, "custom": False}
+                for field in ("labels", "status", "project", "issuetype")
+            ]
+
+        if path in ("/rest/api/2/search", "/rest/api/2/search/jql"):
+            jql = (query.get("jql") or [(body or {}).get("jql", "")])[0]
+            keys = re.findall(r"[A-Z]{2,}-\d+", jql)
+            return 200, {
+                "startAt": 0,
+                "maxResults": len(keys),
+                "total": len(keys),
+                "isLast": True,
+                "issues": [self._issue_json(key) for key in keys],
+            }
+
+        match = re.match(r"^/rest/api/2/issue/([^/]+)(/transitions)?$", path)
+        if match:
+            key, transitions = match.groups()
+            key = self._key(key)
+            issue = self._get_issue(key)
+            if transitions and method == "POST":
+                transition_id = str(body["transition"]["id"])
+                to = self.STATUS_TRANSITIONS.get(issue["status"], {}).get(transition_id)
+                if to is None:
+                    return 400, {"errorMessages": ["invalid transition"]}
+                issue["status"] = to[1]
+                return 204, None
+            if transitions:
+                return 200, {
+                    "transitions": [
+                        {"id": transition_id, "name": name, "to": {"name": to}}
+                        for transition_id, (name, to) in self.STATUS_TRANSITIONS.get(
+                            issue["status"], {}
+                        ).items()
+                    ]
+                }
+            if method == "PUT":
+                for label in (body.get("update") or {}).get("labels", []):
+                    self._add_label(key, label["add"])
+                return 204, None
+            return 200, self._issue_json(key)
+
+        if path == "/rest/api/3/bulk/issues/fields" and method == "POST":
+            labels = body["editedFieldsInput"]["labelsFields"][0]["labels"]
+            for key in body["selectedIssueIdsOrKeys"]:
+                for label in labels:
+                    self._add_label(self._key(key), label["name"])
+            with self._lock:
+                self._bulk_tasks += 1
+                task_id = str(self._bulk_tasks)
+            return 201, {"taskId": task_id}
+
+        if path.startswith("/rest/api/3/bulk/queue/"):
+            return 200, {"status": "COMPLETE", "failedAccessibleIssues": {}}
+
+        return 404, {"errorMessages": [f"no {method} {path}"]}
+
+
+class FakeSlack(FakeService):
+    """
+    Slack incoming webhook stand-in. Pass its url as release_notes' slack_webhook_url.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages: List[str] = []
+        # time.perf_counter() when each message arrived
+        self.posted_at: List[float] = []
+
+    def handle(self, method, path, query, body):
+        with self._lock:
+            self.messages.append((body or {}).get("text", ""))
+            self.posted_at.append(time.perf_counter())
+        return 200, "ok"
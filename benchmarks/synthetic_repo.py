@@ -0,0 +1,104 @@
+import subprocess
+from typing import Tuple
+
+
+def make_repo(
+    repo_dir: str,
+    num_commits: int,
+    body_lines: int = 10,
+    cherry_pick_every: int = 20,
+    merge_every: int = 0,
+    commits_per_pr: int = 0,
+) -> Tuple[str, str]:
+    """
+    Creates a git repo with num_commits commits on master using git fast-import, which is much faster than
+    committing one by one. Every cherry_pick_every'th commit has a cherry-pick trailer, and every merge_every'th
+    commit (if set) is a "Merge pull request #N" merge of a side branch commit.
+    If commits_per_pr is set, the other commits have squash merge subjects, "Commit i (#N)" for the i'th commit,
+    with a new N every commits_per_pr commits.
+
+    :return: (first commit sha, last commit sha)
+    """
+    subprocess.check_call(["git", "init", "-q", repo_dir])
+    subprocess.check_call(
+        ["git", "-C", repo_dir, "config", "user.email", "bench@example.com"]
+    )
+    subprocess.check_call(["git", "-C", repo_dir, "config", "user.name", "bench"])
+
+    body = "\n".join(
+        f"Some detail about the change, line {line}" for line in range(body_lines)
+    )
+    commands = []
+    mark = 0
+    master_mark = None
+    pr_number = 0
+    for i in range(num_commits):
+        subject = f"Commit {i}"
+        if commits_per_pr:
+            subject += f" (#{i // commits_per_pr + 1})"
+        message = f"{subject}\n\n{body}\n"
+        if cherry_pick_every and i % cherry_pick_every == 0:
+            message += f"\n(cherry picked from commit {i:040x})\n"
+
+        side_mark = None
+        if merge_every and i and i % merge_every == 0:
+            pr_number += 1
+            mark += 1
+            side_mark = mark
+            commands.append(
+                _commit(
+                    "refs/heads/side",
+                    side_mark,
+                    f"Change for PR {pr_number}\n",
+                    i,
+                    master_mark,
+                )
+            )
+            message = f"Merge pull request #{pr_number} from org/branch-{pr_number}\n\n{body}\n"
+
+        mark += 1
+        commands.append(
+            _commit("refs/heads/master", mark, message, i, master_mark, side_mark)
+        )
+        master_mark = mark
+
+    subprocess.run(
+        ["git", "-C", repo_dir, "fast-import", "--quiet"],
+        input="".join(commands).encode("utf-8"),
+        check=True,
+    )
+    subprocess.check_call(["git", "-C", repo_dir, "checkout", "-q", "master"])
+
+    first_sha = (
+        subprocess.check_output(
+            ["git", "-C", repo_dir, "rev-list", "--max-parents=0", "master"]
+        )
+        .decode()
+        .split()[0]
+    )
+    last_sha = (
+        subprocess.check_output(["git", "-C", repo_dir, "rev-parse", "master"])
+        .decode()
+        .strip()
+    )
+    return first_sha, last_sha
+
+
+def _commit(ref, mark, message, i, parent_mark=None, merge_mark=None) -> str:
+    data = message.encode("utf-8")
+    lines = [
+        f"commit {ref}",
+        f"mark :{mark}",
+        f"committer bench <bench@example.com> {1500000000 + i} +0000",
+        f"data {len(data)}",
+        message,
+    ]
+    if parent_mark:
+        lines.append(f"from :{parent_mark}")
+    if merge_mark:
+        lines.append(f"merge :{merge_mark}")
+    lines.append(f"M 644 inline file{i % 100}.txt")
+    content = f"{i}\n"
+    lines.append(f"data {len(content)}")
+    lines.append(content)
+    return "\n".join(lines) + "\n"
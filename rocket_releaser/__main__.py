@@ -2,4 +2,9 @@ from sys import argv
 from .release_notes import main
 
 if __name__ == "__main__":
-    main(argv[1:])
+    if argv[1:2] == ["serve"]:
+        from .server import main as serve
+
+        serve(argv[2:])
+    else:
+        main(argv[1:])
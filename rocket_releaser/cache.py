@@ -0,0 +1,232 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from os import makedirs, path
+from typing import Dict, List, Optional, Sequence
+
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+class Cache:
+    """
+    sqlite backed cache that survives between runs, so deploying the same SHAs to preview, staging & prod
+    only asks GitHub about them once.
+    """
+
+    FILE_NAME = "rocket_releaser.sqlite3"
+
+    def __init__(
+        self,
+        cache_dir: Optional[str],
+        sha_ttl: float = 7 * DAY,
+        pr_ttl: float = DAY,
+        transition_ttl: float = 7 * DAY,
+    ):
+        """
+        :param cache_dir: directory to keep the cache file in. Created if it doesn't exist.
+            None keeps the cache in memory for as long as this Cache is open, ex: in a long running server.
+        :param sha_ttl: seconds before a SHA's associated PR numbers are looked up again
+        :param pr_ttl: seconds before a PR's payload (title/body/merged) is considered stale
+        :param transition_ttl: seconds before a Jira workflow status's transitions are looked up again
+        """
+        if cache_dir is None:
+            self.file_path = ":memory:"
+        else:
+            makedirs(cache_dir, exist_ok=True)
+            self.file_path = path.join(cache_dir, self.FILE_NAME)
+        self.sha_ttl = sha_ttl
+        self.pr_ttl = pr_ttl
+        self.transition_ttl = transition_ttl
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS shas ("
+                "owner TEXT, repo TEXT, sha TEXT, pr_numbers TEXT, fetched_at REAL, "
+                "PRIMARY KEY (owner, repo, sha))"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS prs ("
+                "owner TEXT, repo TEXT, number INTEGER, payload TEXT, fetched_at REAL, "
+                "PRIMARY KEY (owner, repo, number))"
+            )
+            # transitions cached before they were keyed by Jira server could belong to any server
+            self._connection.execute("DROP TABLE IF EXISTS transitions")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jira_transitions ("
+                "server TEXT, project TEXT, workflow TEXT, status TEXT, transitions TEXT, fetched_at REAL, "
+                "PRIMARY KEY (server, project, workflow, status))"
+            )
+        self.evict()
+
+    def close(self):
+        self._connection.close()
+
+    def evict(self):
+        """deletes everything older than its ttl"""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM shas WHERE fetched_at < ?", (now - self.sha_ttl,)
+            )
+            self._connection.execute(
+                "DELETE FROM prs WHERE fetched_at < ?", (now - self.pr_ttl,)
+            )
+            self._connection.execute(
+                "DELETE FROM jira_transitions WHERE fetched_at < ?",
+                (now - self.transition_ttl,),
+            )
+
+    def get_associated_prs(
+        self, owner: str, repo: str, shas: List[str], fields: Sequence[str] = ()
+    ) -> Dict[str, List[dict]]:
+        """
+        :param fields: PR fields the caller needs. PR's cached without one of them count as missing.
+        :return: dict mapping sha to its PR payloads, for shas where the sha and all its PR's are fresh
+        """
+        now = time.time()
+        associated_prs = {}
+
+        with self._lock:
+            for sha in shas:
+                row = self._connection.execute(
+                    "SELECT pr_numbers FROM shas WHERE owner = ? AND repo = ? AND sha = ? AND fetched_at >= ?",
+                    (owner, repo, sha, now - self.sha_ttl),
+                ).fetchone()
+                if row is None:
+                    continue
+
+                prs = []
+                for number in json.loads(row[0]):
+                    pr = self._get_pr(owner, repo, number, fields, now)
+                    if pr is None:
+                        break
+                    prs.append(pr)
+                else:
+                    associated_prs[sha] = prs
+
+        logger.debug(f"cache hit for {len(associated_prs)} of {len(shas)} shas")
+        stats.record_cache_lookup(
+            "associated_prs", len(associated_prs), len(shas) - len(associated_prs)
+        )
+        return associated_prs
+
+    def set_associated_prs(
+        self, owner: str, repo: str, associated_prs: Dict[str, List[dict]]
+    ):
+        """
+        :param associated_prs: dict mapping sha to its PR payloads
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            for sha, prs in associated_prs.items():
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO shas VALUES (?, ?, ?, ?, ?)",
+                    (owner, repo, sha, json.dumps([pr["number"] for pr in prs]), now),
+                )
+                self._set_prs(owner, repo, prs, now)
+
+    def get_pull_requests(
+        self, owner: str, repo: str, numbers: List[int], fields: Sequence[str] = ()
+    ) -> Dict[int, dict]:
+        """
+        :param fields: see get_associated_prs
+        :return: dict mapping PR number to its payload, for the numbers whose payload is fresh
+        """
+        now = time.time()
+        pull_requests = {}
+        with self._lock:
+            for number in numbers:
+                pr = self._get_pr(owner, repo, number, fields, now)
+                if pr is not None:
+                    pull_requests[number] = pr
+
+        stats.record_cache_lookup(
+            "pull_requests", len(pull_requests), len(numbers) - len(pull_requests)
+        )
+        return pull_requests
+
+    def set_pull_requests(self, owner: str, repo: str, pull_requests: List[dict]):
+        """
+        :param pull_requests: PR payloads, each with a "number"
+        """
+        with self._lock, self._connection:
+            self._set_prs(owner, repo, pull_requests, time.time())
+
+    def _get_pr(
+        self, owner: str, repo: str, number: int, fields: Sequence[str], now: float
+    ) -> Optional[dict]:
+        row = self._connection.execute(
+            "SELECT payload FROM prs WHERE owner = ? AND repo = ? AND number = ? AND fetched_at >= ?",
+            (owner, repo, number, now - self.pr_ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        pr = json.loads(row[0])
+        return pr if all(field in pr for field in fields) else None
+
+    def _set_prs(self, owner: str, repo: str, prs: List[dict], now: float):
+        for pr in prs:
+            # payloads may only have some fields (ex: a first pass without bodies),
+            # so fresh fields already cached are kept. The payload is as old as its oldest field.
+            fetched_at = now
+            row = self._connection.execute(
+                "SELECT payload, fetched_at FROM prs WHERE owner = ? AND repo = ? AND number = ? AND fetched_at >= ?",
+                (owner, repo, pr["number"], now - self.pr_ttl),
+            ).fetchone()
+            if row is not None and set(json.loads(row[0])) - set(pr):
+                pr = dict(json.loads(row[0]), **pr)
+                fetched_at = row[1]
+            self._connection.execute(
+                "INSERT OR REPLACE INTO prs VALUES (?, ?, ?, ?, ?)",
+                (owner, repo, pr["number"], json.dumps(pr), fetched_at),
+            )
+
+    def get_transitions(
+        self, server: str, project: str, workflow: str, status: str
+    ) -> Optional[Dict[str, dict]]:
+        """
+        :param server: url of the Jira server project is on, as projects on different servers can share keys
+        :return: the transitions out of status, as stored by set_transitions, or None if they aren't fresh
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT transitions FROM jira_transitions WHERE server = ? AND project = ? AND workflow = ? "
+                "AND status = ? AND fetched_at >= ?",
+                (server, project, workflow, status, time.time() - self.transition_ttl),
+            ).fetchone()
+        stats.record_cache_lookup("jira_transitions", int(bool(row)), int(not row))
+        return json.loads(row[0]) if row else None
+
+    def set_transitions(
+        self,
+        server: str,
+        project: str,
+        workflow: str,
+        status: str,
+        transitions: Dict[str, dict],
+    ):
+        """
+        :param server: url of the Jira server project is on
+        :param transitions: dict mapping transition name to {"id": transition id, "to": status name}
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO jira_transitions VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    server,
+                    project,
+                    workflow,
+                    status,
+                    json.dumps(transitions),
+                    time.time(),
+                ),
+            )
@@ -1,9 +1,16 @@
 import re
 import logging
-from typing import List
+from typing import Dict, List
 
 logger = logging.getLogger(__name__)
 
+# matches HTML comments. Will not work in all cases.
+HTML_COMMENT_RE = re.compile("<!--.+?>", flags=re.DOTALL)
+JIRA_ID_RE = re.compile(r"\[(\w+-\d+)\]")
+
+# states of each block while parse_body scans a body
+NOT_STARTED, COLLECTING, DONE = range(3)
+
 
 class ChangeLog:
     def __init__(
@@ -24,7 +31,7 @@ class ChangeLog:
         return [
             (pr.get("number"), pr.get("body"))
             for pr in self.pull_request_dicts
-            if "release" in pr.get("body").lower()
+            if "release" in (pr.get("body") or "").lower()
         ]
 
     @staticmethod
@@ -42,8 +49,7 @@ class ChangeLog:
 
     @staticmethod
     def add_jira_link(line: str, jira_url: str):
-        return re.sub(
-            r"\[(\w+-\d+)\]",
+        return JIRA_ID_RE.sub(
             lambda match: f"<{jira_url}/browse/{match.group(1)}|{match.group(1)}>",
             line,
         )
@@ -61,84 +67,89 @@ class ChangeLog:
     def make_jira_id_bold(line: str):
         return line.replace("[", "*[").replace("]", "]*")
 
-    def parse_bodies(self):
-        for pr_number, body in self.release_bodies:
-            # Remove HTML comments. Will not work in all cases.
-            lines = re.sub("<!--.+?>", "", body, flags=re.DOTALL)
-            lines = lines.strip().split("\n")
-            # Clean lines up
-            lines = list(map(lambda line_: line_.strip().lstrip("-").strip(), lines))
-
-            fixes = ""
-            noteworthy = ""
-            features = ""
-            collecting_releases = False
-            for line in lines:
-                if collecting_releases and not line:
+    @staticmethod
+    def parse_body(body: str) -> Dict[str, str]:
+        """
+        pulls the RELEASES & QA blocks out of a PR body in a single scan.
+        Each block starts after the first line starting with its header and ends at the next blank line.
+
+        :return: dict mapping "fixes", "noteworthy", "features" & "qa_notes" to their lines, each preceded by a space.
+            Sections without lines are left out.
+        """
+        fixes: List[str] = []
+        noteworthy: List[str] = []
+        features: List[str] = []
+        qa_notes: List[str] = []
+        releases_state = qa_state = NOT_STARTED
+
+        if "<!--" in body:
+            body = HTML_COMMENT_RE.sub("", body)
+
+        for line in body.strip().split("\n"):
+            line = line.strip().lstrip("-").strip()
+            lowered = line.lower()
+
+            if releases_state == COLLECTING:
+                if not line:
                     # No more lines in RELEASES block
-                    break
-
-                if collecting_releases:
-                    if self.is_fix(line):
-                        fixes = fixes + " " + line
-                    elif self.is_noteworthy(line):
-                        line = self.make_jira_id_bold(line)
-                        noteworthy = noteworthy + " " + line
-                    else:
-                        features = features + " " + line
-
-                if not collecting_releases and line.lower().startswith("release"):
-                    collecting_releases = True
-
-            if fixes:
-                self.fixes.append(
-                    self.linkify(
-                        self.org_name, self.repo_name, fixes, pr_number, self.jira_url
-                    )
-                )
-            if noteworthy:
-                self.noteworthy.append(
-                    self.linkify(
-                        self.org_name,
-                        self.repo_name,
-                        noteworthy,
-                        pr_number,
-                        self.jira_url,
-                    )
-                )
-            if features:
-                self.features.append(
-                    self.linkify(
-                        self.org_name,
-                        self.repo_name,
-                        features,
-                        pr_number,
-                        self.jira_url,
-                    )
-                )
-
-            qa_notes = ""
-            collecting_qa_notes = False
-            for line in lines:
-                if collecting_qa_notes and not line:
+                    releases_state = DONE
+                elif lowered.startswith("fix") or "fixes [" in lowered:
+                    fixes.append(line)
+                elif "[" in line:
+                    noteworthy.append(ChangeLog.make_jira_id_bold(line))
+                else:
+                    features.append(line)
+            elif releases_state == NOT_STARTED and lowered.startswith("release"):
+                releases_state = COLLECTING
+
+            if qa_state == COLLECTING:
+                if not line:
                     # No more lines in QA block
-                    break
+                    qa_state = DONE
+                else:
+                    qa_notes.append(line)
+            elif qa_state == NOT_STARTED and lowered.startswith("qa"):
+                qa_state = COLLECTING
+
+            if releases_state == DONE and qa_state == DONE:
+                break
+
+        sections = {
+            "fixes": fixes,
+            "noteworthy": noteworthy,
+            "features": features,
+            "qa_notes": qa_notes,
+        }
+        return {
+            name: " " + " ".join(lines) for name, lines in sections.items() if lines
+        }
 
-                if collecting_qa_notes:
-                    qa_notes = qa_notes + " " + line
+    def parse_bodies(self):
+        for pr_number, body in self.release_bodies:
+            self._add_body(pr_number, body)
 
-                if not collecting_qa_notes and line.lower().startswith("qa"):
-                    collecting_qa_notes = True
+        return self
 
-            if qa_notes:
-                self.qa_notes.append(
+    def add_pull_request(self, pr: dict):
+        """
+        adds pr & parses its body right away, so a changelog can be built from PR's as they are found.
+        Use instead of parse_bodies, not in addition to it.
+        """
+        self.pull_request_dicts.append(pr)
+        # PR's fetched without bodies (see prs.PR_FIELD_PROFILES) have no release notes
+        if "release" in (pr.get("body") or "").lower():
+            self._add_body(pr.get("number"), pr.get("body"))
+
+    def _add_body(self, pr_number, body: str):
+        sections = self.parse_body(body)
+        for name in ("fixes", "noteworthy", "features", "qa_notes"):
+            if name in sections:
+                getattr(self, name).append(
                     self.linkify(
                         self.org_name,
                         self.repo_name,
-                        qa_notes,
+                        sections[name],
                         pr_number,
                         self.jira_url,
                     )
                 )
-
-        return self
@@ -0,0 +1,46 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def concurrent_map(
+    func: Callable[[T], R], items: Iterable[T], max_concurrency: int = 1
+) -> List[R]:
+    """
+    like map() but runs func in up to max_concurrency threads.
+    Results are returned in the same order as items.
+    If func raises, the first exception (in item order) is raised.
+    """
+    items = list(items)
+
+    if max_concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as executor:
+        return list(executor.map(func, items))
+
+
+def concurrent_imap(
+    func: Callable[[T], R], items: Iterable[T], max_concurrency: int = 1
+) -> Iterator[R]:
+    """
+    lazy concurrent_map. items is read as results are consumed, with up to max_concurrency calls in flight,
+    so a slow producer of items overlaps with func.
+    Results are yielded in the same order as items.
+    """
+    if max_concurrency <= 1:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = deque()
+        for item in items:
+            in_flight.append(executor.submit(func, item))
+            if len(in_flight) >= max_concurrency:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
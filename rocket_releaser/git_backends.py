@@ -0,0 +1,478 @@
+import asyncio
+import logging
+import re
+import subprocess
+import threading
+import time
+from os import path
+from typing import AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+
+def stream_process(args: List[str], delimiter: bytes = b"\n") -> Iterator[bytes]:
+    """
+    runs args, yielding stdout split by delimiter as it is read.
+    Failures are logged instead of raised.
+    """
+    # only time spent waiting on git counts towards its stats, not time spent by whoever consumes the records
+    seconds = 0.0
+    start = time.perf_counter()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with process:
+        for record in _split_records(process.stdout, delimiter):
+            seconds += time.perf_counter() - start
+            yield record
+            start = time.perf_counter()
+        stderr = process.stderr.read().decode("utf-8", "replace")
+    stats.record_git_command(args, seconds + time.perf_counter() - start)
+
+    if process.returncode:
+        logger.error(
+            f"subprocess call failed with code {process.returncode}: {args}\n{stderr}"
+        )
+
+
+def _split_records(stream, delimiter: bytes) -> Iterator[bytes]:
+    if delimiter == b"\n":
+        yield from stream
+        return
+
+    remainder = b""
+    for chunk in iter(lambda: stream.read(64 * 1024), b""):
+        records = (remainder + chunk).split(delimiter)
+        remainder = records.pop()
+        yield from records
+    if remainder.strip():
+        yield remainder
+
+
+async def async_stream_process(
+    args: List[str], delimiter: bytes = b"\n"
+) -> AsyncIterator[List[bytes]]:
+    """
+    like stream_process, with a process run by the running event loop.
+    Yields the records each read of stdout completes, as lists without the delimiters.
+    """
+    seconds = 0.0
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    try:
+        remainder = b""
+        while True:
+            chunk = await process.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            records = (remainder + chunk).split(delimiter)
+            remainder = records.pop()
+            if records:
+                seconds += time.perf_counter() - start
+                yield records
+                start = time.perf_counter()
+        if remainder.strip():
+            yield [remainder]
+        stderr = (await process.stderr.read()).decode("utf-8", "replace")
+        await process.wait()
+    finally:
+        # the consumer stopped early
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    stats.record_git_command(args, seconds + time.perf_counter() - start)
+
+    if process.returncode:
+        logger.error(
+            f"subprocess call failed with code {process.returncode}: {args}\n{stderr}"
+        )
+
+
+async def _next_records(records: AsyncIterator[List[bytes]]) -> Optional[List[bytes]]:
+    try:
+        return await records.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+class SubprocessGitBackend:
+    """
+    Runs a new git process for every call. The default backend.
+
+    A git backend answers the questions SHAs & branch_exists have about a repo.
+    Other backends keep a handle on the repo open so many queries against one repo are cheaper.
+    """
+
+    def __init__(self, repo_dir: str):
+        self.repo_dir = repo_dir
+        self.base_args = [
+            "git",
+            f'--git-dir={path.join(repo_dir, ".git")}',
+            f"--work-tree={repo_dir}",
+        ]
+
+    def close(self):
+        pass
+
+    def branch_exists(self, branch_name: str) -> bool:
+        args = self.base_args + [
+            "show-ref",
+            "--verify",
+            "--quiet",
+            "refs/heads/" + branch_name,
+        ]
+        try:
+            with stats.git_command(args):
+                subprocess.check_call(args)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def fetch(self, branch: str, extra_args: Sequence[str] = ()):
+        """
+        :param extra_args: extra git fetch options, ex: ["--deepen=50"]
+        :raises subprocess.CalledProcessError: if the fetch fails
+        """
+        fetch_args = (
+            self.base_args
+            + ["fetch"]
+            + list(extra_args)
+            + ["--update-head-ok", "--end-of-options", "origin", f"{branch}:{branch}"]
+        )
+        with stats.git_command(fetch_args):
+            subprocess.check_output(fetch_args)
+        logger.debug(f"Pulled branch with the following args: {fetch_args}")
+
+    def revision_exists(self, revision: str) -> bool:
+        """whether revision resolves to a commit that is in the local repo"""
+        args = self.base_args + [
+            "cat-file",
+            "-e",
+            "--end-of-options",
+            revision + "^{commit}",
+        ]
+        try:
+            with stats.git_command(args):
+                subprocess.check_call(args, stderr=subprocess.DEVNULL)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def is_shallow(self) -> bool:
+        return path.isfile(path.join(self.repo_dir, ".git", "shallow"))
+
+    def merge_base(self, revision_a: str, revision_b: str) -> Optional[str]:
+        """
+        :return: best common ancestor of the revisions, or None if there isn't one in the local repo
+        """
+        args = self.base_args + [
+            "merge-base",
+            "--end-of-options",
+            revision_a,
+            revision_b,
+        ]
+        try:
+            with stats.git_command(args):
+                return (
+                    subprocess.check_output(args, stderr=subprocess.DEVNULL)
+                    .decode("utf-8")
+                    .strip()
+                )
+        except subprocess.CalledProcessError:
+            return None
+
+    def _stream(self, args: List[str], delimiter: bytes = b"\n") -> Iterator[bytes]:
+        return stream_process(args, delimiter)
+
+    def rev_list(self, revision_range: str) -> Iterator[str]:
+        """yields the SHAs in revision_range, in git rev-list order"""
+        for line in self._stream(
+            self.base_args + ["rev-list", "--end-of-options", revision_range]
+        ):
+            yield line.decode("utf-8").strip()
+
+    def commit_messages(
+        self, revision_range: str, grep: Sequence[str] = ()
+    ) -> Iterator[Tuple[str, str]]:
+        """
+        yields (sha, raw message) for the commits in revision_range, in git rev-list order
+
+        :param grep: extended regexes. If passed, backends may skip commits without a message line matching one.
+        """
+        rev_list_args = self.base_args + [
+            "rev-list",
+            # raw body (unwrapped subject and body) https://git-scm.com/docs/git-rev-list
+            # with a NUL after each body so bodies can be told apart from the "commit <sha>" headers
+            "--format=%B%x00",
+        ]
+        if grep:
+            rev_list_args.append("--extended-regexp")
+            rev_list_args.extend(f"--grep={pattern}" for pattern in grep)
+        # revisions can't be taken for options
+        rev_list_args += ["--end-of-options", revision_range]
+
+        for record in self._stream(rev_list_args, delimiter=b"\0"):
+            record = record.decode("utf-8", "replace").lstrip("\n")
+            header, _, message = record.partition("\n")
+            yield header[len("commit ") :], message
+
+    def topo_commits(self, revision_range: str) -> Iterator[Tuple[str, List[str], str]]:
+        """
+        yields (sha, parent shas, raw message) for the commits in revision_range,
+        in topological order: every commit comes before its parents
+        """
+        rev_list_args = self.base_args + [
+            "rev-list",
+            "--topo-order",
+            "--format=%P%n%B%x00",
+            "--end-of-options",
+            revision_range,
+        ]
+        for record in self._stream(rev_list_args, delimiter=b"\0"):
+            record = record.decode("utf-8", "replace").lstrip("\n")
+            header, _, rest = record.partition("\n")
+            parents, _, message = rest.partition("\n")
+            yield header[len("commit ") :], parents.split(), message
+
+
+class AsyncioGitBackend(SubprocessGitBackend):
+    """
+    Walks history with git processes run by an asyncio event loop, see release_notes.async_release_notes.
+    Its methods are called from threads other than the loop's, which get git's output as the loop reads it.
+    Ref lookups & fetches still run git directly.
+    """
+
+    def __init__(self, repo_dir: str, loop: asyncio.AbstractEventLoop):
+        super().__init__(repo_dir)
+        self.loop = loop
+
+    def _stream(self, args: List[str], delimiter: bytes = b"\n") -> Iterator[bytes]:
+        reads = async_stream_process(args, delimiter)
+        try:
+            while True:
+                records = asyncio.run_coroutine_threadsafe(
+                    _next_records(reads), self.loop
+                ).result()
+                if records is None:
+                    return
+                yield from records
+        finally:
+            asyncio.run_coroutine_threadsafe(reads.aclose(), self.loop).result()
+
+
+# whitespace & control characters, which no ref or revision can hold
+_UNSAFE_OBJECT_NAME = re.compile(r"[\s\x00-\x1f\x7f]")
+_BATCH_FORMAT = "%(objectname) %(objecttype) %(objectsize) %(rest)"
+_OUT_OF_SYNC = object()
+
+
+class CatFileGitBackend(SubprocessGitBackend):
+    """
+    Keeps a single `git cat-file --batch` process open for looking up refs & commits,
+    so repeated queries against the same repo don't fork git every time.
+    Walking history still goes through a streamed rev-list.
+    """
+
+    def __init__(self, repo_dir: str):
+        super().__init__(repo_dir)
+        self._batch: Optional[subprocess.Popen] = None
+        self._request_id = 0
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            if self._batch:
+                self._batch.stdin.close()
+                self._batch.wait()
+                self._batch.stdout.close()
+                self._batch = None
+
+    def _kill_batch(self):
+        self._batch.kill()
+        self._batch.wait()
+        self._batch.stdin.close()
+        self._batch.stdout.close()
+        self._batch = None
+
+    def cat_file(self, object_name: str) -> Optional[Tuple[str, str, bytes]]:
+        """
+        :return: (sha, object type, contents), or None if object_name doesn't exist
+        """
+        # cat-file reads a request per line, so whitespace would split one request into several
+        # and every answer after it would go to the wrong request
+        if not object_name or _UNSAFE_OBJECT_NAME.search(object_name):
+            return None
+
+        with self._lock, stats.git_command(["cat-file", "--batch", object_name]):
+            for _ in range(2):
+                found = self._request(object_name)
+                if found is not _OUT_OF_SYNC:
+                    return found
+                logger.warning(
+                    f"git cat-file answered another request than {object_name!r}, restarting it"
+                )
+                self._kill_batch()
+            return None
+
+    def _request(self, object_name: str):
+        """
+        :return: cat_file's answer, or _OUT_OF_SYNC if the answer doesn't match object_name
+        """
+        if self._batch is None or self._batch.poll() is not None:
+            self._batch = subprocess.Popen(
+                self.base_args + ["cat-file", f"--batch={_BATCH_FORMAT}"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            self._request_id = 0
+
+        # git echoes back whatever follows the object name, tying the answer to its request
+        self._request_id += 1
+        request_id = str(self._request_id)
+        self._batch.stdin.write(f"{object_name} {request_id}\n".encode("utf-8"))
+        self._batch.stdin.flush()
+
+        header = self._batch.stdout.readline().decode("utf-8", "replace").split()
+        if header in ([object_name, "missing"], [object_name, "ambiguous"]):
+            return None
+        if len(header) != 4 or header[-1] != request_id:
+            return _OUT_OF_SYNC
+
+        sha, object_type, size, _ = header
+        contents = self._batch.stdout.read(int(size))
+        self._batch.stdout.read(1)  # newline after contents
+        return sha, object_type, contents
+
+    def branch_exists(self, branch_name: str) -> bool:
+        return self.cat_file("refs/heads/" + branch_name) is not None
+
+    def revision_exists(self, revision: str) -> bool:
+        return self.cat_file(revision + "^{commit}") is not None
+
+    def commit_message(self, revision: str) -> Optional[str]:
+        found = self.cat_file(revision + "^{commit}")
+        if found is None:
+            return None
+        # commit objects are headers, a blank line, then the raw message
+        return found[2].decode("utf-8", "replace").partition("\n\n")[2]
+
+
+class Pygit2GitBackend:
+    """
+    Reads the repo in-process with libgit2, so no git processes are forked at all except to fetch.
+    Needs `pip install pygit2`.
+
+    Unlike git rev-list, only a single merge base is hidden when walking a from...to range,
+    and commits come out sorted by time rather than in git's exact order.
+    """
+
+    def __init__(self, repo_dir: str):
+        try:
+            import pygit2
+        except ImportError:
+            raise ImportError(
+                "the pygit2 git backend needs pygit2 installed: pip install pygit2"
+            )
+
+        self.pygit2 = pygit2
+        self.repo = pygit2.Repository(repo_dir)
+        # pygit2 needs credential callbacks to fetch, git already has them set up
+        self._fetcher = SubprocessGitBackend(repo_dir)
+
+    def close(self):
+        self.repo.free()
+
+    def branch_exists(self, branch_name: str) -> bool:
+        try:
+            return self.repo.lookup_branch(branch_name) is not None
+        except ValueError:
+            # invalid branch name
+            return False
+
+    def fetch(self, branch: str, extra_args: Sequence[str] = ()):
+        self._fetcher.fetch(branch, extra_args)
+
+    def _resolve(self, revision: str):
+        return self.repo.revparse_single(revision).peel(self.pygit2.Commit).id
+
+    def revision_exists(self, revision: str) -> bool:
+        try:
+            self._resolve(revision)
+            return True
+        except (KeyError, ValueError):
+            return False
+
+    def is_shallow(self) -> bool:
+        return self.repo.is_shallow
+
+    def merge_base(self, revision_a: str, revision_b: str) -> Optional[str]:
+        try:
+            merge_base = self.repo.merge_base(
+                self._resolve(revision_a), self._resolve(revision_b)
+            )
+        except (KeyError, ValueError):
+            return None
+        return str(merge_base) if merge_base else None
+
+    def _walk(self, revision_range: str, sort=None):
+        from_revision, to_revision = revision_range.split("...")
+        try:
+            from_id = self._resolve(from_revision)
+            to_id = self._resolve(to_revision)
+        except (KeyError, ValueError):
+            logger.error(f"could not resolve {revision_range}")
+            return
+
+        walker = self.repo.walk(
+            to_id, self.pygit2.GIT_SORT_TIME if sort is None else sort
+        )
+        walker.push(from_id)
+        merge_base = self.repo.merge_base(from_id, to_id)
+        if merge_base:
+            walker.hide(merge_base)
+        yield from walker
+
+    def rev_list(self, revision_range: str) -> Iterator[str]:
+        for commit in self._walk(revision_range):
+            yield str(commit.id)
+
+    def commit_messages(
+        self, revision_range: str, grep: Sequence[str] = ()
+    ) -> Iterator[Tuple[str, str]]:
+        # grep is only a hint. Every message is in memory already so there is nothing to save by filtering
+        for commit in self._walk(revision_range):
+            yield str(commit.id), commit.message
+
+    def topo_commits(self, revision_range: str) -> Iterator[Tuple[str, List[str], str]]:
+        for commit in self._walk(revision_range, self.pygit2.GIT_SORT_TOPOLOGICAL):
+            yield str(commit.id), [
+                str(parent) for parent in commit.parent_ids
+            ], commit.message
+
+    def commit_message(self, revision: str) -> Optional[str]:
+        try:
+            return self.repo[self._resolve(revision)].message
+        except (KeyError, ValueError):
+            return None
+
+
+GIT_BACKENDS = {
+    "subprocess": SubprocessGitBackend,
+    "cat-file": CatFileGitBackend,
+    "pygit2": Pygit2GitBackend,
+}
+
+
+def make_git_backend(name: str, repo_dir: str):
+    """
+    :param name: one of GIT_BACKENDS
+    """
+    try:
+        backend_class = GIT_BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"unknown git backend {name}. Choose from {', '.join(GIT_BACKENDS)}"
+        )
+    return backend_class(repo_dir)
@@ -1,27 +1,201 @@
-import requests
+import logging
+import re
+import time
+from typing import Optional, Sequence
+from urllib.parse import urlparse
+
+from . import stats
+from .lazy import LazyModule
+from .rate_limit import RateLimiter, rate_limited_wait_seconds
+
+logger = logging.getLogger(__name__)
+
+requests = LazyModule("requests")
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+
+OPERATION_NAME_RE = re.compile(r"^\s*(?:query|mutation)\s+(\w+)")
+
+
+def github_graphql_url(github_url: str = "") -> str:
+    """
+    :param github_url: url of a GitHub Enterprise server (or a stand-in for one), ex: https://github.company.com.
+        github.com if empty.
+    """
+    if not github_url:
+        return GITHUB_GRAPHQL_URL
+    return github_url.rstrip("/") + "/api/graphql"
 
 
 class BadReturnStatus(Exception):
-    pass
+    def __init__(self, message: str = "", status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
 
 
 class GraphQL:
-    def __init__(self, base_api_uri, token: str = ""):
+    def __init__(
+        self,
+        base_api_uri,
+        token: str = "",
+        max_rate_limit_retries: int = 3,
+        rate_limit_wait: float = 60,
+        pool_size: int = 10,
+        timeout: float = 30,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        rate_limiter: RateLimiter = None,
+    ):
+        """
+        Keeps a pooled keep-alive session, so queries after the first don't pay for a new TCP & TLS handshake.
+
+        :param max_rate_limit_retries: how many times to retry a query that was rate limited
+        :param rate_limit_wait: seconds to wait on a secondary rate limit that didn't say how long to wait.
+            Doubles on every retry.
+        :param pool_size: max number of connections kept open per host
+        :param timeout: seconds to wait for GitHub to connect or respond
+        :param max_retries: how many times to retry a query on a 5xx status or connection error
+        :param retry_backoff: seconds to wait before the first 5xx/connection error retry. Doubles on every retry.
+        :param rate_limiter: GitHub rate limit budgets to share with other GitHub clients. A new one is made if not passed in.
+        """
         self.base_api_uri = base_api_uri
         self.headers = {"Authorization": "Bearer " + token}
+        self.max_rate_limit_retries = max_rate_limit_retries
+        self.rate_limit_wait = rate_limit_wait
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.rate_limiter = rate_limiter or RateLimiter()
 
-    def run_query(self, query, variables={}):
-        request = requests.post(
-            self.base_api_uri,
-            json={"query": query, "variables": variables},
-            headers=self.headers,
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
         )
+        self.session = requests.Session()
+        self.share_connection_pool(self.session)
+        stats.instrument_session(self.session, "github_graphql")
+        self.rate_limiter.instrument_session(self.session, "graphql")
 
-        if request.status_code == 200:
-            return request.json()
+    def share_connection_pool(self, session: "requests.Session"):
+        """
+        makes session use this client's connection pool for requests to the same host,
+        ex: the session of a github3.GitHub client.
+        """
+        base_uri = urlparse(self.base_api_uri)
+        if base_uri.scheme and base_uri.netloc:
+            session.mount(f"{base_uri.scheme}://{base_uri.netloc}", self.adapter)
         else:
-            raise BadReturnStatus(
-                "Query failed to run by returning code of {}. {}".format(
-                    request.status_code, query
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+
+    def close(self):
+        self.session.close()
+
+    def run_query(self, query, variables={}, no_retry_statuses: Sequence[int] = ()):
+        """
+        runs query once the rate limiter says there is budget for it.
+        Queries asking for rateLimit { cost limit remaining resetAt } keep the rate limiter's budget up to date.
+
+        :param no_retry_statuses: 5xx statuses to raise BadReturnStatus for right away instead of retrying,
+            ex: the 502/504 a query too heavy to ever answer gets, for callers that split it up instead
+        """
+        match = OPERATION_NAME_RE.match(query)
+        operation = match.group(1) if match else ""
+        rate_limit_retries = 0
+        server_error_retries = 0
+
+        while True:
+            self.rate_limiter.wait("graphql", self.rate_limiter.cost(operation))
+            try:
+                request = self.session.post(
+                    self.base_api_uri,
+                    json={"query": query, "variables": variables},
+                    headers=self.headers,
+                    timeout=self.timeout,
+                )
+            except requests.exceptions.ConnectionError:
+                if server_error_retries == self.max_retries:
+                    raise
+                self._wait_for_retry(server_error_retries, "connection error")
+                server_error_retries += 1
+                continue
+
+            if request.status_code == 200:
+                result = request.json()
+                data = result.get("data") if isinstance(result, dict) else None
+                if isinstance(data, dict) and data.get("rateLimit"):
+                    self.rate_limiter.update_from_graphql(operation, data["rateLimit"])
+
+                # GraphQL's primary rate limit comes back as a 200 with a RATE_LIMITED error
+                wait = self.graphql_rate_limit_wait_seconds(
+                    request, result, rate_limit_retries
+                )
+                if wait is None or rate_limit_retries == self.max_rate_limit_retries:
+                    return result
+                logger.warning(
+                    f"rate limited by GitHub (RATE_LIMITED error), retrying in {wait:.1f}s"
+                )
+                self.rate_limiter.rate_limited(wait)
+                rate_limit_retries += 1
+                continue
+
+            if (
+                request.status_code >= 500
+                and request.status_code not in no_retry_statuses
+                and server_error_retries < self.max_retries
+            ):
+                self._wait_for_retry(
+                    server_error_retries, f"status {request.status_code}"
                 )
+                server_error_retries += 1
+                continue
+
+            wait = self.rate_limit_wait_seconds(request, rate_limit_retries)
+            if wait is None or rate_limit_retries == self.max_rate_limit_retries:
+                break
+
+            logger.warning(
+                f"rate limited by GitHub (status {request.status_code}), retrying in {wait:.1f}s"
             )
+            # every request sharing the rate limiter holds off, not just this one
+            self.rate_limiter.rate_limited(wait)
+            rate_limit_retries += 1
+
+        raise BadReturnStatus(
+            "Query failed to run by returning code of {}. {}".format(
+                request.status_code, query
+            ),
+            request.status_code,
+        )
+
+    def _wait_for_retry(self, attempt: int, reason: str):
+        wait = self.retry_backoff * 2**attempt
+        logger.warning(f"GitHub query failed ({reason}), retrying in {wait:.1f}s")
+        time.sleep(wait)
+
+    def graphql_rate_limit_wait_seconds(
+        self, response, result, attempt: int = 0
+    ) -> Optional[float]:
+        """
+        :return: seconds to wait before retrying a query GitHub answered with a RATE_LIMITED error,
+            or None if it didn't
+        """
+        errors = result.get("errors") if isinstance(result, dict) else None
+        if not any(
+            isinstance(error, dict) and error.get("type") == "RATE_LIMITED"
+            for error in errors or []
+        ):
+            return None
+
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            reset = float(response.headers.get("X-RateLimit-Reset", time.time()))
+            return max(0.0, reset - time.time())
+
+        return self.rate_limit_wait * 2**attempt
+
+    def rate_limit_wait_seconds(self, response, attempt: int = 0) -> Optional[float]:
+        """
+        :return: seconds to wait before retrying response, or None if response wasn't rate limited
+        """
+        return rate_limited_wait_seconds(
+            response, default_wait=self.rate_limit_wait * 2**attempt
+        )
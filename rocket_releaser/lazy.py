@@ -0,0 +1,24 @@
+import importlib
+
+
+class LazyModule:
+    """
+    stands in for a module that is only imported once one of its attributes is used.
+    For heavy dependencies (github3, jira, slacker, requests) that only some stages need,
+    so the CLI starts fast when those stages don't run.
+
+        jira = LazyModule("jira")
+        jira.JIRA(...)  # jira is imported here
+
+    Annotations using the module have to be strings, ex: "jira.Issue", or they import it at definition time.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr: str):
+        # import_module is thread safe & only a sys.modules lookup after the first import
+        return getattr(importlib.import_module(self._name), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name}>"
@@ -0,0 +1,116 @@
+import logging
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple
+
+from . import stats
+from .changelog import ChangeLog
+from .prs import PRs
+from .ticket_labeler import TicketLabeler
+
+logger = logging.getLogger(__name__)
+
+# mark the end of the PR's handed to the labeler
+_DONE = object()
+_ABORTED = object()
+
+
+def iter_merged_pull_request_dicts(
+    deploy_shas: Iterable[str], prs: PRs
+) -> Iterator[dict]:
+    """
+    yields the merged PR's associated with deploy_shas as prs finds them.
+    deploy_shas may be a generator (ex: SHAs.iter_shas), so GitHub lookups overlap the git walk.
+    """
+    # Shas might be associated with unmerged pr's if the pr rebased itself to include that sha
+    # We only want merged pr's
+    return (pr for pr in prs.iter_pull_request_dicts(deploy_shas) if pr["merged"])
+
+
+def iter_merged_pull_request_dicts_by_commit(
+    commits: Iterable[Tuple[str, Optional[int]]], prs: PRs
+) -> Iterator[dict]:
+    """
+    like iter_merged_pull_request_dicts, for (sha, PR number or None) commits from SHAs.iter_shas_with_prs.
+    See PRs.iter_pull_request_dicts_by_commit.
+    """
+    return (pr for pr in prs.iter_pull_request_dicts_by_commit(commits) if pr["merged"])
+
+
+def _iter_queue(pull_request_queue: queue.Queue) -> Iterator[dict]:
+    """yields the PR's put into pull_request_queue from another thread until _DONE"""
+    while True:
+        pr = pull_request_queue.get()
+        if pr is _DONE:
+            return
+        if pr is _ABORTED:
+            raise RuntimeError("finding PR's failed, stopped labeling")
+        yield pr
+
+
+def run_pipeline(
+    pull_request_dicts: Iterable[dict],
+    changelog: ChangeLog,
+    ticket_labeler: Optional[TicketLabeler] = None,
+    env_name: str = "",
+    vpc_name: str = "",
+    dry_run=False,
+) -> int:
+    """
+    feeds PR's into changelog & ticket_labeler as they are found.
+    The changelog is built on the calling thread while ticket_labeler labels in a background thread,
+    so labeling overlaps the PR lookups instead of waiting for all of them.
+    changelog ends up the same as a ChangeLog of every PR after parse_bodies.
+
+    :param pull_request_dicts: usually iter_merged_pull_request_dicts
+    :param ticket_labeler: labeler to label the PR's with. Its own pull_request_dicts are replaced.
+    :return: number of jira tickets found, 0 if there is no ticket_labeler
+    """
+    return start_pipeline(
+        pull_request_dicts, changelog, ticket_labeler, env_name, vpc_name, dry_run
+    ).result()
+
+
+def start_pipeline(
+    pull_request_dicts: Iterable[dict],
+    changelog: ChangeLog,
+    ticket_labeler: Optional[TicketLabeler] = None,
+    env_name: str = "",
+    vpc_name: str = "",
+    dry_run=False,
+) -> Future:
+    """
+    like run_pipeline, but returns once every PR is in changelog while ticket_labeler may still be labeling.
+
+    :return: future of the number of jira tickets found
+    """
+    if ticket_labeler is None:
+        with stats.stage("pull_request_dicts"):
+            for pr in pull_request_dicts:
+                changelog.add_pull_request(pr)
+        num_jira_tickets = Future()
+        num_jira_tickets.set_result(0)
+        return num_jira_tickets
+
+    labeler_queue = queue.Queue()
+    ticket_labeler.pull_request_dicts = _iter_queue(labeler_queue)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    num_jira_tickets = executor.submit(
+        ticket_labeler.label_tickets, env_name, vpc_name, dry_run=dry_run
+    )
+    try:
+        with stats.stage("pull_request_dicts"):
+            for pr in pull_request_dicts:
+                changelog.add_pull_request(pr)
+                labeler_queue.put(pr)
+    except BaseException:
+        # tickets aren't labeled for a release we couldn't finish reading
+        labeler_queue.put(_ABORTED)
+        executor.shutdown()
+        raise
+    labeler_queue.put(_DONE)
+    # the labeling thread finishes on its own
+    executor.shutdown(wait=False)
+
+    return num_jira_tickets
@@ -1,97 +1,576 @@
 import logging
-from typing import List
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
 
-from .graphql import GraphQL
+from .cache import Cache
+from .concurrency import concurrent_imap
+from .graphql import GITHUB_GRAPHQL_URL, BadReturnStatus, GraphQL
 
 logger = logging.getLogger(__name__)
 
+# fields fetched for every PR, by what the PR's are used for
+PR_FIELD_PROFILES = {
+    # changelog & labeling
+    "full": ("id", "title", "number", "body", "merged"),
+    # labeling PR's & the Jira tickets named in PR titles only, bodies are never downloaded.
+    # The changelog has no sections
+    "titles": ("id", "title", "number", "merged"),
+}
+
+# fields the first pass of a two phase fetch gets for every SHA's PR's.
+# The rest of the profile is fetched afterwards, once per merged PR
+FIRST_PASS_FIELDS = ("number", "merged", "title")
+
+# associated: look up the PR's of every SHA with associatedPullRequests
+# merge_commits: fetch the PR's named by merge & squash commit subjects by number,
+#   only looking up SHAs that history doesn't explain, see SHAs.iter_shas_with_prs
+PR_DISCOVERY_MODES = ("associated", "merge_commits")
+
+# what a query cost & how much GraphQL budget is left, for the GraphQL client's rate limiter
+RATE_LIMIT_FIELD = "  rateLimit { cost limit remaining resetAt }\n"
+
+# GitHub answers with these codes when a query is too heavy to finish in time
+SPLITTABLE_STATUS_CODES = (502, 504)
+
+# errors GitHub rejects a whole query with when it asks for too much at once, which go away in smaller queries.
+# Others, ex: RATE_LIMITED, would only be multiplied by splitting
+SPLITTABLE_ERROR_TYPES = ("MAX_NODE_LIMIT_EXCEEDED",)
+SPLITTABLE_ERROR_MESSAGE_RE = re.compile(
+    r"complexity|query cost|node limit|timeout", re.IGNORECASE
+)
+
+
+def is_splittable_error(error: dict) -> bool:
+    """
+    :return: whether error rejects a whole query for its size, so its chunk should be split in half
+    """
+    return not error.get("path") and (
+        error.get("type") in SPLITTABLE_ERROR_TYPES
+        or bool(SPLITTABLE_ERROR_MESSAGE_RE.search(error.get("message") or ""))
+    )
+
 
 class PRs:
-    def __init__(self, token: str, repo_owner: str, repo_name: str):
+    def __init__(
+        self,
+        token: str,
+        repo_owner: str,
+        repo_name: str,
+        chunk_size: int = 50,
+        max_concurrency: int = 4,
+        cache: Cache = None,
+        graph_ql: GraphQL = None,
+        field_profile: str = "full",
+        two_phase=False,
+    ):
         """
         :param token: GitHub oauth token
+        :param chunk_size: max number of SHAs to look up in a single GraphQL query
+        :param max_concurrency: max number of GraphQL queries in flight at once
+        :param cache: persistent cache of SHA -> PR lookups shared between runs
+        :param graph_ql: GitHub client to share with other GitHub users. A new one is made if not passed in.
+        :param field_profile: which PR fields to fetch, one of PR_FIELD_PROFILES
+        :param two_phase: look SHAs up with FIRST_PASS_FIELDS only, then fetch the rest of the profile
+            once per merged PR. Saves downloading the bodies of PR's that repeat across SHAs or aren't merged.
+            Unmerged PR's only come with FIRST_PASS_FIELDS.
         """
+        if field_profile not in PR_FIELD_PROFILES:
+            raise ValueError(
+                f"unknown field_profile {field_profile}. Choose from {', '.join(PR_FIELD_PROFILES)}"
+            )
+
         self.token = token
         self.repo_owner = repo_owner
         self.repo_name = repo_name
+        self.chunk_size = max(1, chunk_size)
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.graph_ql = graph_ql
+        self.fields = PR_FIELD_PROFILES[field_profile]
+        self.two_phase = two_phase
 
         self._request_dicts = None
 
     def clear_cache(self):
         self._request_dicts = None
 
-    def pull_request_dicts(self, deploy_shas: List[str] = []) -> List[dict]:
+    @property
+    def associated_fields(self) -> Sequence[str]:
+        """fields SHAs' PR's are looked up with"""
+        return FIRST_PASS_FIELDS if self.two_phase else self.fields
+
+    @staticmethod
+    def associated_prs_query(
+        aliases: List[str], fields: Sequence[str] = PR_FIELD_PROFILES["full"]
+    ) -> str:
         """
-        gets PR's associated with deploy shas. Cached so calling multiple times won't result in unnecessary API calls.
+        builds a query that looks up the PR's of several commits at once.
+        Each commit is fetched under its own alias with its own $alias variable.
         """
-
+        variable_defs = "".join(f", ${alias}: String" for alias in aliases)
         # number of associatedPullRequests to pull is entirely arbitrary
         # 99% of cases it should only be 1 anyways
-        query = """
-query associatedPRs($sha: String, $repo: String!, $owner: String!){
-  repository(name: $repo, owner: $owner) {
-    commit: object(expression: $sha) {
-      ... on Commit {
-        associatedPullRequests(first:5){
-          edges{
-            node{
-              title
-              number
-              body
-              merged
-            }
-          }
+        commit_fields = (
+            "\n      ... on Commit {\n"
+            "        associatedPullRequests(first:5){\n"
+            "          edges{\n"
+            f"            node{{{_field_lines(fields, 14)}            }}\n"
+            "          }\n"
+            "        }\n"
+            "      }\n"
+        )
+        objects = "".join(
+            f"    {alias}: object(expression: ${alias}) {{{commit_fields}    }}\n"
+            for alias in aliases
+        )
+        return (
+            f"query associatedPRs($repo: String!, $owner: String!{variable_defs}){{\n"
+            f"  repository(name: $repo, owner: $owner) {{\n"
+            f"{objects}"
+            f"  }}\n"
+            f"{RATE_LIMIT_FIELD}"
+            f"}}\n"
+        )
+
+    def _associated_prs(
+        self, graph_ql: GraphQL, shas: List[str]
+    ) -> Dict[str, Tuple[Optional[str], Optional[dict]]]:
+        """
+        looks up shas in a single query.
+        If GitHub rejects the query as too big (ex: too complex) the shas are split in half and retried.
+
+        :return: dict mapping each sha to a (error message, commit) tuple
+        """
+        aliases = {f"sha{i}": sha for i, sha in enumerate(shas)}
+        variables = {"repo": self.repo_name, "owner": self.repo_owner, **aliases}
+
+        try:
+            result = graph_ql.run_query(
+                self.associated_prs_query(list(aliases), self.associated_fields),
+                variables,
+                # a heavy chunk is split in half rather than retried as is
+                no_retry_statuses=SPLITTABLE_STATUS_CODES if len(shas) > 1 else (),
+            )
+        except BadReturnStatus as e:
+            if len(shas) > 1 and e.status_code in SPLITTABLE_STATUS_CODES:
+                return self._split_associated_prs(graph_ql, shas, str(e))
+            raise
+
+        # 'errors' key is only present in result if there is an error
+        sha_errors = {}
+        query_errors = []
+        for error in result.get("errors", []):
+            path = error.get("path") or []
+            if len(path) > 1 and path[1] in aliases:
+                sha_errors.setdefault(aliases[path[1]], error["message"])
+            else:
+                query_errors.append(error)
+
+        too_big = [error for error in query_errors if is_splittable_error(error)]
+        if len(shas) > 1 and too_big:
+            return self._split_associated_prs(graph_ql, shas, too_big[0]["message"])
+
+        repository = (result.get("data") or {}).get("repository") or {}
+
+        associated_prs = {}
+        for alias, sha in aliases.items():
+            if sha in sha_errors:
+                associated_prs[sha] = (sha_errors[sha], None)
+            elif query_errors:
+                associated_prs[sha] = (query_errors[0]["message"], None)
+            else:
+                associated_prs[sha] = (None, repository.get(alias))
+
+        return associated_prs
+
+    @staticmethod
+    def pull_requests_query(
+        aliases: List[str], fields: Sequence[str] = PR_FIELD_PROFILES["full"]
+    ) -> str:
+        """
+        builds a query that fetches several PR's by number at once.
+        Each PR is fetched under its own alias with its own $alias variable.
+        """
+        variable_defs = "".join(f", ${alias}: Int!" for alias in aliases)
+        pull_requests = "".join(
+            f"    {alias}: pullRequest(number: ${alias}) {{{_field_lines(fields, 6)}    }}\n"
+            for alias in aliases
+        )
+        return (
+            f"query pullRequests($repo: String!, $owner: String!{variable_defs}){{\n"
+            f"  repository(name: $repo, owner: $owner) {{\n"
+            f"{pull_requests}"
+            f"  }}\n"
+            f"{RATE_LIMIT_FIELD}"
+            f"}}\n"
+        )
+
+    def _pull_requests(self, graph_ql: GraphQL, numbers: List[int]) -> Dict[int, dict]:
+        """
+        fetches the PR's with numbers in a single query, split in half & retried like _associated_prs
+        if GitHub rejects it as too big.
+
+        :return: dict mapping number to PR, for the numbers GitHub found a PR for
+        """
+        aliases = {f"pr{i}": number for i, number in enumerate(numbers)}
+        variables = {"repo": self.repo_name, "owner": self.repo_owner, **aliases}
+
+        try:
+            result = graph_ql.run_query(
+                self.pull_requests_query(list(aliases), self.fields),
+                variables,
+                no_retry_statuses=SPLITTABLE_STATUS_CODES if len(numbers) > 1 else (),
+            )
+        except BadReturnStatus as e:
+            if len(numbers) > 1 and e.status_code in SPLITTABLE_STATUS_CODES:
+                return self._split_pull_requests(graph_ql, numbers, str(e))
+            raise
+
+        errors = result.get("errors", [])
+        too_big = [error for error in errors if is_splittable_error(error)]
+        if len(numbers) > 1 and too_big:
+            return self._split_pull_requests(graph_ql, numbers, too_big[0]["message"])
+        for error in errors:
+            # ex: #N was an issue, or a PR in another repo. Its commits get looked up by sha instead
+            logger.info(f"error fetching PR by number: {error['message']}")
+
+        repository = (result.get("data") or {}).get("repository") or {}
+        return {
+            number: repository[alias]
+            for alias, number in aliases.items()
+            if repository.get(alias)
         }
-      }
-    }
-  }
-}
-"""
+
+    def _split_pull_requests(
+        self, graph_ql: GraphQL, numbers: List[int], reason: str
+    ) -> Dict[int, dict]:
+        middle = len(numbers) // 2
+        logger.info(
+            f"query for {len(numbers)} PR's was rejected, splitting in half. {reason}"
+        )
+        pull_requests = self._pull_requests(graph_ql, numbers[:middle])
+        pull_requests.update(self._pull_requests(graph_ql, numbers[middle:]))
+        return pull_requests
+
+    def _split_associated_prs(
+        self, graph_ql: GraphQL, shas: List[str], reason: str
+    ) -> Dict[str, Tuple[Optional[str], Optional[dict]]]:
+        middle = len(shas) // 2
+        logger.info(
+            f"query for {len(shas)} shas was rejected, splitting in half. {reason}"
+        )
+        associated_prs = self._associated_prs(graph_ql, shas[:middle])
+        associated_prs.update(self._associated_prs(graph_ql, shas[middle:]))
+        return associated_prs
+
+    def pull_request_dicts(self, deploy_shas: List[str] = []) -> List[dict]:
+        """
+        gets PR's associated with deploy shas. Cached so calling multiple times won't result in unnecessary API calls.
+        See iter_pull_request_dicts.
+        """
 
         if self._request_dicts is None:
+            self._request_dicts = list(self.iter_pull_request_dicts(deploy_shas))
+
+        return self._request_dicts
 
-            pull_request_dicts: List[dict] = []
-            seen = {}
+    def iter_pull_request_dicts(self, deploy_shas: Iterable[str]) -> Iterator[dict]:
+        """
+        yields PR's associated with deploy shas as they are found, in deploy sha order & without duplicates.
+        deploy_shas is read lazily, so a sha generator (ex: SHAs.iter_shas) can still be walking git
+        while earlier shas are looked up.
+        SHAs are looked up chunk_size at a time, with up to max_concurrency chunks in flight.
+        If there is a persistent cache only SHAs missing from it are looked up.
+        """
+        graph_ql = self._graph_ql()
+        pull_request_dicts = self._iter_associated_pull_request_dicts(
+            graph_ql, deploy_shas
+        )
+        if self.two_phase:
+            pull_request_dicts = self._iter_completed(graph_ql, pull_request_dicts)
+        return pull_request_dicts
 
-            graph_ql = GraphQL("https://api.github.com/graphql", self.token)
+    def _iter_associated_pull_request_dicts(
+        self, graph_ql: GraphQL, deploy_shas: Iterable[str]
+    ) -> Iterator[dict]:
+        seen = {}
+        for chunk, associated_prs in concurrent_imap(
+            lambda chunk: (chunk, self._chunk_associated_prs(graph_ql, chunk)),
+            self._chunks(deploy_shas),
+            self.max_concurrency,
+        ):
+            for sha in chunk:
+                for pr in self._commit_pull_requests(sha, *associated_prs[sha]):
+                    # two commits may reference the same PR
+                    if pr["number"] not in seen:
+                        seen[pr["number"]] = True
+                        yield pr
 
-            deploy_shas = set(deploy_shas)  # get rid of duplicates
+    def iter_pull_request_dicts_by_commit(
+        self, commits: Iterable[Tuple[str, Optional[int]]]
+    ) -> Iterator[dict]:
+        """
+        like iter_pull_request_dicts, for (sha, PR number or None) commits, ex: from SHAs.iter_shas_with_prs.
+        PR's are fetched by number, so all the commits of a PR cost one lookup instead of one each.
+        Only commits without a number, or whose number GitHub has no PR for, are looked up by sha.
+        Every chunk of commits takes up to two queries, one per kind of lookup,
+        and a third if it has commits of a number an earlier chunk found no PR for.
+        """
+        graph_ql = self._graph_ql()
+        pull_request_dicts = self._iter_pull_request_dicts_by_commit(graph_ql, commits)
+        if self.two_phase:
+            # the PR's of commits looked up by sha only have the first pass fields
+            pull_request_dicts = self._iter_completed(graph_ql, pull_request_dicts)
+        return pull_request_dicts
 
-            for sha in deploy_shas:
-                result = graph_ql.run_query(
-                    query,
-                    {"sha": sha, "repo": self.repo_name, "owner": self.repo_owner},
+    def _iter_pull_request_dicts_by_commit(
+        self, graph_ql: GraphQL, commits: Iterable[Tuple[str, Optional[int]]]
+    ) -> Iterator[dict]:
+        seen = {}
+        # every number fetched so far -> its PR, for the commits of a PR that come in later chunks
+        pull_requests_by_number = {}
+        # numbers GitHub has no PR for, their commits are looked up by sha
+        missing_numbers = set()
+        for chunk, new_numbers, pull_requests, associated_prs in concurrent_imap(
+            lambda lookup: self._resolve_commits(graph_ql, *lookup),
+            self._commit_chunks(commits),
+            self.max_concurrency,
+        ):
+            pull_requests_by_number.update(pull_requests)
+            missing_numbers.update(new_numbers - set(pull_requests))
+            # later commits of numbers an earlier chunk found no PR for
+            late_shas = [
+                sha
+                for sha, number in chunk
+                if number in missing_numbers and sha not in associated_prs
+            ]
+            if late_shas:
+                associated_prs = dict(
+                    associated_prs, **self._chunk_associated_prs(graph_ql, late_shas)
                 )
 
-                try:
-                    # 'errors' key is only present in result if there is an error
-                    logger.warning(
-                        f"error with sha {sha}: " + result["errors"][0]["message"]
-                    )
+            for sha, number in chunk:
+                if number in pull_requests_by_number:
+                    if number in seen:
+                        continue
+                    pr = pull_requests_by_number[number]
+                    pr["deploy_sha"] = sha
+                    found = [pr]
+                else:
+                    found = self._commit_pull_requests(sha, *associated_prs[sha])
+                for pr in found:
+                    if pr["number"] not in seen:
+                        seen[pr["number"]] = True
+                        yield pr
+
+    def _iter_completed(
+        self, graph_ql: GraphQL, pull_request_dicts: Iterable[dict]
+    ) -> Iterator[dict]:
+        """
+        second pass of a two phase fetch: fetches the fields merged PR's are missing by number,
+        chunk_size PR's at a time with up to max_concurrency chunks in flight, keeping order
+        """
+
+        def complete(chunk: List[dict]) -> Tuple[List[dict], Dict[int, dict]]:
+            numbers = [
+                pr["number"]
+                for pr in chunk
+                if pr["merged"] and any(field not in pr for field in self.fields)
+            ]
+            return (
+                chunk,
+                self._chunk_pull_requests(graph_ql, numbers) if numbers else {},
+            )
+
+        for chunk, pull_requests in concurrent_imap(
+            complete,
+            _batches(pull_request_dicts, self.chunk_size),
+            self.max_concurrency,
+        ):
+            for pr in chunk:
+                if pr["number"] in pull_requests:
+                    pr = dict(pull_requests[pr["number"]], deploy_sha=pr["deploy_sha"])
+                yield pr
+
+    def _graph_ql(self) -> GraphQL:
+        return self.graph_ql or GraphQL(
+            GITHUB_GRAPHQL_URL,
+            self.token,
+            pool_size=max(10, self.max_concurrency),
+        )
+
+    @staticmethod
+    def _commit_pull_requests(
+        sha: str, error: Optional[str], commit: Optional[dict]
+    ) -> List[dict]:
+        """:return: the PR's of a commit looked up with associatedPullRequests"""
+        if error:
+            logger.warning(f"error with sha {sha}: " + error)
+            return []
+
+        try:
+            prs = [edge["node"] for edge in commit["associatedPullRequests"]["edges"]]
+        except TypeError:
+            # this can happen if commit is cherry-picked from local commit not in repo
+            logger.warning(
+                "commit %s not found or has no associated PRs", sha, exc_info=1
+            )
+            return []
+
+        for pr in prs:
+            # for logging we record sha we got to this pr from
+            pr["deploy_sha"] = sha
+        return prs
+
+    def _commit_chunks(
+        self, commits: Iterable[Tuple[str, Optional[int]]]
+    ) -> Iterator[Tuple[List[Tuple[str, Optional[int]]], Set[int]]]:
+        """
+        splits commits into chunks of up to chunk_size lookups, keeping order & dropping duplicate SHAs.
+        Only the first commit of every PR number counts as a lookup, later commits of the number
+        are only looked up by sha if GitHub has no PR for it.
+
+        :return: (chunk, PR numbers first seen in chunk) pairs
+        """
+        seen_shas = set()
+        seen_numbers = set()
+        chunk = []
+        new_numbers = set()
+        lookups = 0
+        for sha, number in commits:
+            if sha in seen_shas:
+                continue
+            seen_shas.add(sha)
+            chunk.append((sha, number))
+            if number is not None and number in seen_numbers:
+                continue
+            if number is not None:
+                seen_numbers.add(number)
+                new_numbers.add(number)
+            lookups += 1
+            if lookups == self.chunk_size:
+                yield chunk, new_numbers
+                chunk = []
+                new_numbers = set()
+                lookups = 0
+        if chunk:
+            yield chunk, new_numbers
+
+    def _resolve_commits(
+        self,
+        graph_ql: GraphQL,
+        chunk: List[Tuple[str, Optional[int]]],
+        new_numbers: Set[int],
+    ) -> Tuple[
+        List[Tuple[str, Optional[int]]],
+        Set[int],
+        Dict[int, dict],
+        Dict[str, Tuple[Optional[str], Optional[dict]]],
+    ]:
+        """
+        fetches the PR's numbered new_numbers, then looks up by sha the commits of chunk without a number
+        and those whose number in new_numbers GitHub has no PR for
+
+        :return: (chunk, new_numbers, dict mapping number to PR, dict mapping sha to an _associated_prs result)
+        """
+        numbers = list(
+            dict.fromkeys(number for _, number in chunk if number in new_numbers)
+        )
+        pull_requests = self._chunk_pull_requests(graph_ql, numbers) if numbers else {}
+
+        shas = [
+            sha
+            for sha, number in chunk
+            if number is None or (number in new_numbers and number not in pull_requests)
+        ]
+        associated_prs = self._chunk_associated_prs(graph_ql, shas) if shas else {}
+
+        return chunk, new_numbers, pull_requests, associated_prs
+
+    def _chunk_pull_requests(
+        self, graph_ql: GraphQL, numbers: List[int]
+    ) -> Dict[int, dict]:
+        """
+        like _pull_requests, but reads & updates the persistent cache if there is one
+        """
+        pull_requests = {}
+        if self.cache:
+            pull_requests = self.cache.get_pull_requests(
+                self.repo_owner, self.repo_name, numbers, self.fields
+            )
+
+        uncached_numbers = [number for number in numbers if number not in pull_requests]
+        if uncached_numbers:
+            fetched = self._pull_requests(graph_ql, uncached_numbers)
+            if self.cache:
+                self.cache.set_pull_requests(
+                    self.repo_owner, self.repo_name, list(fetched.values())
+                )
+            pull_requests.update(fetched)
+
+        return pull_requests
+
+    def _chunks(self, deploy_shas: Iterable[str]) -> Iterator[List[str]]:
+        """splits deploy_shas into lists of up to chunk_size, getting rid of duplicates while keeping order"""
+        seen = set()
+        chunk = []
+        for sha in deploy_shas:
+            if sha in seen:
+                continue
+            seen.add(sha)
+            chunk.append(sha)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _chunk_associated_prs(
+        self, graph_ql: GraphQL, shas: List[str]
+    ) -> Dict[str, Tuple[Optional[str], Optional[dict]]]:
+        """
+        like _associated_prs, but reads & updates the persistent cache if there is one
+        """
+        associated_prs = {}
+        if self.cache:
+            for sha, prs in self.cache.get_associated_prs(
+                self.repo_owner, self.repo_name, shas, self.associated_fields
+            ).items():
+                edges = [{"node": pr} for pr in prs]
+                associated_prs[sha] = (
+                    None,
+                    {"associatedPullRequests": {"edges": edges}},
+                )
+
+        uncached_shas = [sha for sha in shas if sha not in associated_prs]
+        if uncached_shas:
+            associated_prs.update(self._associated_prs(graph_ql, uncached_shas))
+
+        if self.cache:
+            fetched_prs = {}
+            for sha in uncached_shas:
+                error, commit = associated_prs[sha]
+                # only commits GitHub found are cached, so missing ones are tried again next run
+                if error or not commit:
                     continue
-                except KeyError:
-                    pass
-
-                try:
-                    for edge in result["data"]["repository"]["commit"][
-                        "associatedPullRequests"
-                    ]["edges"]:
-                        pr = edge["node"]
-                        pr_num = pr["number"]
-
-                        # for logging we record sha we got to this pr from
-                        pr["deploy_sha"] = sha
-
-                        # two commits may reference the same PR
-                        if pr_num not in seen:
-                            pull_request_dicts.append(pr)
-                            seen[pr_num] = True
-                except TypeError:
-                    # this can happen if commit is cherry-picked from local commit not in repo
-                    logger.warning(
-                        "commit %s not found or has no associated PRs", sha, exc_info=1
-                    )
-
-            self._request_dicts = pull_request_dicts
+                edges = commit["associatedPullRequests"]["edges"]
+                fetched_prs[sha] = [dict(edge["node"]) for edge in edges]
 
-        return self._request_dicts
+            self.cache.set_associated_prs(self.repo_owner, self.repo_name, fetched_prs)
+
+        return associated_prs
+
+
+def _field_lines(fields: Sequence[str], indent: int) -> str:
+    return "".join(f"\n{' ' * indent}{field}" for field in fields) + "\n"
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,284 @@
+import calendar
+import datetime
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+# GitHub asks to wait at least a minute on a secondary rate limit that doesn't say how long
+SECONDARY_RATE_LIMIT_WAIT = 60
+
+
+class RateLimiter:
+    """
+    GitHub rate limit budgets shared by everything that calls GitHub, so concurrent workers
+    spend one budget between them instead of each running into the limit on its own.
+
+    Budgets are per GitHub resource ("core" for REST, "graphql", ...) and come from the X-RateLimit-* headers of
+    every response & the rateLimit field of GraphQL queries that ask for it.
+    Requests call wait() first, which spreads them out once little of the budget is left,
+    holds them until the budget resets once it is used up, and holds everyone after a rate limited response.
+    Secondary rate limits don't announce themselves in headers, so after one requests are also spaced out,
+    twice as far apart every time GitHub rate limits again and a little closer with every response that isn't.
+    """
+
+    def __init__(
+        self,
+        slow_down_below: float = 0.1,
+        reserve: float = 0.01,
+        min_spacing: float = 0.1,
+        max_spacing: float = 2,
+    ):
+        """
+        :param slow_down_below: fraction of a budget left at which requests are spread evenly
+            over the time left until it resets
+        :param reserve: fraction of a budget that is never spent, left for whoever else uses the token.
+            Requests wait for the reset instead.
+        :param min_spacing: seconds between requests right after the first rate limited response
+        :param max_spacing: most seconds requests are ever spaced apart
+        """
+        self.slow_down_below = slow_down_below
+        self.reserve = reserve
+        self.min_spacing = min_spacing
+        self.max_spacing = max_spacing
+
+        self._lock = threading.Lock()
+        # resource -> {"limit", "remaining", "reset_at", "next_at"}
+        self._budgets: Dict[str, dict] = {}
+        self._paused_until = 0.0
+        self._spacing = 0.0
+        self._next_slot = 0.0
+        # GraphQL operation name -> cost of its last run
+        self._costs: Dict[str, int] = {}
+
+    def budget(self, resource: str) -> Optional[dict]:
+        """:return: the limit, remaining & reset_at (epoch seconds) last seen for resource, or None"""
+        with self._lock:
+            budget = self._budgets.get(resource)
+            return dict(budget) if budget else None
+
+    def cost(self, operation: str) -> int:
+        """:return: what GraphQL charged for operation the last time it ran, 1 if it hasn't yet"""
+        return self._costs.get(operation, 1)
+
+    def wait(self, resource: str, cost: int = 1):
+        """
+        blocks until a request costing cost may be sent without going over resource's budget,
+        then counts it against the budget
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                delay, reason = self._delay(resource, cost, now)
+                if self._spacing:
+                    slot = max(now + delay, self._next_slot)
+                    self._next_slot = slot + self._spacing
+                    if slot - now > delay:
+                        delay = slot - now
+                        reason = f"spacing requests {self._spacing:.2f}s apart after being rate limited"
+                paused_until = self._paused_until
+                if delay <= 0:
+                    self._spend(resource, cost)
+                    return
+
+            logger.info(
+                f"waiting {delay:.1f}s for the GitHub {resource} budget, {reason}"
+            )
+            stats.record_rate_limit_wait(resource, delay)
+            time.sleep(delay)
+
+            with self._lock:
+                # unless somebody was rate limited while we slept, in which case we queue up again
+                if self._paused_until <= paused_until:
+                    self._spend(resource, cost)
+                    return
+
+    def _spend(self, resource: str, cost: int):
+        budget = self._budgets.get(resource)
+        if budget:
+            budget["remaining"] -= cost
+
+    def _delay(self, resource: str, cost: int, now: float):
+        if now < self._paused_until:
+            return self._paused_until - now, "GitHub rate limited an earlier request"
+
+        budget = self._budgets.get(resource)
+        if not budget or now >= budget["reset_at"]:
+            return 0.0, ""
+
+        until_reset = budget["reset_at"] - now
+        spendable = budget["remaining"] - budget["limit"] * self.reserve
+        if spendable < cost:
+            return until_reset, f"{budget['remaining']} of {budget['limit']} left"
+
+        if budget["remaining"] < budget["limit"] * self.slow_down_below:
+            # spread what's left evenly over the time until the reset
+            delay = max(0.0, budget["next_at"] - now)
+            budget["next_at"] = (
+                max(now, budget["next_at"]) + until_reset * cost / spendable
+            )
+            return (
+                delay,
+                f"slowing down with {budget['remaining']} of {budget['limit']} left",
+            )
+
+        return 0.0, ""
+
+    def pause(self, seconds: float):
+        """holds every request for seconds, ex: after GitHub answered with a secondary rate limit"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.time() + seconds)
+
+    def rate_limited(self, seconds: float):
+        """
+        holds every request for seconds after GitHub rate limited one, and spaces them out further afterwards.
+        Responses to requests that were already in flight get rate limited too,
+        so only the first one of a pause spaces requests further apart.
+        """
+        with self._lock:
+            now = time.time()
+            if now >= self._paused_until:
+                self._spacing = min(
+                    self.max_spacing, max(self.min_spacing, self._spacing * 2)
+                )
+            self._paused_until = max(self._paused_until, now + seconds)
+
+    def speed_up(self):
+        """spaces requests a little closer together, after a response that wasn't rate limited"""
+        with self._lock:
+            self._spacing *= 0.9
+            if self._spacing < self.min_spacing / 10:
+                self._spacing = 0.0
+
+    def update(self, resource: str, limit: int, remaining: int, reset_at: float):
+        """
+        records resource's budget as GitHub reported it.
+        Within the same window the lower of GitHub's count & ours is kept, as requests still in flight
+        are already counted in ours.
+        """
+        with self._lock:
+            budget = self._budgets.get(resource)
+            if budget and reset_at <= budget["reset_at"]:
+                remaining = min(remaining, budget["remaining"])
+                next_at = budget["next_at"]
+            else:
+                next_at = 0.0
+            remaining = max(0, remaining)
+            self._budgets[resource] = {
+                "limit": limit,
+                "remaining": remaining,
+                "reset_at": reset_at,
+                "next_at": next_at,
+            }
+
+        if remaining < limit * self.slow_down_below:
+            logger.warning(
+                f"GitHub {resource} budget is low: {remaining} of {limit} left"
+            )
+        else:
+            logger.debug(f"GitHub {resource} budget: {remaining} of {limit} left")
+        stats.record_rate_limit(resource, limit, remaining)
+
+    def update_from_headers(self, headers, default_resource: str):
+        """
+        records the budget in a response's X-RateLimit-* headers, if it has them
+
+        :param default_resource: resource to record it as if GitHub didn't say, ex: "core" for REST
+        """
+        try:
+            limit = int(headers["X-RateLimit-Limit"])
+            remaining = int(headers["X-RateLimit-Remaining"])
+            reset_at = float(headers["X-RateLimit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return
+        resource = headers.get("X-RateLimit-Resource") or default_resource
+        self.update(resource, limit, remaining, reset_at)
+
+    def update_from_graphql(self, operation: str, rate_limit: dict):
+        """
+        records the rateLimit field of a GraphQL result, ex: {"cost": 1, "limit": 5000, "remaining": 4999,
+        "resetAt": "2021-01-01T00:00:00Z"}. Its cost is what operation is expected to cost next time.
+        """
+        if rate_limit.get("cost") is not None:
+            self._costs[operation] = max(1, rate_limit["cost"])
+        if rate_limit.get("remaining") is None or not rate_limit.get("resetAt"):
+            return
+        reset_at = calendar.timegm(
+            time.strptime(rate_limit["resetAt"], "%Y-%m-%dT%H:%M:%SZ")
+        )
+        self.update(
+            "graphql",
+            rate_limit.get("limit") or rate_limit["remaining"],
+            rate_limit["remaining"],
+            reset_at,
+        )
+
+    def instrument_session(self, session, default_resource: str):
+        """
+        records the budget of every response session gets, and holds every request after one that was
+        rate limited, ex: for the session of a github3.GitHub client
+        """
+
+        def record(response, *args, **kwargs):
+            self.update_from_headers(response.headers, default_resource)
+            wait = rate_limited_wait_seconds(response)
+            if wait is None:
+                self.speed_up()
+            else:
+                self.rate_limited(wait)
+
+        session.hooks["response"].append(record)
+
+
+def rate_limited_wait_seconds(
+    response, default_wait: float = SECONDARY_RATE_LIMIT_WAIT
+) -> Optional[float]:
+    """
+    :param default_wait: seconds to wait on a rate limit that doesn't say how long to wait
+    :return: seconds GitHub asked to wait with response, or None if it didn't rate limit it
+    """
+    if response.status_code not in (403, 429):
+        return None
+
+    # https://docs.github.com/en/rest/overview/resources-in-the-rest-api#secondary-rate-limits
+    retry_after = _retry_after_seconds(response.headers.get("Retry-After"))
+    if retry_after is not None:
+        return retry_after
+
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = float(response.headers.get("X-RateLimit-Reset", time.time()))
+        return max(0.0, reset - time.time())
+
+    # a 403 that isn't about rate limits (ex: bad permissions) won't get better by waiting
+    if response.status_code == 429 or "rate limit" in response.text.lower():
+        return default_wait
+
+    return None
+
+
+def _retry_after_seconds(retry_after: Optional[str]) -> Optional[float]:
+    """
+    :param retry_after: a Retry-After header, either seconds or an HTTP-date
+    :return: seconds to wait, or None if retry_after is missing or can't be parsed
+    """
+    if not retry_after:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        logger.warning(f"ignoring unparseable Retry-After {retry_after!r}")
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, retry_at.timestamp() - time.time())
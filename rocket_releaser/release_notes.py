@@ -1,16 +1,32 @@
 import argparse
+import asyncio
 import datetime
+import json
 import logging
 import re
 import subprocess
+import sys
+import threading
+from concurrent.futures import Executor, Future
+from functools import partial
 from sys import stdout, argv
-from typing import List
+from typing import List, Optional, Tuple
 
+from . import stats
+from .cache import Cache
 from .changelog import ChangeLog
-from .prs import PRs
-from .shas import branch_exists, SHAs
-from .slack import post_deployment_message_to_slack
-from .ticket_labeler import TicketLabeler
+from .concurrency import concurrent_map
+from .git_backends import GIT_BACKENDS, AsyncioGitBackend, make_git_backend
+from .graphql import GraphQL, github_graphql_url
+from .pipeline import (
+    iter_merged_pull_request_dicts,
+    iter_merged_pull_request_dicts_by_commit,
+    start_pipeline,
+)
+from .prs import PR_DISCOVERY_MODES, PR_FIELD_PROFILES, PRs
+from .shas import FETCH_MODES, branch_exists, SHAs
+from .slack import SLACK_WEBHOOK_URL, post_deployment_message_to_slack
+from .ticket_labeler import PR_LABEL_BACKENDS, TicketLabeler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -25,19 +41,29 @@ def turn_changelog_into_string(
     org_name: str,
     repo_name: str,
 ):
-
     changelog = ChangeLog(pull_request_dicts, org_name, repo_name).parse_bodies()
+    return format_changelog(
+        changelog,
+        env_name,
+        from_revision,
+        to_revision,
+        num_jira_tickets,
+        org_name,
+        repo_name,
+    )
 
-    link = (
+
+def compare_link(org_name: str, repo_name: str, from_revision: str, to_revision: str):
+    return (
         f"<https://github.com/{org_name}/{repo_name}/compare/{from_revision[:7]}...{to_revision[:7]}|"
         f"{from_revision[:7]}...{to_revision[:7]}>"
     )
-    now_str = datetime.datetime.now().isoformat(" ")
-    title_line = f"*{env_name.upper()} RELEASE* {now_str} ({link})"
 
+
+def is_hotfix(pull_request_dicts: List[dict], env_name: str) -> bool:
     # assumes that env_name is the same as the branch name
     # currently for 15Five this assumption works (only difference is dev/preview but that doesnt get hotfixes)
-    is_hotfix = any(
+    return any(
         [
             "hotfix" in pr.get("title", "").lower()
             and env_name.lower() in pr.get("title", "").lower()
@@ -45,21 +71,13 @@ def turn_changelog_into_string(
         ]
     )
 
-    if is_hotfix:
-        title_line = ":fire: *HOTFIX* :fire: " + title_line
-
-    messages = [
-        title_line,
-        f"{num_jira_tickets} jira tickets found.",
-        f"{len(changelog.pull_request_dicts)} PRs found.",
-    ]
-
-    if from_revision == to_revision:
-        messages.append(
-            "Start and end commit hashes are the same - no changes for release notes to log"
-        )
-        return "\n".join(messages)
 
+def changelog_sections(changelogs: List[ChangeLog], env_name: str) -> List[str]:
+    """
+    :return: lines of the Noteworthy Changes, Features, Fixes & QA sections of changelogs,
+        with the items of every changelog under one heading per section
+    """
+    messages = []
     attr_names_and_category_names = [
         ("noteworthy", "Noteworthy Changes"),
         ("features", "Features"),
@@ -67,20 +85,202 @@ def turn_changelog_into_string(
     ]
 
     for attr_name, category_name in attr_names_and_category_names:
-        category_items = getattr(changelog, attr_name)
+        category_items = [
+            item for changelog in changelogs for item in getattr(changelog, attr_name)
+        ]
         if category_items:
             messages.append(f"\n*{category_name}*")
             messages.extend(category_items)
 
-    if changelog.qa_notes and env_name.lower() in ("preview", "staging"):
+    qa_notes = [item for changelog in changelogs for item in changelog.qa_notes]
+    if qa_notes and env_name.lower() in ("preview", "staging"):
         messages.append("\n*Notes for QA*")
-        messages.extend(changelog.qa_notes)
+        messages.extend(qa_notes)
+
+    return messages
+
+
+@stats.stage("format_changelog")
+def format_changelog(
+    changelog: ChangeLog,
+    env_name: str,
+    from_revision: str,
+    to_revision: str,
+    num_jira_tickets: Optional[int],
+    org_name: str,
+    repo_name: str,
+):
+    """
+    like turn_changelog_into_string, for a changelog that is already parsed
+
+    :param num_jira_tickets: None while they are still being labeled, see format_tickets_found
+    """
+    pull_request_dicts = changelog.pull_request_dicts
+
+    link = compare_link(org_name, repo_name, from_revision, to_revision)
+    now_str = datetime.datetime.now().isoformat(" ")
+    title_line = f"*{env_name.upper()} RELEASE* {now_str} ({link})"
+
+    if is_hotfix(pull_request_dicts, env_name):
+        title_line = ":fire: *HOTFIX* :fire: " + title_line
+
+    messages = [
+        title_line,
+        f"{num_jira_tickets} jira tickets found."
+        if num_jira_tickets is not None
+        else "Labeling jira tickets, their count follows when done.",
+        f"{len(changelog.pull_request_dicts)} PRs found.",
+    ]
+
+    if from_revision == to_revision:
+        messages.append(
+            "Start and end commit hashes are the same - no changes for release notes to log"
+        )
+        return "\n".join(messages)
+
+    messages.extend(changelog_sections([changelog], env_name))
 
     text = "\n".join(messages)
 
     return text
 
 
+def format_tickets_found(
+    env_name: str,
+    from_revision: str,
+    to_revision: str,
+    num_jira_tickets: int,
+    org_name: str,
+    repo_name: str,
+) -> str:
+    """follow up to release notes posted before their jira tickets were labeled"""
+    link = compare_link(org_name, repo_name, from_revision, to_revision)
+    return (
+        f"*{env_name.upper()} RELEASE* ({link}): {num_jira_tickets} jira tickets found."
+    )
+
+
+def build_changelog(
+    prs: PRs,
+    from_revision: str,
+    to_revision: str,
+    repo_dir: str,
+    search_branch: str = "master",
+    ticket_labeler: TicketLabeler = None,
+    env_name: str = "prod",
+    vpc_name: str = "prod",
+    dry_run=False,
+    fetch_before=True,
+    compact_shas=False,
+    git_backend="subprocess",
+    fetch_mode: str = "always",
+    fetch_filter: str = "",
+    pr_discovery: str = "associated",
+) -> Tuple[ChangeLog, int]:
+    """
+    finds the merged PR's deployed from_revision...to_revision in the repo prs looks up,
+    labeling them with ticket_labeler as they are found. See release_notes for the other params.
+
+    :return: (parsed changelog, number of jira tickets found)
+    """
+    changelog, num_jira_tickets = start_changelog(
+        prs,
+        from_revision,
+        to_revision,
+        repo_dir,
+        search_branch,
+        ticket_labeler,
+        env_name,
+        vpc_name,
+        dry_run=dry_run,
+        fetch_before=fetch_before,
+        compact_shas=compact_shas,
+        git_backend=git_backend,
+        fetch_mode=fetch_mode,
+        fetch_filter=fetch_filter,
+        pr_discovery=pr_discovery,
+    )
+    return changelog, num_jira_tickets.result()
+
+
+def start_changelog(
+    prs: PRs,
+    from_revision: str,
+    to_revision: str,
+    repo_dir: str,
+    search_branch: str = "master",
+    ticket_labeler: TicketLabeler = None,
+    env_name: str = "prod",
+    vpc_name: str = "prod",
+    dry_run=False,
+    fetch_before=True,
+    compact_shas=False,
+    git_backend="subprocess",
+    fetch_mode: str = "always",
+    fetch_filter: str = "",
+    pr_discovery: str = "associated",
+) -> Tuple[ChangeLog, Future]:
+    """
+    like build_changelog, but returns once every PR is known while ticket_labeler may still be labeling
+
+    :return: (parsed changelog, future of the number of jira tickets found)
+    """
+    if pr_discovery not in PR_DISCOVERY_MODES:
+        raise ValueError(
+            f"unknown pr_discovery {pr_discovery}. Choose from {', '.join(PR_DISCOVERY_MODES)}"
+        )
+
+    owns_git_backend = isinstance(git_backend, str)
+    if owns_git_backend:
+        git_backend = make_git_backend(git_backend, repo_dir)
+
+    try:
+        if not branch_exists(repo_dir, search_branch, backend=git_backend):
+            raise ValueError(search_branch + " branch does not exist in " + repo_dir)
+
+        logger.info(
+            f"Pulling deploy SHAs from {search_branch} branch in {repo_dir}. {from_revision}...{to_revision}"
+        )
+        shas = SHAs(
+            repo_dir,
+            fetch_before,
+            compact=compact_shas,
+            backend=git_backend,
+            fetch_mode=fetch_mode,
+            fetch_filter=fetch_filter,
+        )
+        if fetch_before:
+            with stats.stage("fetch"):
+                shas.fetch(from_revision, to_revision, branch=search_branch)
+
+        logger.info(
+            f"Pulling {prs.repo_owner}/{prs.repo_name} PR bodies from GitHub as deploy SHAs are found."
+        )
+        # SHAs stream into PR lookups, and PR's into the changelog & labeler, see pipeline
+        changelog = ChangeLog([], prs.repo_owner, prs.repo_name)
+        if pr_discovery == "merge_commits":
+            pull_request_dicts = iter_merged_pull_request_dicts_by_commit(
+                shas.iter_shas_with_prs(from_revision, to_revision), prs
+            )
+        else:
+            pull_request_dicts = iter_merged_pull_request_dicts(
+                shas.iter_shas(from_revision, to_revision), prs
+            )
+        num_jira_tickets = start_pipeline(
+            pull_request_dicts,
+            changelog,
+            ticket_labeler,
+            env_name,
+            vpc_name,
+            dry_run=dry_run,
+        )
+    finally:
+        if owns_git_backend:
+            git_backend.close()
+
+    return changelog, num_jira_tickets
+
+
 def release_notes(
     github_token: str,
     from_revision: str,
@@ -99,57 +299,356 @@ def release_notes(
     verbose=False,
     dry_run=False,
     fetch_before=True,
-):
+    pr_chunk_size: int = 50,
+    max_concurrency: int = 4,
+    cache_dir: str = "",
+    compact_shas=False,
+    git_backend="subprocess",
+    fetch_mode: str = "always",
+    fetch_filter: str = "",
+    label_concurrency: int = 4,
+    bulk_jira_labels=False,
+    pr_label_backend: str = "rest",
+    github_url: str = "",
+    slack_webhook_url: str = SLACK_WEBHOOK_URL,
+    pr_discovery: str = "associated",
+    pr_fields: str = "full",
+    two_phase_prs=False,
+    graph_ql: GraphQL = None,
+    cache: Cache = None,
+    ticket_labeler: TicketLabeler = None,
+    post_before_labeling=False,
+) -> str:
+    """
+    Runs async_release_notes on a new event loop, so the git walk overlaps the GitHub lookups.
+    Called from a thread that is already running an event loop, it runs without asyncio instead.
 
-    if not repo_dir:
-        repo_dir = get_default_repo_dir()
+    :param pr_discovery: how to find the PR's of the deployed commits, one of prs.PR_DISCOVERY_MODES.
+        merge_commits fetches PR's named by merge & squash commit subjects by number
+        and only looks up the commits history doesn't explain one by one.
+    :param pr_fields: which PR fields to fetch, one of prs.PR_FIELD_PROFILES.
+        titles never downloads PR bodies, for runs that only label: the changelog has no sections
+        and only Jira tickets in PR titles are labeled.
+    :param two_phase_prs: look up SHAs without PR bodies, then fetch bodies once per merged PR
+    :param github_url: url of a GitHub Enterprise server, ex: https://github.company.com. github.com if empty.
+    :param slack_webhook_url: url slack_webhook_key goes under, for a Slack stand-in
+    :param git_backend: name of a git backend from git_backends.GIT_BACKENDS, or a backend instance.
+        Pass the same instance to several calls against one repo to reuse its handle on the repo.
+    :param graph_ql: GitHub client to reuse between calls, so its connections stay open. Made for this call if not passed.
+    :param cache: cache to use instead of one in cache_dir
+    :param ticket_labeler: labeler for org_name/repo_name to reuse between calls, so its Jira session stays open.
+        Made for this call from the jira & label params if not passed. Ignored if label_tickets is False.
+    :param post_before_labeling: post the release notes to Slack as soon as every PR is known,
+        then post how many jira tickets were found once labeling is done
+    :return: the release notes, followed by the jira tickets found message if post_before_labeling
+    """
+    # every param, passed on as is
+    params = dict(locals())
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(async_release_notes(**params))
 
-    if not branch_exists(repo_dir, search_branch):
-        raise ValueError(search_branch + " branch does not exist in " + repo_dir)
+    with stats.stage("release_notes"):
+        params["repo_dir"], prs, params["ticket_labeler"] = _release_clients(**params)
+        changelog, labeling = start_changelog(prs, **_changelog_params(params))
+        if _posts_before_labeling(post_before_labeling, params["ticket_labeler"]):
+            try:
+                early_text = _publish(
+                    format_changelog(
+                        changelog,
+                        env_name,
+                        from_revision,
+                        to_revision,
+                        None,
+                        org_name,
+                        repo_name,
+                    ),
+                    **_publish_params(params),
+                )
+            finally:
+                # labeling goes on if posting fails, wait for it instead of leaving it behind
+                num_jira_tickets = labeling.result()
+            return _publish_tickets_found(early_text, num_jira_tickets, params)
 
-    logger.info(
-        f"Pulling deploy SHAs from {search_branch} branch in {repo_dir}. {from_revision}...{to_revision}"
-    )
-    deploy_shas = SHAs(repo_dir, fetch_before).get_shas(
-        from_revision, to_revision, branch=search_branch
-    )
+        num_jira_tickets = labeling.result()
+        if label_tickets:
+            logger.info(f"labeled {num_jira_tickets} tickets")
+        return _publish(
+            format_changelog(
+                changelog,
+                env_name,
+                from_revision,
+                to_revision,
+                num_jira_tickets,
+                org_name,
+                repo_name,
+            ),
+            **_publish_params(params),
+        )
 
-    logger.info(f"Pulling PR bodies from GitHub. Searching {len(deploy_shas)} SHAs.")
-    prs = PRs(github_token, org_name, repo_name)
 
-    # Shas might be associated with unmerged pr's if the pr rebased itself to include that sha
-    # We only want merged pr's
-    pull_request_dicts = [
-        pr for pr in prs.pull_request_dicts(deploy_shas) if pr["merged"]
-    ]
+async def async_release_notes(
+    github_token: str,
+    from_revision: str,
+    to_revision: str,
+    org_name: str,
+    repo_name: str,
+    repo_dir: str = None,
+    search_branch: str = "master",
+    slack_webhook_key: str = "",
+    env_name: str = "prod",
+    vpc_name: str = "prod",
+    jira_token: str = "",
+    jira_username: str = "",
+    jira_url: str = "",
+    label_tickets=True,
+    verbose=False,
+    dry_run=False,
+    fetch_before=True,
+    pr_chunk_size: int = 50,
+    max_concurrency: int = 4,
+    cache_dir: str = "",
+    compact_shas=False,
+    git_backend="subprocess",
+    fetch_mode: str = "always",
+    fetch_filter: str = "",
+    label_concurrency: int = 4,
+    bulk_jira_labels=False,
+    pr_label_backend: str = "rest",
+    github_url: str = "",
+    slack_webhook_url: str = SLACK_WEBHOOK_URL,
+    pr_discovery: str = "associated",
+    pr_fields: str = "full",
+    two_phase_prs=False,
+    graph_ql: GraphQL = None,
+    cache: Cache = None,
+    ticket_labeler: TicketLabeler = None,
+    post_before_labeling=False,
+    executor: Executor = None,
+) -> str:
+    """
+    release notes for an asyncio program, ex: a deploy orchestrator. See release_notes for the other params.
+    The git walk runs on the event loop and streams SHAs to the GitHub lookups, which run on executor threads
+    along with labeling & posting to Slack as GitHub, Jira & Slack are only reached through blocking clients.
+    The event loop is never blocked.
+
+    :param executor: where to run the blocking stages, the event loop's default executor if None
+    """
+    params = dict(locals())
+    del params["executor"]
+
+    with stats.stage("release_notes"):
+        loop = asyncio.get_running_loop()
+        run = partial(loop.run_in_executor, executor)
+
+        # connecting to Jira blocks
+        params["repo_dir"], prs, params["ticket_labeler"] = await run(
+            partial(_release_clients, **params)
+        )
+        if git_backend == "subprocess" and _loop_can_run_git():
+            params["git_backend"] = AsyncioGitBackend(params["repo_dir"], loop)
+
+        changelog, labeling = await run(
+            partial(start_changelog, prs, **_changelog_params(params))
+        )
+        publish = partial(_publish, **_publish_params(params))
+
+        if _posts_before_labeling(post_before_labeling, params["ticket_labeler"]):
+            try:
+                early_text = await run(
+                    publish,
+                    format_changelog(
+                        changelog,
+                        env_name,
+                        from_revision,
+                        to_revision,
+                        None,
+                        org_name,
+                        repo_name,
+                    ),
+                )
+            finally:
+                # labeling goes on if posting fails, wait for it instead of leaving it behind
+                num_jira_tickets = await asyncio.wrap_future(labeling)
+            return await run(
+                _publish_tickets_found, early_text, num_jira_tickets, params
+            )
+
+        num_jira_tickets = await asyncio.wrap_future(labeling)
+        if label_tickets:
+            logger.info(f"labeled {num_jira_tickets} tickets")
+        return await run(
+            publish,
+            format_changelog(
+                changelog,
+                env_name,
+                from_revision,
+                to_revision,
+                num_jira_tickets,
+                org_name,
+                repo_name,
+            ),
+        )
 
-    num_jira_tickets: int = 0
 
-    if label_tickets:
+def _release_clients(
+    github_token: str,
+    org_name: str,
+    repo_name: str,
+    repo_dir: str,
+    jira_token: str,
+    jira_username: str,
+    jira_url: str,
+    label_tickets: bool,
+    pr_chunk_size: int,
+    max_concurrency: int,
+    cache_dir: str,
+    label_concurrency: int,
+    bulk_jira_labels: bool,
+    pr_label_backend: str,
+    github_url: str,
+    pr_fields: str,
+    two_phase_prs: bool,
+    graph_ql: Optional[GraphQL],
+    cache: Optional[Cache],
+    ticket_labeler: Optional[TicketLabeler],
+    **_,
+) -> Tuple[str, PRs, Optional[TicketLabeler]]:
+    """
+    makes what release_notes needs that wasn't passed in
+
+    :return: (repo_dir, PRs, ticket labeler or None if label_tickets is False)
+    """
+    if not repo_dir:
+        repo_dir = get_default_repo_dir()
+
+    if graph_ql is None:
+        # one pooled GitHub client for the whole run so connections are reused
+        graph_ql = GraphQL(
+            github_graphql_url(github_url),
+            github_token,
+            pool_size=max(10, max_concurrency),
+        )
+
+    if cache is None and cache_dir:
+        cache = Cache(cache_dir)
+
+    prs = PRs(
+        github_token,
+        org_name,
+        repo_name,
+        chunk_size=pr_chunk_size,
+        max_concurrency=max_concurrency,
+        cache=cache,
+        graph_ql=graph_ql,
+        field_profile=pr_fields,
+        two_phase=two_phase_prs,
+    )
+
+    if not label_tickets:
+        ticket_labeler = None
+    elif ticket_labeler is None:
         ticket_labeler = TicketLabeler(
             github_token,
-            pull_request_dicts,
+            [],
             org_name,
             repo_name,
             jira_token,
             jira_username,
             jira_url,
+            graph_ql=graph_ql,
+            max_concurrency=label_concurrency,
+            bulk_jira_labels=bulk_jira_labels,
+            pr_label_backend=pr_label_backend,
+            cache=cache,
+            github_url=github_url,
         )
-        num_jira_tickets = ticket_labeler.label_tickets(
-            env_name, vpc_name, dry_run=dry_run
+
+    return repo_dir, prs, ticket_labeler
+
+
+def _changelog_params(params: dict) -> dict:
+    """start_changelog's params out of release_notes'"""
+    return {
+        key: params[key]
+        for key in (
+            "from_revision",
+            "to_revision",
+            "repo_dir",
+            "search_branch",
+            "ticket_labeler",
+            "env_name",
+            "vpc_name",
+            "dry_run",
+            "fetch_before",
+            "compact_shas",
+            "git_backend",
+            "fetch_mode",
+            "fetch_filter",
+            "pr_discovery",
         )
-        logger.info(f"labeled {num_jira_tickets} tickets")
+    }
 
-    slack_text = turn_changelog_into_string(
-        pull_request_dicts,
-        env_name,
-        from_revision,
-        to_revision,
-        num_jira_tickets,
-        org_name,
-        repo_name,
+
+def _publish_params(params: dict) -> dict:
+    """_publish's params out of release_notes', besides the text"""
+    return {
+        key: params[key]
+        for key in (
+            "env_name",
+            "slack_webhook_key",
+            "slack_webhook_url",
+            "verbose",
+            "dry_run",
+        )
+    }
+
+
+def _posts_before_labeling(
+    post_before_labeling: bool, ticket_labeler: Optional[TicketLabeler]
+) -> bool:
+    """without a jira token no tickets get labeled, so there's nothing to follow up on"""
+    return (
+        post_before_labeling
+        and ticket_labeler is not None
+        and bool(ticket_labeler.jira_token)
+    )
+
+
+def _publish_tickets_found(early_text: str, num_jira_tickets: int, params: dict) -> str:
+    """posts the follow up to release notes posted before labeling was done"""
+    logger.info(f"labeled {num_jira_tickets} tickets")
+    followup_text = _publish(
+        format_tickets_found(
+            params["env_name"],
+            params["from_revision"],
+            params["to_revision"],
+            num_jira_tickets,
+            params["org_name"],
+            params["repo_name"],
+        ),
+        **_publish_params(params),
     )
+    return early_text + "\n" + followup_text
+
+
+def _loop_can_run_git() -> bool:
+    # before python 3.8 only event loops on the main thread could wait for child processes
+    return (
+        sys.version_info >= (3, 8)
+        or threading.current_thread() is threading.main_thread()
+    )
+
 
+def _publish(
+    slack_text: str,
+    env_name: str,
+    slack_webhook_key: str,
+    slack_webhook_url: str,
+    verbose: bool,
+    dry_run: bool,
+) -> str:
     if verbose:
         print(slack_text)
 
@@ -158,7 +657,9 @@ def release_notes(
 
     if slack_webhook_key:
         logger.info(f"Pushing ChangeLog data to {env_name} Slack channel.")
-        post_deployment_message_to_slack(slack_webhook_key, slack_text)
+        post_deployment_message_to_slack(
+            slack_webhook_key, slack_text, slack_webhook_url
+        )
     else:
         logger.warning("no slack webhook key. Not pushing to slack.")
 
@@ -167,6 +668,222 @@ def release_notes(
     return slack_text
 
 
+MULTI_REPO_OUTPUTS = ("per_repo", "combined")
+
+# keys every target of a multi repo config needs
+TARGET_KEYS = ("org_name", "repo_name", "repo_dir", "from_revision", "to_revision")
+
+
+def load_targets(config_path: str) -> List[dict]:
+    """
+    reads the repos to release together from a JSON config file like:
+
+        {"targets": [
+            {"org_name": "org", "repo_name": "api", "repo_dir": "/src/api",
+             "from_revision": "0782415", "to_revision": "8038fc3", "search_branch": "main"},
+            ...
+        ]}
+
+    search_branch is optional.
+
+    :raises ValueError: if a target is missing a key
+    """
+    with open(config_path) as config_file:
+        targets = json.load(config_file)["targets"]
+
+    for i, target in enumerate(targets):
+        missing = [key for key in TARGET_KEYS if not target.get(key)]
+        if missing:
+            raise ValueError(
+                f"target {i} in {config_path} is missing {', '.join(missing)}"
+            )
+    return targets
+
+
+@stats.stage("format_changelog")
+def format_multi_repo_changelog(
+    targets: List[dict],
+    changelogs: List[ChangeLog],
+    env_name: str,
+    num_jira_tickets: int,
+    output: str = "per_repo",
+) -> str:
+    """
+    like format_changelog, for the changelogs of several repos released together
+
+    :param targets: the repos changelogs are for, see load_targets
+    :param output: "per_repo" for a section per repo, "combined" to mix every repo's changes together
+    """
+    pull_request_dicts = [
+        pr for changelog in changelogs for pr in changelog.pull_request_dicts
+    ]
+
+    now_str = datetime.datetime.now().isoformat(" ")
+    title_line = f"*{env_name.upper()} RELEASE* {now_str} ({len(targets)} repos)"
+    if is_hotfix(pull_request_dicts, env_name):
+        title_line = ":fire: *HOTFIX* :fire: " + title_line
+
+    messages = [
+        title_line,
+        f"{num_jira_tickets} jira tickets found.",
+        f"{len(pull_request_dicts)} PRs found.",
+    ]
+
+    for target, changelog in zip(targets, changelogs):
+        repo_line = (
+            f"{target['org_name']}/{target['repo_name']} "
+            f"({compare_link(target['org_name'], target['repo_name'], target['from_revision'], target['to_revision'])}): "
+            f"{len(changelog.pull_request_dicts)} PRs"
+        )
+        if output == "per_repo":
+            messages.append(f"\n*{repo_line}*")
+            messages.extend(changelog_sections([changelog], env_name))
+        else:
+            messages.append(repo_line)
+
+    if output == "combined":
+        messages.extend(changelog_sections(changelogs, env_name))
+
+    return "\n".join(messages)
+
+
+@stats.stage("release_notes")
+def multi_repo_release_notes(
+    github_token: str,
+    targets: List[dict],
+    search_branch: str = "master",
+    slack_webhook_key: str = "",
+    env_name: str = "prod",
+    vpc_name: str = "prod",
+    jira_token: str = "",
+    jira_username: str = "",
+    jira_url: str = "",
+    label_tickets=True,
+    verbose=False,
+    dry_run=False,
+    fetch_before=True,
+    pr_chunk_size: int = 50,
+    max_concurrency: int = 4,
+    cache_dir: str = "",
+    compact_shas=False,
+    git_backend: str = "subprocess",
+    fetch_mode: str = "always",
+    fetch_filter: str = "",
+    label_concurrency: int = 4,
+    bulk_jira_labels=False,
+    pr_label_backend: str = "rest",
+    github_url: str = "",
+    slack_webhook_url: str = SLACK_WEBHOOK_URL,
+    pr_discovery: str = "associated",
+    pr_fields: str = "full",
+    two_phase_prs=False,
+    repo_concurrency: int = 4,
+    output: str = "per_repo",
+):
+    """
+    release_notes for several repos deployed together, posted as one Slack message.
+    Repos are read up to repo_concurrency at a time, sharing one GitHub connection pool & cache.
+    Each repo's PR's are labeled as they're found. Jira tickets are labeled once all repos are read,
+    so a ticket mentioned in several repos is only transitioned & labeled once.
+
+    :param targets: repos to release, see load_targets
+    :param search_branch: branch of targets that don't name their own
+    :param git_backend: name of the git backend each repo gets its own instance of
+    :param output: see format_multi_repo_changelog
+    See release_notes for the other params.
+    """
+    if output not in MULTI_REPO_OUTPUTS:
+        raise ValueError(
+            f"unknown output {output}. Choose from {', '.join(MULTI_REPO_OUTPUTS)}"
+        )
+
+    # max_concurrency queries per repo, all through one pooled client
+    graph_ql = GraphQL(
+        github_graphql_url(github_url),
+        github_token,
+        pool_size=max(10, max_concurrency * repo_concurrency),
+    )
+
+    cache = Cache(cache_dir) if cache_dir else None
+
+    def build_target_changelog(target: dict) -> ChangeLog:
+        prs = PRs(
+            github_token,
+            target["org_name"],
+            target["repo_name"],
+            chunk_size=pr_chunk_size,
+            max_concurrency=max_concurrency,
+            cache=cache,
+            graph_ql=graph_ql,
+            field_profile=pr_fields,
+            two_phase=two_phase_prs,
+        )
+
+        ticket_labeler = None
+        if label_tickets:
+            # no jira token, tickets are labeled for every repo at once below
+            ticket_labeler = TicketLabeler(
+                github_token,
+                [],
+                target["org_name"],
+                target["repo_name"],
+                graph_ql=graph_ql,
+                max_concurrency=label_concurrency,
+                pr_label_backend=pr_label_backend,
+                github_url=github_url,
+            )
+
+        changelog, _ = build_changelog(
+            prs,
+            target["from_revision"],
+            target["to_revision"],
+            target["repo_dir"],
+            target.get("search_branch") or search_branch,
+            ticket_labeler,
+            env_name,
+            vpc_name,
+            dry_run=dry_run,
+            fetch_before=fetch_before,
+            compact_shas=compact_shas,
+            git_backend=git_backend,
+            fetch_mode=fetch_mode,
+            fetch_filter=fetch_filter,
+            pr_discovery=pr_discovery,
+        )
+        return changelog
+
+    changelogs = concurrent_map(build_target_changelog, targets, repo_concurrency)
+
+    num_jira_tickets = 0
+    if label_tickets and jira_token:
+        jira_labeler = TicketLabeler(
+            github_token,
+            [pr for changelog in changelogs for pr in changelog.pull_request_dicts],
+            "",
+            "",
+            jira_token,
+            jira_username,
+            jira_url,
+            max_concurrency=label_concurrency,
+            bulk_jira_labels=bulk_jira_labels,
+            cache=cache,
+            github_url=github_url,
+            jira_only=True,
+        )
+        num_jira_tickets = jira_labeler.label_tickets(
+            env_name, vpc_name, dry_run=dry_run
+        )
+        logger.info(f"labeled {num_jira_tickets} tickets")
+
+    slack_text = format_multi_repo_changelog(
+        targets, changelogs, env_name, num_jira_tickets, output
+    )
+
+    return _publish(
+        slack_text, env_name, slack_webhook_key, slack_webhook_url, verbose, dry_run
+    )
+
+
 def get_default_repo_dir():
     try:
         get_repo_dir_command = ["git", "rev-parse", "--show-toplevel"]
@@ -179,10 +896,11 @@ def get_default_repo_dir():
 def main(args: List[str]):
     parser = argparse.ArgumentParser()
     parser.add_argument("github_token", help="GitHub API token")
-    parser.add_argument("from_revision")
-    parser.add_argument("to_revision")
-    parser.add_argument("org_name")
-    parser.add_argument("repo_name")
+    # not needed with --config, which names them for every repo
+    parser.add_argument("from_revision", nargs="?", default="")
+    parser.add_argument("to_revision", nargs="?", default="")
+    parser.add_argument("org_name", nargs="?", default="")
+    parser.add_argument("repo_name", nargs="?", default="")
     parser.add_argument(
         "-r",
         "--repo_dir",
@@ -233,6 +951,134 @@ def main(args: List[str]):
         dest="fetch_before",
         default=True,
     )
+    parser.add_argument(
+        "--pr_chunk_size",
+        help="Number of SHAs to look up per GitHub query. Default is 50",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        help="Max number of GitHub queries in flight at once. Default is 4",
+        type=int,
+        dest="max_concurrency",
+        default=4,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache GitHub & Jira workflow lookups in between runs. No cache by default",
+        dest="cache_dir",
+        default="",
+    )
+    parser.add_argument(
+        "--compact_shas",
+        help="Have git filter commit messages instead of reading all of them. Faster on big ranges",
+        action="store_true",
+        dest="compact_shas",
+        default=False,
+    )
+    parser.add_argument(
+        "--git_backend",
+        help='How to read the git repo. Default is "subprocess"',
+        choices=list(GIT_BACKENDS),
+        default="subprocess",
+    )
+    parser.add_argument(
+        "--fetch_mode",
+        help='"smart" skips the fetch when both revisions are already local and deepens shallow clones '
+        'until the revisions meet. Default is "always"',
+        choices=FETCH_MODES,
+        default="always",
+    )
+    parser.add_argument(
+        "--fetch_filter",
+        help='Partial clone filter to fetch with, eg. "blob:none"',
+        default="",
+    )
+    parser.add_argument(
+        "--label_concurrency",
+        help="Max number of PR's/Jira tickets to label at once. Default is 4",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--bulk_jira_labels",
+        help="Label all Jira tickets at once with Jira Cloud's bulk edit API",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--pr_label_backend",
+        help="How to label PR's. rest labels them one at a time, "
+        "graphql labels many per request. Default is rest",
+        choices=PR_LABEL_BACKENDS,
+        default="rest",
+    )
+    parser.add_argument(
+        "--pr_discovery",
+        help="How to find the deployed PR's. associated looks up every commit's PR's, "
+        "merge_commits fetches the PR's named in merge & squash commit subjects by number "
+        "and only looks up the other commits. Default is associated",
+        choices=PR_DISCOVERY_MODES,
+        default="associated",
+    )
+    parser.add_argument(
+        "--pr_fields",
+        help="Which PR fields to fetch. titles never downloads PR bodies, for when you only need labeling: "
+        "the changelog has no sections and only Jira tickets in PR titles are labeled. Default is full",
+        choices=list(PR_FIELD_PROFILES),
+        default="full",
+    )
+    parser.add_argument(
+        "--two_phase_prs",
+        help="Look up SHAs without PR bodies, then fetch bodies once per merged PR. "
+        "Less to download when PR's span many commits or have big bodies",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--post_before_labeling",
+        help="Post the release notes to Slack as soon as every PR is known, "
+        "then post how many Jira tickets were found once they are labeled. Not with --config",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--stats",
+        help="Print how long each stage took, HTTP & git usage and cache hit rates",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--stats-json",
+        help="Write the --stats numbers to this file as JSON",
+        dest="stats_json",
+        default="",
+    )
+    parser.add_argument(
+        "--github_url",
+        help="GitHub Enterprise url, ex: https://github.company.com. Default is github.com",
+        default="",
+    )
+    parser.add_argument(
+        "--config",
+        help="JSON file of several repos to release together in one Slack message, "
+        "instead of from_revision, to_revision, org_name & repo_name. See load_targets",
+        default="",
+    )
+    parser.add_argument(
+        "--repo_concurrency",
+        help="With --config, max number of repos to read at once. Default is 4",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--output",
+        help="With --config, per_repo gives every repo its own section, "
+        "combined mixes their changes together. Default is per_repo",
+        choices=MULTI_REPO_OUTPUTS,
+        default="per_repo",
+    )
     parser.add_argument("--jira_token", help="Jira API token", default="")
     parser.add_argument("--jira_username", help='Eg. "bob@company.com"', default="")
     parser.add_argument(
@@ -240,6 +1086,19 @@ def main(args: List[str]):
     )
 
     parsed_args = parser.parse_args(args)
+    if not parsed_args.config and not all(
+        (
+            parsed_args.from_revision,
+            parsed_args.to_revision,
+            parsed_args.org_name,
+            parsed_args.repo_name,
+        )
+    ):
+        parser.error(
+            "from_revision, to_revision, org_name & repo_name are required without --config"
+        )
+    if parsed_args.config and parsed_args.post_before_labeling:
+        parser.error("--post_before_labeling only works without --config")
 
     logger.info(
         "Running release notes script with following options: "
@@ -259,6 +1118,26 @@ def main(args: List[str]):
                 "verbose": parsed_args.verbose,
                 "dry_run": parsed_args.dry_run,
                 "fetch_before": parsed_args.fetch_before,
+                "pr_chunk_size": parsed_args.pr_chunk_size,
+                "max_concurrency": parsed_args.max_concurrency,
+                "cache_dir": parsed_args.cache_dir,
+                "compact_shas": parsed_args.compact_shas,
+                "git_backend": parsed_args.git_backend,
+                "fetch_mode": parsed_args.fetch_mode,
+                "fetch_filter": parsed_args.fetch_filter,
+                "label_concurrency": parsed_args.label_concurrency,
+                "bulk_jira_labels": parsed_args.bulk_jira_labels,
+                "pr_label_backend": parsed_args.pr_label_backend,
+                "pr_discovery": parsed_args.pr_discovery,
+                "pr_fields": parsed_args.pr_fields,
+                "two_phase_prs": parsed_args.two_phase_prs,
+                "post_before_labeling": parsed_args.post_before_labeling,
+                "github_url": parsed_args.github_url,
+                "config": parsed_args.config,
+                "repo_concurrency": parsed_args.repo_concurrency,
+                "output": parsed_args.output,
+                "stats": parsed_args.stats,
+                "stats_json": parsed_args.stats_json,
                 "jira_token": "CENSORED",
                 "jira_username": parsed_args.jira_username,
                 "jira_url": parsed_args.jira_url,
@@ -269,13 +1148,7 @@ def main(args: List[str]):
     if parsed_args.verbose:
         logger.setLevel(logging.DEBUG)
 
-    return release_notes(
-        parsed_args.github_token,
-        parsed_args.from_revision,
-        parsed_args.to_revision,
-        parsed_args.org_name,
-        parsed_args.repo_name,
-        repo_dir=parsed_args.repo_dir,
+    options = dict(
         search_branch=parsed_args.search_branch,
         slack_webhook_key=parsed_args.slack_webhook_key,
         env_name=parsed_args.env_name,
@@ -286,4 +1159,53 @@ def main(args: List[str]):
         label_tickets=parsed_args.label_tickets,
         verbose=parsed_args.verbose,
         dry_run=parsed_args.dry_run,
+        fetch_before=parsed_args.fetch_before,
+        pr_chunk_size=parsed_args.pr_chunk_size,
+        max_concurrency=parsed_args.max_concurrency,
+        cache_dir=parsed_args.cache_dir,
+        compact_shas=parsed_args.compact_shas,
+        git_backend=parsed_args.git_backend,
+        fetch_mode=parsed_args.fetch_mode,
+        fetch_filter=parsed_args.fetch_filter,
+        label_concurrency=parsed_args.label_concurrency,
+        bulk_jira_labels=parsed_args.bulk_jira_labels,
+        pr_label_backend=parsed_args.pr_label_backend,
+        github_url=parsed_args.github_url,
+        pr_discovery=parsed_args.pr_discovery,
+        pr_fields=parsed_args.pr_fields,
+        two_phase_prs=parsed_args.two_phase_prs,
     )
+    if parsed_args.config:
+        run = partial(
+            multi_repo_release_notes,
+            parsed_args.github_token,
+            load_targets(parsed_args.config),
+            repo_concurrency=parsed_args.repo_concurrency,
+            output=parsed_args.output,
+            **options,
+        )
+    else:
+        run = partial(
+            release_notes,
+            parsed_args.github_token,
+            parsed_args.from_revision,
+            parsed_args.to_revision,
+            parsed_args.org_name,
+            parsed_args.repo_name,
+            repo_dir=parsed_args.repo_dir,
+            post_before_labeling=parsed_args.post_before_labeling,
+            **options,
+        )
+
+    if not (parsed_args.stats or parsed_args.stats_json):
+        return run()
+
+    stats_collector = stats.StatsCollector()
+    try:
+        with stats.collecting(stats_collector):
+            return run()
+    finally:
+        if parsed_args.stats:
+            print(stats_collector.summary())
+        if parsed_args.stats_json:
+            stats_collector.write_json(parsed_args.stats_json)
@@ -0,0 +1,495 @@
+"""
+Long running release notes server, so deploys don't pay for interpreter startup, imports,
+new GitHub/Jira connections & a cold cache every time.
+
+    python -m rocket_releaser serve github_token --port 8000 --jira_token ... --jira_url ...
+
+POST a JSON release to /release_notes:
+
+    {"org_name": "org", "repo_name": "api", "repo_dir": "/src/api",
+     "from_revision": "0782415", "to_revision": "8038fc3", "env_name": "staging", "slack_webhook_key": "..."}
+
+and get back {"text": release notes, "stats": stats of the run, see stats.StatsCollector}.
+Errors come back as {"error": message} with a 400 for bad requests & a 500 otherwise.
+Only repo dirs passed with --repo_dir when the server starts may be released.
+"""
+import argparse
+import json
+import logging
+import re
+import socket
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path, remove
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Dict, List, Sequence, Tuple
+
+from . import stats
+from .cache import Cache
+from .git_backends import GIT_BACKENDS, make_git_backend
+from .graphql import GraphQL, github_graphql_url
+from .prs import PR_DISCOVERY_MODES
+from .release_notes import TARGET_KEYS, release_notes
+from .shas import FETCH_MODES
+from .ticket_labeler import PR_LABEL_BACKENDS, TicketLabeler
+
+logger = logging.getLogger(__name__)
+
+# release_notes params a request may set besides TARGET_KEYS. Everything else is fixed when the server starts
+REQUEST_KEYS = (
+    "search_branch",
+    "slack_webhook_key",
+    "env_name",
+    "vpc_name",
+    "label_tickets",
+    "dry_run",
+    "fetch_before",
+    "compact_shas",
+    "fetch_mode",
+    "fetch_filter",
+    "pr_discovery",
+    "pr_fields",
+    "two_phase_prs",
+    "post_before_labeling",
+)
+
+# request keys that end up in git's argv
+GIT_ARG_KEYS = ("from_revision", "to_revision", "search_branch")
+
+# request keys that have to be true or false
+BOOL_KEYS = (
+    "label_tickets",
+    "dry_run",
+    "fetch_before",
+    "compact_shas",
+    "two_phase_prs",
+    "post_before_labeling",
+)
+
+# whitespace, control characters & what else git check-ref-format refuses in a ref name
+_BAD_REF_CHARS = re.compile(r"[\s\x00-\x1f\x7f~^:?*\[\\]")
+# ancestry suffixes a revision may follow a ref or sha with, ex: HEAD~2 or v1.0^
+_REVISION_SUFFIX = re.compile(r"(?:[~^][0-9]*)*$")
+
+
+def is_valid_ref_name(name: str) -> bool:
+    """
+    :return: whether name follows git check-ref-format's rules for a branch name
+    """
+    return (
+        bool(name)
+        and not _BAD_REF_CHARS.search(name)
+        and not name.startswith("-")
+        and not name.endswith(("/", "."))
+        and ".." not in name
+        and "@{" not in name
+        and name != "@"
+        and all(
+            part and not part.startswith(".") and not part.endswith(".lock")
+            for part in name.split("/")
+        )
+    )
+
+
+def is_valid_revision(revision: str) -> bool:
+    """
+    :return: whether revision is a ref name or sha, optionally followed by ~ & ^ ancestry suffixes
+    """
+    base = revision[: _REVISION_SUFFIX.search(revision).start()]
+    return is_valid_ref_name(base)
+
+
+class ReleaseNotesService:
+    """
+    runs release_notes for requests, keeping what can be reused between them:
+    the pooled GitHub client, an in memory (or cache_dir) cache of SHA -> PR lookups & Jira transitions,
+    a TicketLabeler per repo with its open Jira session, and a git backend per repo dir.
+
+    Releases run one at a time so each request's stats are only its own.
+    A request identical to one already waiting or running gets that one's result instead of running again,
+    ex: when a deploy is retried.
+    """
+
+    def __init__(
+        self,
+        github_token: str,
+        repo_dirs: Sequence[str] = (),
+        jira_token: str = "",
+        jira_username: str = "",
+        jira_url: str = "",
+        github_url: str = "",
+        cache_dir: str = "",
+        git_backend: str = "cat-file",
+        pr_chunk_size: int = 50,
+        max_concurrency: int = 4,
+        label_concurrency: int = 4,
+        bulk_jira_labels=False,
+        pr_label_backend: str = "rest",
+    ):
+        """
+        See release_notes for the other params.
+
+        :param repo_dirs: the repos requests may release, requests for any other repo_dir are rejected
+        """
+        self.github_token = github_token
+        # real path -> repo dir as configured
+        self.repo_dirs = {path.realpath(repo_dir): repo_dir for repo_dir in repo_dirs}
+        self.jira_token = jira_token
+        self.jira_username = jira_username
+        self.jira_url = jira_url
+        self.github_url = github_url
+        self.git_backend = git_backend
+        self.pr_chunk_size = pr_chunk_size
+        self.max_concurrency = max_concurrency
+        self.label_concurrency = label_concurrency
+        self.bulk_jira_labels = bulk_jira_labels
+        self.pr_label_backend = pr_label_backend
+
+        self.graph_ql = GraphQL(
+            github_graphql_url(github_url),
+            github_token,
+            pool_size=max(10, max_concurrency),
+        )
+        self.cache = Cache(cache_dir or None)
+
+        # (org, repo) -> labeler
+        self._ticket_labelers: Dict[Tuple[str, str], TicketLabeler] = {}
+        # repo dir -> git backend
+        self._git_backends = {}
+        self._release_lock = threading.Lock()
+        # request key -> result of the identical request waiting or running
+        self._pending: Dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+
+    def close(self):
+        with self._release_lock:
+            for git_backend in self._git_backends.values():
+                git_backend.close()
+            self._git_backends = {}
+            self.graph_ql.close()
+            self.cache.close()
+
+    def check_request(self, request: dict):
+        """
+        :raises ValueError: if request is missing a TARGET_KEYS key, has one that isn't in REQUEST_KEYS,
+            is for a repo_dir that isn't one of repo_dirs, has a revision or branch that isn't a valid ref,
+            or has a value of the wrong type
+        """
+        if not isinstance(request, dict):
+            raise ValueError("request should be a JSON object")
+
+        missing = [key for key in TARGET_KEYS if not request.get(key)]
+        if missing:
+            raise ValueError(f"request is missing {', '.join(missing)}")
+
+        unknown = set(request) - set(TARGET_KEYS) - set(REQUEST_KEYS)
+        if unknown:
+            raise ValueError(f"unknown request keys {', '.join(sorted(unknown))}")
+
+        if not isinstance(request["repo_dir"], str) or (
+            path.realpath(request["repo_dir"]) not in self.repo_dirs
+        ):
+            raise ValueError(f"repo_dir {request['repo_dir']} isn't served")
+
+        # the git backend is shared by every request on a repo_dir, so nothing that could throw it off gets to git
+        for key in GIT_ARG_KEYS:
+            value = request.get(key, "master")
+            is_valid = (
+                is_valid_ref_name if key == "search_branch" else is_valid_revision
+            )
+            if not isinstance(value, str) or not is_valid(value):
+                raise ValueError(f"bad {key} {value!r}")
+
+        for key in BOOL_KEYS:
+            if not isinstance(request.get(key, False), bool):
+                raise ValueError(f"{key} should be true or false")
+
+        for key in set(REQUEST_KEYS) - set(GIT_ARG_KEYS) - set(BOOL_KEYS):
+            if not isinstance(request.get(key, ""), str):
+                raise ValueError(f"{key} should be a string")
+
+        if request.get("fetch_mode", "always") not in FETCH_MODES:
+            raise ValueError(
+                f"unknown fetch_mode {request['fetch_mode']}. Choose from {', '.join(FETCH_MODES)}"
+            )
+
+        if request.get("pr_discovery", "associated") not in PR_DISCOVERY_MODES:
+            raise ValueError(
+                f"unknown pr_discovery {request['pr_discovery']}. Choose from {', '.join(PR_DISCOVERY_MODES)}"
+            )
+
+    def release_notes(self, request: dict) -> dict:
+        """
+        :param request: TARGET_KEYS & optionally REQUEST_KEYS params for release_notes
+        :return: {"text": release notes, "stats": StatsCollector.to_dict() of the run}
+        :raises ValueError: if request isn't valid, see check_request
+        """
+        self.check_request(request)
+
+        key = json.dumps(request, sort_keys=True)
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = future = Future()
+
+        if pending is not None:
+            logger.info(
+                f"{request['org_name']}/{request['repo_name']} request is already pending, waiting for it"
+            )
+            return pending.result()
+
+        try:
+            future.set_result(self._release_notes(request))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+
+        return future.result()
+
+    def _release_notes(self, request: dict) -> dict:
+        with self._release_lock:
+            collector = stats.StatsCollector()
+            with stats.collecting(collector):
+                text = release_notes(
+                    self.github_token,
+                    request["from_revision"],
+                    request["to_revision"],
+                    request["org_name"],
+                    request["repo_name"],
+                    repo_dir=self.repo_dirs[path.realpath(request["repo_dir"])],
+                    search_branch=request.get("search_branch", "master"),
+                    slack_webhook_key=request.get("slack_webhook_key", ""),
+                    env_name=request.get("env_name", "prod"),
+                    vpc_name=request.get("vpc_name", request.get("env_name", "prod")),
+                    jira_token=self.jira_token,
+                    jira_username=self.jira_username,
+                    jira_url=self.jira_url,
+                    label_tickets=request.get("label_tickets", True),
+                    dry_run=request.get("dry_run", False),
+                    fetch_before=request.get("fetch_before", True),
+                    pr_chunk_size=self.pr_chunk_size,
+                    max_concurrency=self.max_concurrency,
+                    compact_shas=request.get("compact_shas", False),
+                    git_backend=self._get_git_backend(
+                        self.repo_dirs[path.realpath(request["repo_dir"])]
+                    ),
+                    fetch_mode=request.get("fetch_mode", "always"),
+                    fetch_filter=request.get("fetch_filter", ""),
+                    pr_discovery=request.get("pr_discovery", "associated"),
+                    pr_fields=request.get("pr_fields", "full"),
+                    two_phase_prs=request.get("two_phase_prs", False),
+                    post_before_labeling=request.get("post_before_labeling", False),
+                    label_concurrency=self.label_concurrency,
+                    bulk_jira_labels=self.bulk_jira_labels,
+                    pr_label_backend=self.pr_label_backend,
+                    github_url=self.github_url,
+                    graph_ql=self.graph_ql,
+                    cache=self.cache,
+                    ticket_labeler=self._get_ticket_labeler(
+                        request["org_name"], request["repo_name"]
+                    )
+                    if request.get("label_tickets", True)
+                    else None,
+                )
+            return {"text": text, "stats": collector.to_dict()}
+
+    def _get_git_backend(self, repo_dir: str):
+        if repo_dir not in self._git_backends:
+            self._git_backends[repo_dir] = make_git_backend(self.git_backend, repo_dir)
+        return self._git_backends[repo_dir]
+
+    def _get_ticket_labeler(self, org_name: str, repo_name: str) -> TicketLabeler:
+        if (org_name, repo_name) not in self._ticket_labelers:
+            self._ticket_labelers[(org_name, repo_name)] = TicketLabeler(
+                self.github_token,
+                [],
+                org_name,
+                repo_name,
+                self.jira_token,
+                self.jira_username,
+                self.jira_url,
+                graph_ql=self.graph_ql,
+                max_concurrency=self.label_concurrency,
+                bulk_jira_labels=self.bulk_jira_labels,
+                pr_label_backend=self.pr_label_backend,
+                cache=self.cache,
+                github_url=self.github_url,
+            )
+        return self._ticket_labelers[(org_name, repo_name)]
+
+
+def make_handler_class(service: ReleaseNotesService):
+    class ReleaseNotesHandler(BaseHTTPRequestHandler):
+        def address_string(self):
+            # unix socket clients don't have an address
+            return self.client_address[0] if self.client_address else "unix socket"
+
+        def _respond(self, status: int, response: dict):
+            content = json.dumps(response).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._respond(200, {"status": "ok"})
+            else:
+                self._respond(404, {"error": f"no GET {self.path}"})
+
+        def do_POST(self):
+            if self.path != "/release_notes":
+                self._respond(404, {"error": f"no POST {self.path}"})
+                return
+
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                response = service.release_notes(json.loads(self.rfile.read(length)))
+            except ValueError as e:
+                # includes bad JSON
+                self._respond(400, {"error": str(e)})
+            except Exception as e:
+                logger.exception("release notes failed")
+                self._respond(500, {"error": str(e)})
+            else:
+                self._respond(200, response)
+
+    return ReleaseNotesHandler
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if path.exists(self.server_address):
+            remove(self.server_address)
+        super().server_bind()
+
+
+def make_server(
+    service: ReleaseNotesService,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    socket_path="",
+):
+    """
+    :param socket_path: unix socket to listen on instead of host & port
+    :return: server for service, call serve_forever() on it to start serving
+    """
+    handler_class = make_handler_class(service)
+    if socket_path:
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("unix sockets aren't supported on this platform")
+        return ThreadingUnixHTTPServer(socket_path, handler_class)
+
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    return server
+
+
+def main(args: List[str]):
+    parser = argparse.ArgumentParser(prog="python -m rocket_releaser serve")
+    parser.add_argument("github_token", help="GitHub API token")
+    parser.add_argument("--host", help='Default is "127.0.0.1"', default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="Default is 8000", default=8000)
+    parser.add_argument(
+        "--socket",
+        help="Unix socket to listen on instead of --host & --port",
+        dest="socket_path",
+        default="",
+    )
+    parser.add_argument(
+        "--repo_dir",
+        help="Repo dir requests may release. Pass once per repo",
+        dest="repo_dirs",
+        action="append",
+        required=True,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory to cache GitHub & Jira workflow lookups in. In memory by default",
+        dest="cache_dir",
+        default="",
+    )
+    parser.add_argument(
+        "--git_backend",
+        help='How to read the git repos. Default is "cat-file", which keeps a git process open per repo',
+        choices=list(GIT_BACKENDS),
+        default="cat-file",
+    )
+    parser.add_argument(
+        "--pr_chunk_size",
+        help="Number of SHAs to look up per GitHub query. Default is 50",
+        type=int,
+        default=50,
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        help="Max number of GitHub queries in flight at once. Default is 4",
+        type=int,
+        dest="max_concurrency",
+        default=4,
+    )
+    parser.add_argument(
+        "--label_concurrency",
+        help="Max number of PR's/Jira tickets to label at once. Default is 4",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--bulk_jira_labels",
+        help="Label all Jira tickets at once with Jira Cloud's bulk edit API",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--pr_label_backend",
+        help="How to label PR's. Default is rest",
+        choices=PR_LABEL_BACKENDS,
+        default="rest",
+    )
+    parser.add_argument(
+        "--github_url",
+        help="GitHub Enterprise url, ex: https://github.company.com. Default is github.com",
+        default="",
+    )
+    parser.add_argument("--jira_token", help="Jira API token", default="")
+    parser.add_argument("--jira_username", help='Eg. "bob@company.com"', default="")
+    parser.add_argument(
+        "--jira_url", help='Eg. "https://company.atlassian.net"', default=""
+    )
+
+    parsed_args = parser.parse_args(args)
+
+    service = ReleaseNotesService(
+        parsed_args.github_token,
+        parsed_args.repo_dirs,
+        jira_token=parsed_args.jira_token,
+        jira_username=parsed_args.jira_username,
+        jira_url=parsed_args.jira_url,
+        github_url=parsed_args.github_url,
+        cache_dir=parsed_args.cache_dir,
+        git_backend=parsed_args.git_backend,
+        pr_chunk_size=parsed_args.pr_chunk_size,
+        max_concurrency=parsed_args.max_concurrency,
+        label_concurrency=parsed_args.label_concurrency,
+        bulk_jira_labels=parsed_args.bulk_jira_labels,
+        pr_label_backend=parsed_args.pr_label_backend,
+    )
+    server = make_server(
+        service, parsed_args.host, parsed_args.port, parsed_args.socket_path
+    )
+    logger.info(
+        f"serving release notes on {parsed_args.socket_path or f'{parsed_args.host}:{parsed_args.port}'}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -1,30 +1,69 @@
 import subprocess
 import logging
+import time
 from os import path
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import re
 
+from .git_backends import SubprocessGitBackend
+
 logger = logging.getLogger(__name__)
 
+COMMIT_LINE_RE = re.compile(r"commit (\w+)$")
+CHERRY_PICK_PREFIX = "(cherry picked from commit "
 
-def branch_exists(repo_dir: str, branch_name: str):
-    try:
-        base_args = ["git", f'--git-dir={path.join(repo_dir, ".git")}']
-        subprocess.check_call(
-            base_args + ["show-ref", "--verify", "--quiet", "refs/heads/" + branch_name]
-        )
-        return True
-    except subprocess.CalledProcessError:
-        return False
+# subjects GitHub gives the commits it merges PR's with
+MERGE_PR_SUBJECT_RE = re.compile(r"Merge pull request #(\d+) ")
+SQUASH_PR_SUBJECT_RE = re.compile(r"\(#(\d+)\)$")
+
+# git extended regexes for message lines _parse_shas picks up
+SHA_LINE_GREPS = ["^commit [[:alnum:]_]+$", "^\\(cherry picked from commit "]
+
+# always: fetch the branch every time
+# smart: skip the fetch if the revisions are already local & deepen shallow clones until the range is complete
+FETCH_MODES = ("always", "smart")
+
+
+def branch_exists(repo_dir: str, branch_name: str, backend=None):
+    """
+    :param backend: git backend to ask. Defaults to a SubprocessGitBackend
+    """
+    return (backend or SubprocessGitBackend(repo_dir)).branch_exists(branch_name)
 
 
 class SHAs:
-    def __init__(self, repo_dir: str, fetch_before: bool = True):
+    def __init__(
+        self,
+        repo_dir: str,
+        fetch_before: bool = True,
+        compact: bool = False,
+        backend=None,
+        fetch_mode: str = "always",
+        fetch_filter: str = "",
+        deepen_by: int = 50,
+        max_deepen_attempts: int = 8,
+    ):
         """
         :param fetch_before: Whether to fetch branch to make sure you have it when calling for_branch.
+        :param fetch_mode: one of FETCH_MODES
+        :param fetch_filter: partial clone filter to fetch with, ex: "blob:none". We never need file contents.
+        :param deepen_by: commits to deepen a shallow clone by when the range isn't all local. Doubles every attempt.
+        :param max_deepen_attempts: how many times to deepen a shallow clone before giving up
+        :param compact: Whether to have git filter commit messages down to the ones with cherry-picked SHAs
+            instead of reading every commit message. Much less data to read on big ranges.
+        :param backend: git backend to read the repo with, see git_backends. Defaults to a SubprocessGitBackend
         """
 
         self.fetch_before = fetch_before
+        self.compact = compact
+        self.backend = backend or SubprocessGitBackend(repo_dir)
+
+        if fetch_mode not in FETCH_MODES:
+            raise ValueError(f"fetch_mode must be one of {FETCH_MODES}")
+        self.fetch_mode = fetch_mode
+        self.fetch_filter = fetch_filter
+        self.deepen_by = deepen_by
+        self.max_deepen_attempts = max_deepen_attempts
 
         self.base_args = [
             "git",
@@ -41,56 +80,163 @@ class SHAs:
         """
 
         if self.fetch_before:
-            fetch_args = self.base_args + [
-                "fetch",
-                "origin",
-                f"{branch}:{branch}",
-                "--update-head-ok",
-            ]
-
-            try:
-                subprocess.check_output(fetch_args)
-                logger.debug(f"Pulled branch with the following args: {fetch_args}")
-            except subprocess.CalledProcessError:
-                logger.exception("subprocess call failed")
-
-        rev_list_args = self.base_args + [
-            "rev-list",
-            # https://stackoverflow.com/questions/7251477/what-are-the-differences-between-double-dot-and-triple-dot-in-git-dif
-            # to be honest not sure what difference is between .. and ... when on same branch
-            # but staying with ... to be on safe side because it includes more
-            # I didn't find any differences when doing manual tests
-            from_revision + "..." + to_revision,
-            "--format=%B",  # raw body (unwrapped subject and body) https://git-scm.com/docs/git-rev-list
-        ]
+            self.fetch(from_revision, to_revision, branch)
 
+        shas = list(self.iter_shas(from_revision, to_revision))
+
+        logger.debug(f"rev-list SHAs: {shas}")
+
+        return shas
+
+    def fetch(
+        self, from_revision: str, to_revision: str, branch: str = "master"
+    ) -> str:
+        """
+        Fetches branch so from_revision...to_revision can be read locally.
+        :return: description of the fetch strategy that ran
+        """
+        start = time.perf_counter()
         try:
-            commit_msgs = subprocess.check_output(rev_list_args).decode("utf-8")
+            strategy = self._fetch(from_revision, to_revision, branch)
         except subprocess.CalledProcessError:
             logger.exception("subprocess call failed")
-            commit_msgs = ""
-
-        logger.debug(f"rev-list commit messages: {commit_msgs}")
+            strategy = "failed fetch"
 
-        shas = self._get_shas(commit_msgs)
+        logger.info(
+            f"fetch strategy: {strategy}. Took {time.perf_counter() - start:.2f}s"
+        )
+        return strategy
+
+    def _fetch(self, from_revision: str, to_revision: str, branch: str) -> str:
+        fetch_args = [f"--filter={self.fetch_filter}"] if self.fetch_filter else []
+        smart = self.fetch_mode == "smart"
+
+        if smart and self._range_is_local(from_revision, to_revision):
+            return "skipped fetch, both revisions are already local"
+
+        self.backend.fetch(branch, fetch_args)
+        strategy = f"partial fetch ({self.fetch_filter})" if fetch_args else "fetch"
+
+        if smart and self.backend.is_shallow():
+            # a shallow clone may not go back far enough to find where the revisions split
+            deepened = 0
+            depth = self.deepen_by
+            for _ in range(self.max_deepen_attempts):
+                if self.backend.merge_base(from_revision, to_revision):
+                    break
+                if not self.backend.is_shallow():
+                    # whole history is here, deepening won't help
+                    break
+                self.backend.fetch(branch, fetch_args + [f"--deepen={depth}"])
+                deepened += depth
+                depth *= 2
+            if deepened:
+                strategy += f", deepened shallow clone by {deepened} commits"
+
+        return strategy
+
+    def _range_is_local(self, from_revision: str, to_revision: str) -> bool:
+        if not (
+            self.backend.revision_exists(from_revision)
+            and self.backend.revision_exists(to_revision)
+        ):
+            return False
+        # in a shallow clone the revisions may be local but not where they split
+        return not self.backend.is_shallow() or bool(
+            self.backend.merge_base(from_revision, to_revision)
+        )
 
-        logger.debug(f"rev-list SHAs: {shas}")
+    def iter_shas(self, from_revision: str, to_revision: str) -> Iterator[str]:
+        """
+        Yields SHAs from from_revision to to_revision as git outputs them, including cherry-picked SHAs.
+        Commit messages are read one at a time so the whole rev-list output is never held in memory.
+        If git fails nothing more is yielded and the failure is logged.
+        """
+        # https://stackoverflow.com/questions/7251477/what-are-the-differences-between-double-dot-and-triple-dot-in-git-dif
+        # to be honest not sure what difference is between .. and ... when on same branch
+        # but staying with ... to be on safe side because it includes more
+        # I didn't find any differences when doing manual tests
+        revision_range = from_revision + "..." + to_revision
+
+        if self.compact:
+            yield from self._iter_shas_compact(revision_range)
+            return
+
+        for sha, message in self.backend.commit_messages(revision_range):
+            yield sha
+            yield from self._parse_shas(message.split("\n"))
+
+    def iter_shas_with_prs(
+        self, from_revision: str, to_revision: str
+    ) -> Iterator[Tuple[str, Optional[int]]]:
+        """
+        Yields the same SHAs as iter_shas, each with the number of the PR it came in with if history says so:
+        "Merge pull request #N from ..." commits & the commits they merged in (reachable from their second parent
+        and from nothing else in the range) are PR N, squash merged commits with a "... (#N)" subject are PR N.
+        Everything else, including cherry-picked SHAs, comes with None.
+        Commits come out in topological order rather than git rev-list's default order,
+        and every commit message is read even if compact is set.
+        """
+        # sha -> the PR numbers of its children in the range, None for children that aren't part of a PR
+        child_prs: Dict[str, Set[Optional[int]]] = {}
+
+        for sha, parents, message in self.backend.topo_commits(
+            from_revision + "..." + to_revision
+        ):
+            # topological order means every child has been seen, so a commit only belongs to a PR
+            # if all of its children do
+            owners = child_prs.pop(sha, set())
+            inherited = next(iter(owners)) if len(owners) == 1 else None
+
+            subject = message.split("\n", 1)[0].strip()
+            merge = MERGE_PR_SUBJECT_RE.match(subject)
+            if merge and len(parents) > 1:
+                pr_number = int(merge.group(1))
+                child_prs.setdefault(parents[0], set()).add(inherited)
+                for parent in parents[1:]:
+                    child_prs.setdefault(parent, set()).add(pr_number)
+            else:
+                squash = SQUASH_PR_SUBJECT_RE.search(subject)
+                pr_number = int(squash.group(1)) if squash else inherited
+                for parent in parents:
+                    child_prs.setdefault(parent, set()).add(inherited)
+
+            yield sha, pr_number
+            for cherry_picked_sha in self._parse_shas(message.split("\n")):
+                yield cherry_picked_sha, None
+
+    def _iter_shas_compact(self, revision_range: str) -> Iterator[str]:
+        """
+        Same output as reading every commit message but git does the filtering:
+        only the bodies of commits with a line _parse_shas would pick up are sent over the pipe,
+        everything else is just a SHA per line.
+        """
+        extra_shas = {}
+        for sha, message in self.backend.commit_messages(
+            revision_range, grep=SHA_LINE_GREPS
+        ):
+            extra_shas[sha] = list(self._parse_shas(message.split("\n")))
 
-        return shas
+        for sha in self.backend.rev_list(revision_range):
+            yield sha
+            yield from extra_shas.get(sha, [])
 
     def _get_shas(self, commit_msgs: str) -> List[str]:
         """returns shas, inlcuding cherry-picked shas"""
+        return list(self._parse_shas(commit_msgs.split("\n")))
 
-        shas = []
-
-        for line in commit_msgs.split("\n"):
+    @staticmethod
+    def _parse_shas(lines: Iterable[str]) -> Iterator[str]:
+        """yields shas from rev-list --format=%B output lines, inlcuding cherry-picked shas"""
 
-            line = line.rstrip("\r")
+        for line in lines:
 
-            if re.match(r"commit \w+$", line):
-                shas.append(line.replace("commit ", ""))
+            line = line.rstrip("\r\n")
 
-            if line.startswith("(cherry picked from commit "):
-                shas.append(line.replace("(cherry picked from commit ", "").rstrip(")"))
+            if line.startswith("commit "):
+                match = COMMIT_LINE_RE.match(line)
+                if match:
+                    yield match.group(1)
 
-        return shas
+            elif line.startswith(CHERRY_PICK_PREFIX):
+                yield line[len(CHERRY_PICK_PREFIX) :].rstrip(")")
@@ -1,12 +1,23 @@
-import slacker
 import logging
 
+from . import stats
+from .lazy import LazyModule
+
 logger = logging.getLogger(__name__)
 
+slacker = LazyModule("slacker")
+
+SLACK_WEBHOOK_URL = "https://hooks.slack.com/services"
 
-def post_deployment_message_to_slack(slack_webhook_key, text):
 
-    incoming_webhook_url = f"https://hooks.slack.com/services/{slack_webhook_key}"
+@stats.stage("post_to_slack")
+def post_deployment_message_to_slack(
+    slack_webhook_key, text, slack_webhook_url: str = SLACK_WEBHOOK_URL
+):
+    """
+    :param slack_webhook_url: url the webhook key goes under, for a Slack stand-in
+    """
+    incoming_webhook_url = f"{slack_webhook_url}/{slack_webhook_key}"
 
     # We will continue to use Slacker for posting internal messages to webhooks.
     # There is no reason to switch to SlackClient. Alternatively, we could just use
@@ -16,7 +27,7 @@ def post_deployment_message_to_slack(slack_webhook_key, text):
     display_name = "Deployment Team"
     icon_url = ":rocket:"
 
-    slack.incomingwebhook.post(
+    response = slack.incomingwebhook.post(
         {
             "text": text,
             "username": display_name,
@@ -24,3 +35,4 @@ def post_deployment_message_to_slack(slack_webhook_key, text):
             "icon_emoji": icon_url,
         }
     )
+    stats.record_response("slack", response)
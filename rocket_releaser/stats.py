@@ -0,0 +1,350 @@
+"""
+Instrumentation for release notes runs.
+
+Code that does something worth measuring reports it here, and every registered collector is told about it.
+Nothing is recorded while no collectors are registered.
+StatsCollector is the built in collector behind --stats & --stats-json.
+To plug in your own, subclass Collector & register it:
+
+    class StatsdCollector(Collector):
+        def stage(self, name, seconds):
+            statsd.timing(f"rocket_releaser.{name}", seconds * 1000)
+
+    with collecting(StatsdCollector()):
+        release_notes(...)
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in ms of the HTTP latency histogram buckets, the last bucket is everything slower
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Collector:
+    """
+    receives stats as they are recorded. Override the methods you care about.
+    Methods may be called from several threads at once.
+    """
+
+    def stage(self, name: str, seconds: float):
+        """a stage of the run finished. Stages may overlap (ex: label_tickets runs while PR's are found)"""
+
+    def http_request(
+        self,
+        backend: str,
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        status_code: int,
+    ):
+        """
+        :param backend: "github_graphql", "github_rest", "jira" or "slack"
+        """
+
+    def git_command(self, args: Sequence[str], seconds: float):
+        """a git process finished, or a long lived one answered a query"""
+
+    def cache_lookup(self, cache: str, hits: int, misses: int):
+        """
+        :param cache: what was looked up, ex: "associated_prs"
+        """
+
+    def rate_limit(self, resource: str, limit: int, remaining: int):
+        """
+        GitHub said how much of a rate limit budget is left
+
+        :param resource: "core" for REST, "graphql", ...
+        """
+
+    def rate_limit_wait(self, resource: str, seconds: float):
+        """a GitHub request was held back for seconds to stay under resource's rate limit"""
+
+
+_collectors: List[Collector] = []
+_collectors_lock = threading.Lock()
+
+
+def add_collector(collector: Collector):
+    with _collectors_lock:
+        _collectors.append(collector)
+
+
+def remove_collector(collector: Collector):
+    with _collectors_lock:
+        _collectors.remove(collector)
+
+
+@contextmanager
+def collecting(collector: Collector):
+    """registers collector for the duration of the with block"""
+    add_collector(collector)
+    try:
+        yield collector
+    finally:
+        remove_collector(collector)
+
+
+def _emit(method: str, *args):
+    for collector in list(_collectors):
+        try:
+            getattr(collector, method)(*args)
+        except Exception:
+            # a broken collector shouldn't break the release
+            logger.exception(f"stats collector {collector} failed")
+
+
+@contextmanager
+def stage(name: str):
+    """times the with block as stage name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _collectors:
+            _emit("stage", name, time.perf_counter() - start)
+
+
+@contextmanager
+def git_command(args: Sequence[str]):
+    """times the with block as running git with args"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_git_command(args, time.perf_counter() - start)
+
+
+def record_git_command(args: Sequence[str], seconds: float):
+    if _collectors:
+        _emit("git_command", args, seconds)
+
+
+def record_response(backend: str, response, seconds: float = None):
+    """
+    records a requests.Response
+
+    :param seconds: how long the request took. Defaults to response.elapsed
+    """
+    if not _collectors:
+        return
+
+    if seconds is None:
+        seconds = response.elapsed.total_seconds()
+    body = response.request.body if response.request is not None else None
+    content_length = response.headers.get("Content-Length")
+    _emit(
+        "http_request",
+        backend,
+        seconds,
+        len(body or b""),
+        int(content_length) if content_length else len(response.content or b""),
+        response.status_code,
+    )
+
+
+def record_cache_lookup(cache: str, hits: int, misses: int):
+    if _collectors:
+        _emit("cache_lookup", cache, hits, misses)
+
+
+def record_rate_limit(resource: str, limit: int, remaining: int):
+    if _collectors:
+        _emit("rate_limit", resource, limit, remaining)
+
+
+def record_rate_limit_wait(resource: str, seconds: float):
+    if _collectors:
+        _emit("rate_limit_wait", resource, seconds)
+
+
+def instrument_session(session, backend: str):
+    """records every response session gets as a request to backend"""
+
+    def record(response, *args, **kwargs):
+        record_response(backend, response)
+
+    session.hooks["response"].append(record)
+
+
+class StatsCollector(Collector):
+    """adds up everything recorded, for a summary at the end of a run"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages: Dict[str, float] = {}
+        self.http: Dict[str, dict] = {}
+        self.git = {"commands": 0, "seconds": 0.0}
+        self.caches: Dict[str, Dict[str, int]] = {}
+        self.rate_limits: Dict[str, dict] = {}
+
+    def stage(self, name: str, seconds: float):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def http_request(
+        self,
+        backend: str,
+        seconds: float,
+        bytes_sent: int,
+        bytes_received: int,
+        status_code: int,
+    ):
+        with self._lock:
+            http = self.http.setdefault(
+                backend,
+                {
+                    "requests": 0,
+                    "errors": 0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "latency_histogram_ms": {
+                        bucket: 0 for bucket in self._bucket_names()
+                    },
+                },
+            )
+            http["requests"] += 1
+            if status_code >= 400:
+                http["errors"] += 1
+            http["bytes_sent"] += bytes_sent
+            http["bytes_received"] += bytes_received
+            http["seconds"] += seconds
+            http["max_seconds"] = max(http["max_seconds"], seconds)
+            http["latency_histogram_ms"][self._bucket_name(seconds * 1000)] += 1
+
+    def git_command(self, args: Sequence[str], seconds: float):
+        with self._lock:
+            self.git["commands"] += 1
+            self.git["seconds"] += seconds
+
+    def cache_lookup(self, cache: str, hits: int, misses: int):
+        with self._lock:
+            lookups = self.caches.setdefault(cache, {"hits": 0, "misses": 0})
+            lookups["hits"] += hits
+            lookups["misses"] += misses
+
+    def _rate_limit(self, resource: str) -> dict:
+        return self.rate_limits.setdefault(
+            resource,
+            {
+                "limit": None,
+                "remaining": None,
+                "min_remaining": None,
+                "waits": 0,
+                "waited_seconds": 0.0,
+            },
+        )
+
+    def rate_limit(self, resource: str, limit: int, remaining: int):
+        with self._lock:
+            rate_limit = self._rate_limit(resource)
+            rate_limit["limit"] = limit
+            rate_limit["remaining"] = remaining
+            if rate_limit["min_remaining"] is None:
+                rate_limit["min_remaining"] = remaining
+            else:
+                rate_limit["min_remaining"] = min(
+                    rate_limit["min_remaining"], remaining
+                )
+
+    def rate_limit_wait(self, resource: str, seconds: float):
+        with self._lock:
+            rate_limit = self._rate_limit(resource)
+            rate_limit["waits"] += 1
+            rate_limit["waited_seconds"] += seconds
+
+    @staticmethod
+    def _bucket_names() -> List[str]:
+        return [f"<={bucket}" for bucket in LATENCY_BUCKETS_MS] + [
+            f">{LATENCY_BUCKETS_MS[-1]}"
+        ]
+
+    @staticmethod
+    def _bucket_name(milliseconds: float) -> str:
+        for bucket in LATENCY_BUCKETS_MS:
+            if milliseconds <= bucket:
+                return f"<={bucket}"
+        return f">{LATENCY_BUCKETS_MS[-1]}"
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            caches = {
+                name: dict(
+                    lookups,
+                    hit_rate=lookups["hits"] / (lookups["hits"] + lookups["misses"])
+                    if lookups["hits"] + lookups["misses"]
+                    else None,
+                )
+                for name, lookups in self.caches.items()
+            }
+            return copy.deepcopy(
+                {
+                    "stages": self.stages,
+                    "http": self.http,
+                    "git": self.git,
+                    "caches": caches,
+                    "rate_limits": self.rate_limits,
+                }
+            )
+
+    def write_json(self, file_path: str):
+        with open(file_path, "w") as stats_file:
+            json.dump(self.to_dict(), stats_file, indent=2)
+
+    def summary(self) -> str:
+        stats = self.to_dict()
+        lines = ["Stages:"]
+        for name, seconds in stats["stages"].items():
+            lines.append(f"  {name}: {seconds:.2f}s")
+
+        lines.append("HTTP:")
+        for backend, http in stats["http"].items():
+            average_ms = http["seconds"] / http["requests"] * 1000
+            lines.append(
+                f"  {backend}: {http['requests']} requests ({http['errors']} errors), "
+                f"{http['bytes_sent']} bytes sent, {http['bytes_received']} bytes received, "
+                f"avg {average_ms:.0f}ms, max {http['max_seconds'] * 1000:.0f}ms"
+            )
+            histogram = ", ".join(
+                f"{bucket}ms: {count}"
+                for bucket, count in http["latency_histogram_ms"].items()
+                if count
+            )
+            lines.append(f"    {histogram}")
+
+        lines.append(
+            f"Git: {stats['git']['commands']} commands, {stats['git']['seconds']:.2f}s"
+        )
+
+        lines.append("Caches:")
+        for name, lookups in stats["caches"].items():
+            hit_rate = (
+                f"{lookups['hit_rate']:.0%}" if lookups["hit_rate"] is not None else "-"
+            )
+            lines.append(
+                f"  {name}: {lookups['hits']} hits, {lookups['misses']} misses ({hit_rate})"
+            )
+
+        if stats["rate_limits"]:
+            lines.append("GitHub rate limits:")
+        for resource, rate_limit in stats["rate_limits"].items():
+            budget = (
+                f"{rate_limit['remaining']} of {rate_limit['limit']} left "
+                f"(lowest {rate_limit['min_remaining']})"
+                if rate_limit["limit"] is not None
+                else "budget unknown"
+            )
+            lines.append(
+                f"  {resource}: {budget}, waited {rate_limit['waits']} times "
+                f"for {rate_limit['waited_seconds']:.2f}s"
+            )
+
+        return "\n".join(lines)
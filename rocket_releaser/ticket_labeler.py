@@ -1,45 +1,33 @@
+import json
 import logging
 import re
-from typing import List
-
-import github3
-import jira
-
+import time
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import stats
+from .cache import Cache
+from .concurrency import concurrent_imap, concurrent_map
+from .graphql import BadReturnStatus, GraphQL, github_graphql_url
+from .lazy import LazyModule
 from .prs import PRs
+from .rate_limit import RateLimiter, rate_limited_wait_seconds
 
 logger = logging.getLogger(__name__)
 
+# only imported once a labeler is made, runs that don't label tickets don't pay for them
+github3 = LazyModule("github3")
+jira = LazyModule("jira")
+requests = LazyModule("requests")
+
+PR_LABEL_BACKENDS = ("rest", "graphql")
+
 
 class TicketLabeler:
     """
     class for labeling github/jira pr's/tickets
     """
 
-    # you can find more transition id's with the following code:
-    """
-    import jira
-    import json
-    jira = jira.JIRA('https://yourJira.atlassian.net', basic_auth=('your_account@company.com', 'JIRA SECRET'))
-    issue = jira.issue('DEV-91') # replace this number with issue you want to get availible transitions for
-    # keep in mind isssues in different states may have different transitions!
-    transitions=[(t['name'], t['id']) for t in jira.transitions(issue)]
-    d = dict(transitions)
-    print(json.dumps(d, indent=4 ,sort_keys=True))
-    """
-
-    TRANSITION_IDS = {
-        "Backlog": "871",
-        "Blocked": "831",
-        "Close": "851",
-        "Code Review": "771",
-        "Deployed": "861",
-        "Ready to Test": "841",
-        "Reopen Issue": "811",
-        "Start Progress": "801",
-        "Start Testing": "791",
-        "Stop progress": "821",
-    }
-
     TRANSITION_KEYWORDS = [
         "close",
         "closes",
@@ -63,6 +51,35 @@ class TicketLabeler:
         flags=re.VERBOSE | re.IGNORECASE,
     )
 
+    # Deprecated: transition ids of the one Jira workflow these used to be hard-coded for.
+    # Transitions are now looked up by name per workflow, see transition_ids
+    TRANSITION_IDS = {
+        "Backlog": "871",
+        "Blocked": "831",
+        "Close": "851",
+        "Code Review": "771",
+        "Deployed": "861",
+        "Ready to Test": "841",
+        "Reopen Issue": "811",
+        "Start Progress": "801",
+        "Start Testing": "791",
+        "Stop progress": "821",
+    }
+
+    # max number of tickets fetched in one JQL search
+    JIRA_SEARCH_PAGE_SIZE: int = 100
+
+    # max number of tickets Jira Cloud's bulk edit endpoint takes at once
+    JIRA_BULK_EDIT_PAGE_SIZE: int = 1000
+    # seconds to wait for a bulk edit task to finish
+    JIRA_BULK_EDIT_TIMEOUT: float = 120
+
+    # max number of addLabelsToLabelable mutations sent in one GraphQL request
+    PR_LABEL_CHUNK_SIZE: int = 100
+
+    # how many times to retry labeling a PR over REST after GitHub rate limited it
+    MAX_RATE_LIMIT_RETRIES: int = 3
+
     PREVIEW_ENV_NAME: str = "preview"
     STAGING_ENV_NAME: str = "staging"
     PRODUCTION_ENV_NAME: str = "production"
@@ -70,125 +87,312 @@ class TicketLabeler:
     def __init__(
         self,
         githubToken: str,
-        pull_request_dicts: List[dict],
+        pull_request_dicts: Iterable[dict],
         repo_owner: str,
         repo_name: str,
         jira_token: str = "",
         jira_username: str = "",
         jira_url: str = "",
+        graph_ql: GraphQL = None,
+        max_concurrency: int = 1,
+        bulk_jira_labels: bool = False,
+        pr_label_backend: str = "rest",
+        cache: Cache = None,
+        github_url: str = "",
+        jira_only=False,
+        rate_limiter: RateLimiter = None,
     ):
         """
         :param githubToken: GitHub oauth githubToken
+        :param graph_ql: GitHub client whose connection pool the REST client should share.
+            Also used for labeling PR's with the graphql pr_label_backend.
+        :param max_concurrency: max number of PR's/tickets to label at once
+        :param bulk_jira_labels: whether to label all jira tickets at once after transitioning them,
+            see bulk_label_jira_tickets
+        :param pr_label_backend: "rest" to label PR's one at a time with github3,
+            or "graphql" to label them with batched GraphQL mutations, see label_prs
+        :param cache: persistent cache of Jira workflow transitions shared between runs
+        :param github_url: url of a GitHub Enterprise server, github.com if empty
+        :param jira_only: have label_tickets only label Jira tickets, not PR's.
+            ex: for tickets mentioned by PR's of several repos
+        :param rate_limiter: GitHub rate limit budgets to share with other GitHub clients.
+            Defaults to graph_ql's, or a new one without graph_ql.
         """
+        if pr_label_backend not in PR_LABEL_BACKENDS:
+            raise ValueError(
+                f"unknown PR label backend {pr_label_backend}. Choose from {', '.join(PR_LABEL_BACKENDS)}"
+            )
+
         self.githubToken = githubToken
         self.pull_request_dicts = pull_request_dicts
         self.repo_owner = repo_owner
         self.repo_name = repo_name
         self.jira_token = jira_token
         self.jira_url = jira_url
-        self.gh = github3.GitHub(token=self.githubToken)
+        self.max_concurrency = max_concurrency
+        self.bulk_jira_labels = bulk_jira_labels
+        self.pr_label_backend = pr_label_backend
+        self.graph_ql = graph_ql
+        self.cache = cache
+        # (project, workflow, status) -> transition name -> {"id": transition id, "to": status name}
+        self._transitions: Dict[Tuple[str, str, str], Dict[str, dict]] = {}
+        self.github_url = github_url
+        self.jira_only = jira_only
+        if github_url:
+            self.gh = github3.GitHubEnterprise(github_url, token=self.githubToken)
+        else:
+            self.gh = github3.GitHub(token=self.githubToken)
+        stats.instrument_session(self.gh.session, "github_rest")
+        self.rate_limiter = rate_limiter or (
+            graph_ql.rate_limiter if graph_ql else RateLimiter()
+        )
+        self.rate_limiter.instrument_session(self.gh.session, "core")
+        if graph_ql:
+            graph_ql.share_connection_pool(self.gh.session)
 
         # documentation claims you need to use username/password combo but username/token works as well
         if jira_token:
             self.jira = jira.JIRA(jira_url, basic_auth=(jira_username, self.jira_token))
+            stats.instrument_session(self.jira._session, "jira")
 
+    @stats.stage("label_tickets")
     def label_tickets(self, env_name: str, vpc_name: str, dry_run=False) -> int:
         """
         labels github pr's and associated jira tickets with env_name.
         Note that if env_name matches self.PRODUCTION_ENV_NAME the jira issue will be closed
 
+        PR's and tickets are labeled by up to self.max_concurrency workers.
+        Each ticket is handled by a single worker so its transitions still happen before its label.
+
+        self.pull_request_dicts may be an iterator that is still finding PR's (see pipeline).
+        PR's are labeled as they come in, tickets once every PR mentioning them is known.
+
         :param env_name: the name of the vpc to label the tickets/issues with
         :return: number of jira tickets found
         """
         if dry_run:
             logger.info("Dry run - not actually making any changes")
 
-        jira_ticket_name_list = []
-
         label: str = f"{vpc_name}({env_name})" if vpc_name != env_name else env_name
 
-        for pr in self.pull_request_dicts:
+        # ticket name -> (transition keyword, pr title) for every pr that mentions it, in pr order
+        jira_ticket_mentions: Dict[str, List[Tuple[Optional[str], str]]] = {}
+        # tickets left to label in bulk once they're all transitioned
+        jira_tickets_to_label: List[str] = []
+        pull_request_dicts: List[dict] = []
+        prefetched_issues: Dict[str, "jira.Issue"] = {}
+
+        def jobs():
+            for pr in self.pull_request_dicts:
+                pull_request_dicts.append(pr)
+                if not self.jira_only and self.pr_label_backend != "graphql":
+                    yield partial(self._label_pr, pr, label, dry_run)
+
+                if self.jira_token:
+                    for jira_ticket_map in self.get_pr_jira_ticket_maps(pr):
+                        jira_ticket_mentions.setdefault(
+                            jira_ticket_map["issue"], []
+                        ).append((jira_ticket_map["transition"], pr.get("title")))
+
+            if not self.jira_only and self.pr_label_backend == "graphql":
+                yield partial(self._label_prs, pull_request_dicts, label, dry_run)
+
+            prefetched_issues.update(
+                self.prefetch_jira_issues(list(jira_ticket_mentions))
+            )
+            for jira_ticket_name, mentions in jira_ticket_mentions.items():
+                yield partial(
+                    self._label_jira_ticket_mentions,
+                    jira_ticket_name,
+                    mentions,
+                    env_name,
+                    label,
+                    dry_run,
+                    prefetched_issues.get(jira_ticket_name),
+                    jira_tickets_to_label if self.bulk_jira_labels else None,
+                )
 
-            title = pr.get("title")
-            pr_num = pr.get("number")
+        for _ in concurrent_imap(lambda job: job(), jobs(), self.max_concurrency):
+            pass
+        self.pull_request_dicts = pull_request_dicts
 
-            try:
-                logger.info(
-                    f"labeling pr #{pr_num} {title} at "
-                    f"https://github.com/{self.repo_owner}/{self.repo_name}/pull/{pr_num} with {label}"
-                )
-                if not dry_run:
-                    self.label_pr_or_issue(pr, label)
+        if jira_tickets_to_label and not dry_run:
+            self.bulk_label_jira_tickets(
+                list(dict.fromkeys(jira_tickets_to_label)), label, prefetched_issues
+            )
 
-            except github3.exceptions.GitHubException:
-                logger.exception("Error during labeling: ")
+        return len(jira_ticket_mentions)
 
-            if not self.jira_token:
-                continue
+    def prefetch_jira_issues(
+        self, jira_ticket_names: List[str]
+    ) -> Dict[str, "jira.Issue"]:
+        """
+        fetches issues with JQL searches of up to JIRA_SEARCH_PAGE_SIZE tickets each,
+        only getting the fields we read, instead of one full issue request per ticket.
 
-            jira_ticket_maps = []
-            jira_ticket_maps_title = self.get_jira_ticket_maps(pr.get("title", ""))
-            jira_ticket_maps_body = self.get_jira_ticket_maps(pr.get("body", ""))
+        A page Jira rejects is searched again in halves, so a bad key costs a few searches.
+        Tickets missing from the results are left out so they get fetched (and their errors logged) one at a time.
 
-            for jira_ticket_map_title in jira_ticket_maps_title:
-                jira_ticket_maps.append(jira_ticket_map_title)
+        :return: dict mapping ticket name to issue
+        """
+        pages = [
+            jira_ticket_names[i : i + self.JIRA_SEARCH_PAGE_SIZE]
+            for i in range(0, len(jira_ticket_names), self.JIRA_SEARCH_PAGE_SIZE)
+        ]
 
-            for jira_ticket_map_body in jira_ticket_maps_body:
-                if jira_ticket_map_body.get("transition"):
-                    jira_ticket_maps.append(jira_ticket_map_body)
-                # we ignore tickets without transition in body because they may be unrelated
-                # ex: "this story is similar to ENG-4235" ~ we dont want to label ENG-4235
+        def search(page: List[str]) -> list:
+            try:
+                # unvalidated JQL skips keys that don't exist instead of failing the whole search
+                return self.jira.search_issues(
+                    f"key in ({', '.join(page)})",
+                    maxResults=len(page),
+                    fields="labels,status,project,issuetype",
+                    validate_query=False,
+                )
+            except jira.exceptions.JIRAError:
+                if len(page) == 1:
+                    logger.warning(
+                        f"couldn't search for {page[0]}, fetching it on its own",
+                        exc_info=1,
+                    )
+                    return []
+                # keep the bad key from costing the whole page a request per ticket
+                half = len(page) // 2
+                return search(page[:half]) + search(page[half:])
 
-            if not jira_ticket_maps:
-                logger.warning(f"couldnt find jira # in pr #{pr_num} {title}")
-                continue
+        issues = {}
+        for found_issues in concurrent_map(search, pages, self.max_concurrency):
+            for issue in found_issues:
+                issues[issue.key] = issue
 
-            # ugly hack ~ by converting to dict & back we ensure we dont have duplicate issues
-            # (same issue may be mentioned in title and again in body)
-            jira_ticket_maps = list(
-                {map["issue"]: map for map in jira_ticket_maps}.values()
+        return issues
+
+    def get_pr_jira_ticket_maps(self, pr: dict) -> List[dict]:
+        """
+        :return: jira ticket maps for the tickets pr closes/fixes/mentions in its title, without duplicates
+        """
+        jira_ticket_maps = []
+        jira_ticket_maps_title = self.get_jira_ticket_maps(pr.get("title", ""))
+        jira_ticket_maps_body = self.get_jira_ticket_maps(pr.get("body", ""))
+
+        for jira_ticket_map_title in jira_ticket_maps_title:
+            jira_ticket_maps.append(jira_ticket_map_title)
+
+        for jira_ticket_map_body in jira_ticket_maps_body:
+            if jira_ticket_map_body.get("transition"):
+                jira_ticket_maps.append(jira_ticket_map_body)
+            # we ignore tickets without transition in body because they may be unrelated
+            # ex: "this story is similar to ENG-4235" ~ we dont want to label ENG-4235
+
+        if not jira_ticket_maps:
+            logger.warning(
+                f"couldnt find jira # in pr #{pr.get('number')} {pr.get('title')}"
             )
 
-            for jira_ticket_map in jira_ticket_maps:
-                jira_ticket_name = jira_ticket_map.get("issue")
-                transition_kw = jira_ticket_map.get("transition")
+        # ugly hack ~ by converting to dict & back we ensure we dont have duplicate issues
+        # (same issue may be mentioned in title and again in body)
+        return list({map["issue"]: map for map in jira_ticket_maps}.values())
 
-                try:
-                    if jira_ticket_name not in jira_ticket_name_list:
-                        jira_ticket_name_list.append(jira_ticket_name)
-                    logger.info(
-                        f"labeling jira ticket at {self.jira_url}/browse/{jira_ticket_name}"
-                        f" with {label}"
-                    )
-                    issue = self.jira.issue(jira_ticket_name)
+    def _label_pr(self, pr: dict, label: str, dry_run: bool):
+        title = pr.get("title")
+        pr_num = pr.get("number")
 
-                    # a ticket may have more than one PR
-                    # so we only transition if final PR
-                    if transition_kw:
+        logger.info(
+            f"labeling pr #{pr_num} {title} at "
+            f"https://github.com/{self.repo_owner}/{self.repo_name}/pull/{pr_num} with {label}"
+        )
+        if dry_run:
+            return
 
-                        if env_name == self.PREVIEW_ENV_NAME:
-                            logger.info(
-                                "env_name matches preview - making sure if ticket is still in progress "
-                                "its marked in review"
-                            )
-                            if not dry_run:
-                                self.mark_in_review_jira_ticket(issue)
+        for attempt in range(self.MAX_RATE_LIMIT_RETRIES + 1):
+            try:
+                self.label_pr_or_issue(pr, label)
+                return
+            except github3.exceptions.GitHubException as e:
+                response = getattr(e, "response", None)
+                wait = (
+                    rate_limited_wait_seconds(response)
+                    if response is not None
+                    else None
+                )
+                if wait is None or attempt == self.MAX_RATE_LIMIT_RETRIES:
+                    logger.exception("Error during labeling: ")
+                    return
+                # the rate limiter already holds every GitHub request for wait seconds,
+                # label_pr_or_issue waits it out
+                logger.warning(
+                    f"rate limited labeling pr #{pr_num}, retrying in {wait:.1f}s"
+                )
 
-                        # we don't have enough qa currently to test everything before it goes to prod
-                        # so we don't close the ticket when it hits prod in case it still needs testing
-                        # elif env_name == self.PRODUCTION_ENV_NAME:
-                        #     logger.info('env_name matches production - closing jira ticket')
-                        #     if not dry_run:
-                        #         self.mark_deployed_jira_ticket(issue)
+    def _label_prs(self, prs: List[dict], label: str, dry_run: bool):
+        for pr in prs:
+            pr_num = pr.get("number")
+            logger.info(
+                f"labeling pr #{pr_num} {pr.get('title')} at "
+                f"https://github.com/{self.repo_owner}/{self.repo_name}/pull/{pr_num} with {label}"
+            )
+        if not dry_run:
+            self.label_prs(prs, label)
 
-                    if not dry_run:
-                        # this HAS to be last because you cant add labels to closed issue
-                        self.label_jira_ticket(issue, jira_ticket_name, label)
+    def _label_jira_ticket_mentions(
+        self,
+        jira_ticket_name: str,
+        mentions: List[Tuple[Optional[str], str]],
+        env_name: str,
+        label: str,
+        dry_run: bool,
+        prefetched_issue: "jira.Issue" = None,
+        jira_tickets_to_label: List[str] = None,
+    ):
+        """
+        transitions & labels a ticket once for every pr that mentions it, in order
 
-                except (jira.exceptions.JIRAError, ValueError):
-                    logger.exception("error with " + str(title))
+        :param prefetched_issue: issue to use for the first mention instead of fetching it
+        :param jira_tickets_to_label: if passed, the ticket is added to it to be labeled later instead of labeled now
+        """
+        issue = prefetched_issue
+        for transition_kw, title in mentions:
+            try:
+                logger.info(
+                    f"labeling jira ticket at {self.jira_url}/browse/{jira_ticket_name}"
+                    f" with {label}"
+                )
+                # later mentions reuse the issue, transition_jira_ticket & label_jira_ticket keep it up to date
+                if issue is None:
+                    issue = self.jira.issue(jira_ticket_name)
 
-        return len(jira_ticket_name_list)
+                # a ticket may have more than one PR
+                # so we only transition if final PR
+                if transition_kw:
+
+                    if env_name == self.PREVIEW_ENV_NAME:
+                        logger.info(
+                            "env_name matches preview - making sure if ticket is still in progress "
+                            "its marked in review"
+                        )
+                        if not dry_run:
+                            self.mark_in_review_jira_ticket(issue)
+
+                    # we don't have enough qa currently to test everything before it goes to prod
+                    # so we don't close the ticket when it hits prod in case it still needs testing
+                    # elif env_name == self.PRODUCTION_ENV_NAME:
+                    #     logger.info('env_name matches production - closing jira ticket')
+                    #     if not dry_run:
+                    #         self.mark_deployed_jira_ticket(issue)
+
+                if jira_tickets_to_label is not None:
+                    jira_tickets_to_label.append(jira_ticket_name)
+                elif not dry_run:
+                    # this HAS to be last because you cant add labels to closed issue
+                    self.label_jira_ticket(issue, jira_ticket_name, label)
+
+            except (
+                jira.exceptions.JIRAError,
+                requests.exceptions.HTTPError,
+                KeyError,
+                ValueError,
+            ):
+                logger.exception("error with " + str(title))
 
     @staticmethod
     def get_jira_ticket_maps(search_string: str) -> List[dict]:
@@ -234,20 +438,296 @@ class TicketLabeler:
         :param pr: dict with number key mapping to a string
         """
         pr_num = pr.get("number")
+        # one request for the issue, one for the labels
+        self.rate_limiter.wait("core", 2)
         issue = self.gh.issue(self.repo_owner, self.repo_name, pr_num)
         issue.add_labels(label)
 
+    def label_prs(self, prs: List[dict], label: str):
+        """
+        labels prs with addLabelsToLabelable mutations, PR_LABEL_CHUNK_SIZE of them aliased into each request,
+        using the PR node ids PRs.pull_request_dicts returns.
+        PR's without a node id, and every PR if the label doesn't exist yet, are labeled one at a time with
+        label_pr_or_issue instead, which creates the label.
+        Errors are logged per PR.
+        """
+        graph_ql = self.graph_ql or GraphQL(
+            github_graphql_url(self.github_url),
+            self.githubToken,
+            rate_limiter=self.rate_limiter,
+        )
+
+        label_id = None
+        try:
+            label_id = self.label_node_id(graph_ql, label)
+        except BadReturnStatus:
+            logger.warning(f"couldn't look up label {label}", exc_info=1)
+
+        rest_prs = [pr for pr in prs if not (label_id and pr.get("id"))]
+        graphql_prs = [pr for pr in prs if label_id and pr.get("id")]
+        chunks = [
+            graphql_prs[i : i + self.PR_LABEL_CHUNK_SIZE]
+            for i in range(0, len(graphql_prs), self.PR_LABEL_CHUNK_SIZE)
+        ]
+
+        def add_labels(chunk: List[dict]):
+            try:
+                rejected = self._add_labels_to_labelables(graph_ql, label_id, chunk)
+            except BadReturnStatus:
+                logger.warning(
+                    "GraphQL labeling failed, labeling PR's one at a time", exc_info=1
+                )
+                rest_prs.extend(chunk)
+            else:
+                if rejected:
+                    logger.warning(
+                        "GitHub rejected the labeling mutation, labeling PR's one at a time"
+                    )
+                    rest_prs.extend(rejected)
+
+        concurrent_map(add_labels, chunks, self.max_concurrency)
+        concurrent_map(
+            lambda pr: self._label_pr(pr, label, dry_run=False),
+            rest_prs,
+            self.max_concurrency,
+        )
+
+    def label_node_id(self, graph_ql: GraphQL, label: str) -> Optional[str]:
+        """
+        :return: GraphQL node id of label in this repo, or None if the repo doesn't have it
+        """
+        result = graph_ql.run_query(
+            """
+query labelId($repo: String!, $owner: String!, $label: String!){
+  repository(name: $repo, owner: $owner) {
+    label(name: $label) {
+      id
+    }
+  }
+}
+""",
+            {"repo": self.repo_name, "owner": self.repo_owner, "label": label},
+        )
+        repository = (result.get("data") or {}).get("repository") or {}
+        return (repository.get("label") or {}).get("id")
+
+    @staticmethod
+    def add_labels_mutation(aliases: List[str]) -> str:
+        """
+        builds a mutation that labels several PR's at once.
+        Each PR is labeled under its own alias with its own $alias variable holding its node id.
+        """
+        variable_defs = "".join(f", ${alias}: ID!" for alias in aliases)
+        mutations = "".join(
+            f"  {alias}: addLabelsToLabelable(input: {{labelableId: ${alias}, labelIds: $labelIds}}) {{\n"
+            f"    clientMutationId\n"
+            f"  }}\n"
+            for alias in aliases
+        )
+        return (
+            f"mutation addLabels($labelIds: [ID!]!{variable_defs}){{\n{mutations}}}\n"
+        )
+
+    def _add_labels_to_labelables(
+        self, graph_ql: GraphQL, label_id: str, prs: List[dict]
+    ) -> List[dict]:
+        """
+        labels prs in one mutation, logging the errors of PR's GitHub couldn't label
+
+        :return: prs if GitHub rejected the whole mutation, otherwise an empty list
+        """
+        aliases = {f"pr{i}": pr for i, pr in enumerate(prs)}
+        variables = {"labelIds": [label_id]}
+        variables.update({alias: pr["id"] for alias, pr in aliases.items()})
+
+        result = graph_ql.run_query(self.add_labels_mutation(list(aliases)), variables)
+
+        # 'errors' key is only present in result if there is an error
+        for error in result.get("errors", []):
+            path = error.get("path") or []
+            pr = aliases.get(path[0]) if path else None
+            if pr:
+                logger.error(
+                    f"Error during labeling pr #{pr.get('number')}: {error['message']}"
+                )
+            else:
+                # without a path the error is about the whole mutation, which didn't run
+                logger.error(f"Error during labeling: {error['message']}")
+                return prs
+        return []
+
     def label_jira_ticket(self, issue, ticket_name, label):
 
         if " " in label:
             raise ValueError("labels can't have spaces!")
 
         if label not in issue.fields.labels:
-            issue.update(fields={"labels": issue.fields.labels + [label]})
+            # "add" only touches our label, so concurrent deploys can't overwrite each other's labels
+            issue.update(update={"labels": [{"add": label}]})
 
         return issue
 
-    def mark_deployed_jira_ticket(self, issue: jira.Issue):
+    def bulk_label_jira_tickets(
+        self,
+        jira_ticket_names: List[str],
+        label: str,
+        issues: Optional[Dict[str, "jira.Issue"]] = None,
+    ):
+        """
+        adds label to tickets with Jira Cloud's bulk edit endpoint, JIRA_BULK_EDIT_PAGE_SIZE tickets per request.
+        Tickets the bulk edit can't be used for (ex: on Jira Server, which doesn't have it)
+        get an additive label update each instead.
+        Errors are logged per ticket.
+
+        :param issues: already fetched issues, to name tickets in errors that Jira reports by issue id
+        """
+        if " " in label:
+            for jira_ticket_name in jira_ticket_names:
+                logger.error(
+                    f"error with {jira_ticket_name}: labels can't have spaces!"
+                )
+            return
+
+        issues = issues or {}
+        ticket_names_by_id = {
+            str(issue.id): name
+            for name, issue in issues.items()
+            if hasattr(issue, "id")
+        }
+        unlabeled = []
+        for i in range(0, len(jira_ticket_names), self.JIRA_BULK_EDIT_PAGE_SIZE):
+            page = jira_ticket_names[i : i + self.JIRA_BULK_EDIT_PAGE_SIZE]
+            try:
+                failures = self._bulk_edit_labels(page, label)
+            except (
+                jira.exceptions.JIRAError,
+                requests.exceptions.HTTPError,
+                KeyError,
+                ValueError,
+            ):
+                logger.warning(
+                    "bulk edit failed, labeling tickets one at a time", exc_info=1
+                )
+                unlabeled.extend(page)
+                continue
+
+            for issue_id, errors in failures.items():
+                jira_ticket_name = ticket_names_by_id.get(issue_id, issue_id)
+                logger.error(f"error with {jira_ticket_name}: {'; '.join(errors)}")
+
+        concurrent_map(
+            lambda jira_ticket_name: self._add_jira_label(jira_ticket_name, label),
+            unlabeled,
+            self.max_concurrency,
+        )
+
+    def _bulk_edit_labels(
+        self, jira_ticket_names: List[str], label: str
+    ) -> Dict[str, List[str]]:
+        """
+        submits a bulk edit task adding label to tickets & waits for it to finish.
+        https://developer.atlassian.com/cloud/jira/platform/rest/v3/api-group-issue-bulk-operations/
+
+        :return: dict mapping issue id to errors, for issues the task failed to edit
+        :raises jira.exceptions.JIRAError: if the endpoint isn't there or rejects the request
+        :raises requests.exceptions.HTTPError: if Jira answers with an error the jira session let through
+        :raises KeyError: if the task isn't in Jira's answer
+        :raises ValueError: if the answer isn't json, or the task doesn't finish successfully
+        """
+        base_url = self.jira._options["server"] + "/rest/api/3/bulk"
+        response = self.jira._session.post(
+            base_url + "/issues/fields",
+            data=json.dumps(
+                {
+                    "selectedIssueIdsOrKeys": jira_ticket_names,
+                    "selectedActions": ["labels"],
+                    "editedFieldsInput": {
+                        "labelsFields": [
+                            {
+                                "fieldId": "labels",
+                                "bulkEditMultiSelectFieldOption": "ADD",
+                                "labels": [{"name": label}],
+                            }
+                        ]
+                    },
+                    "sendBulkNotification": False,
+                }
+            ),
+        )
+        response.raise_for_status()
+        task_id = response.json()["taskId"]
+
+        deadline = time.time() + self.JIRA_BULK_EDIT_TIMEOUT
+        while True:
+            response = self.jira._session.get(f"{base_url}/queue/{task_id}")
+            response.raise_for_status()
+            task = response.json()
+            if task["status"] == "COMPLETE":
+                return task.get("failedAccessibleIssues") or {}
+            if task["status"] not in ("ENQUEUED", "RUNNING") or time.time() > deadline:
+                raise ValueError(f"bulk edit task {task_id} ended as {task['status']}")
+            time.sleep(1)
+
+    def _add_jira_label(self, jira_ticket_name: str, label: str):
+        try:
+            self.jira._session.put(
+                self.jira._get_url(f"issue/{jira_ticket_name}"),
+                data=json.dumps({"update": {"labels": [{"add": label}]}}),
+            )
+        except jira.exceptions.JIRAError:
+            logger.exception(f"error with {jira_ticket_name}")
+
+    def transition_ids(self, issue: "jira.Issue") -> Dict[str, dict]:
+        """
+        looks up the transitions available from issue's status once per (project, workflow, status),
+        instead of once per issue. Issues don't say which workflow they're on,
+        but a project's workflow scheme maps each issue type to one, so the issue type stands in for it.
+
+        :return: dict mapping transition name to {"id": transition id, "to": status name}
+        """
+        key = (
+            issue.fields.project.key,
+            issue.fields.issuetype.name,
+            issue.fields.status.name,
+        )
+        transitions = self._transitions.get(key)
+        # the cache may be shared with labelers for other Jira servers
+        server = self.jira_url.rstrip("/")
+        if transitions is None and self.cache:
+            transitions = self.cache.get_transitions(server, *key)
+        if transitions is None:
+            transitions = {
+                transition["name"]: {
+                    "id": transition["id"],
+                    "to": transition["to"]["name"],
+                }
+                for transition in self.jira.transitions(issue)
+            }
+            if self.cache:
+                self.cache.set_transitions(server, *key, transitions)
+
+        self._transitions[key] = transitions
+        return transitions
+
+    def transition_jira_ticket(
+        self, issue: "jira.Issue", transition_name: str, **kwargs
+    ):
+        """
+        transitions issue & updates its status locally so later checks don't have to fetch it again
+
+        :param kwargs: passed on to jira.JIRA.transition_issue, ex: fields or comment
+        :raises ValueError: if issue's workflow has no transition_name transition from its status
+        """
+        transition = self.transition_ids(issue).get(transition_name)
+        if transition is None:
+            raise ValueError(
+                f"{issue.key} has no {transition_name} transition from {issue.fields.status.name}"
+            )
+
+        self.jira.transition_issue(issue, transition["id"], **kwargs)
+        issue.fields.status.name = transition["to"]
+
+    def mark_deployed_jira_ticket(self, issue: "jira.Issue"):
         """
         Closes w/ comment then marks as deployed
         """
@@ -258,20 +738,18 @@ class TicketLabeler:
             issue.fields.status.name != "Closed"
             and issue.fields.status.name != "Deployed"
         ):
-            self.jira.transition_issue(
+            self.transition_jira_ticket(
                 issue,
-                self.TRANSITION_IDS["Close"],
+                "Close",
                 fields={"resolution": {"name": "Done"}},
                 comment="auto transitioned by deploy",
             )
 
         if issue.fields.status.name != "Deployed":
             # Note that you can't comment when transitioning to Deployed status
-            self.jira.transition_issue(
-                issue, self.TRANSITION_IDS["Deployed"], comment=""
-            )
+            self.transition_jira_ticket(issue, "Deployed", comment="")
 
-    def mark_ready_test_jira_ticket(self, issue: jira.Issue):
+    def mark_ready_test_jira_ticket(self, issue: "jira.Issue"):
         """
         :param issue: jira Issue
         """
@@ -279,9 +757,9 @@ class TicketLabeler:
             raise TypeError("issue is None - issue should be of type jira.Issue")
 
         if issue.fields.status.name in ("Reopened", "Open", "In Progress", "In Review"):
-            self.jira.transition_issue(issue, self.TRANSITION_IDS["Ready to Test"])
+            self.transition_jira_ticket(issue, "Ready to Test")
 
-    def mark_in_review_jira_ticket(self, issue: jira.Issue):
+    def mark_in_review_jira_ticket(self, issue: "jira.Issue"):
         """
         :param issue: jira Issue
         """
@@ -289,4 +767,4 @@ class TicketLabeler:
             raise TypeError("issue is None - issue should be of type jira.Issue")
 
         if issue.fields.status.name in ("Reopened", "Open", "In Progress"):
-            self.jira.transition_issue(issue, self.TRANSITION_IDS["Code Review"])
+            self.transition_jira_ticket(issue, "Code Review")
@@ -37,5 +37,6 @@ setup(
         "slacker==0.9.65",
         "requests==2.22.0",
     ],
+    extras_require={"pygit2": ["pygit2"]},
     python_requires=">=3.6",
 )
@@ -0,0 +1,89 @@
+import tempfile
+import time
+
+from rocket_releaser.cache import Cache
+
+pr = {"number": 12, "title": "foo", "body": "bar", "merged": True}
+
+
+def test_associated_prs_survive_between_cache_instances():
+    cache_dir = tempfile.mkdtemp()
+    Cache(cache_dir).set_associated_prs("15five", "repo", {"sha1": [pr], "sha2": []})
+
+    cache = Cache(cache_dir)
+    associated_prs = cache.get_associated_prs(
+        "15five", "repo", ["sha1", "sha2", "sha3"]
+    )
+
+    assert associated_prs == {"sha1": [pr], "sha2": []}
+    assert not cache.get_associated_prs("15five", "other_repo", ["sha1"])
+
+
+def test_stale_prs_are_not_returned():
+    cache = Cache(tempfile.mkdtemp(), pr_ttl=0.01)
+    cache.set_associated_prs("15five", "repo", {"sha1": [pr], "sha2": []})
+    time.sleep(0.02)
+
+    # sha without PR's has nothing that can go stale
+    assert cache.get_associated_prs("15five", "repo", ["sha1", "sha2"]) == {"sha2": []}
+
+
+def test_prs_without_the_fields_asked_for_are_missing():
+    cache = Cache(None)
+    cache.set_pull_requests("15five", "repo", [pr])
+    # a body-less first pass doesn't throw away the body that is already cached
+    cache.set_associated_prs(
+        "15five", "repo", {"sha1": [{"number": 12, "title": "new"}]}
+    )
+
+    assert cache.get_pull_requests("15five", "repo", [12], ["body"]) == {
+        12: dict(pr, title="new")
+    }
+    assert cache.get_associated_prs("15five", "repo", ["sha1"], ["id"]) == {}
+
+
+def test_evict_deletes_expired_shas():
+    cache = Cache(tempfile.mkdtemp(), sha_ttl=0.01)
+    cache.set_associated_prs("15five", "repo", {"sha1": [pr]})
+    time.sleep(0.02)
+    cache.evict()
+
+    count = cache._connection.execute("SELECT COUNT(*) FROM shas").fetchone()[0]
+    assert count == 0
+
+
+JIRA_URL = "https://foo.atlassian.net"
+
+
+def test_transitions_survive_between_cache_instances():
+    cache_dir = tempfile.mkdtemp()
+    transitions = {"Code Review": {"id": "771", "to": "In Review"}}
+    Cache(cache_dir).set_transitions(
+        JIRA_URL, "ENG", "Story", "In Progress", transitions
+    )
+
+    cache = Cache(cache_dir)
+    assert cache.get_transitions(JIRA_URL, "ENG", "Story", "In Progress") == transitions
+    assert cache.get_transitions(JIRA_URL, "ENG", "Bug", "In Progress") is None
+    assert (
+        cache.get_transitions(
+            "https://other.atlassian.net", "ENG", "Story", "In Progress"
+        )
+        is None
+    )
+
+
+def test_stale_transitions_are_not_returned():
+    cache = Cache(tempfile.mkdtemp(), transition_ttl=0.01)
+    cache.set_transitions(JIRA_URL, "ENG", "Story", "Open", {})
+    time.sleep(0.02)
+
+    assert cache.get_transitions(JIRA_URL, "ENG", "Story", "Open") is None
+
+
+def test_in_memory_cache():
+    pr = {"number": 1, "title": "foo", "body": "", "merged": True}
+    cache = Cache(None)
+    cache.set_associated_prs("15five", "repo", {"sha1": [pr]})
+
+    assert cache.get_associated_prs("15five", "repo", ["sha1"]) == {"sha1": [pr]}
@@ -110,3 +110,30 @@ def test_parse_bodies_should_add_jira_link():
     )
     c.parse_bodies()
     assert "atlassian" in c.noteworthy[0]
+
+
+def test_parse_body_pulls_out_every_section_in_one_pass():
+    body = (
+        "<!-- RELEASES\nnot this -->\n"
+        "Summary\n\n"
+        "RELEASES\n"
+        "- fixes [ENG-1] crash\n"
+        "- [ENG-2] new page\n"
+        "- faster search\n\n"
+        "QA:\n"
+        "- check search\n"
+        "- check page\n\n"
+        "RELEASES\n"
+        "ignored\n"
+    )
+
+    assert ChangeLog.parse_body(body) == {
+        "fixes": " fixes [ENG-1] crash",
+        "noteworthy": " *[ENG-2]* new page",
+        "features": " faster search",
+        "qa_notes": " check search check page",
+    }
+
+
+def test_parse_body_without_blocks():
+    assert ChangeLog.parse_body("bla bla release\n\nmore bla") == {}
@@ -0,0 +1,158 @@
+import asyncio
+import shutil
+import tempfile
+from os import path
+
+import pytest
+from git import Repo
+
+from rocket_releaser.git_backends import (
+    AsyncioGitBackend,
+    CatFileGitBackend,
+    SubprocessGitBackend,
+    make_git_backend,
+)
+from rocket_releaser.shas import SHAs, branch_exists
+
+tmp_dirpath = None
+repo = None
+commits = []
+
+
+def setup_module():
+    global repo
+    global tmp_dirpath
+    tmp_dirpath = tempfile.mkdtemp()
+    repo = Repo.init(tmp_dirpath)
+    repo.git.config("user.email", "test_user@example.com")
+    repo.git.config("user.name", "test_user")
+    for message in [
+        "first",
+        "second\n\nmore detail",
+        "feature\n\n(cherry picked from commit c8e9114beabca79e4497f9ea40499c80cebe902a)",
+    ]:
+        repo.git.commit("--allow-empty", "-m", message)
+        commits.append(repo.head.commit)
+
+
+def teardown_module():
+    repo.close()
+    shutil.rmtree(tmp_dirpath)
+
+
+@pytest.fixture(params=["subprocess", "cat-file", "pygit2"])
+def backend(request):
+    if request.param == "pygit2":
+        pytest.importorskip("pygit2")
+    backend = make_git_backend(request.param, tmp_dirpath)
+    yield backend
+    backend.close()
+
+
+def test_backends_agree_with_git_rev_list(backend):
+    revision_range = f"{commits[0].hexsha}...{commits[-1].hexsha}"
+    expected = [commit.hexsha for commit in reversed(commits[1:])]
+
+    assert list(backend.rev_list(revision_range)) == expected
+    assert [sha for sha, _ in backend.commit_messages(revision_range)] == expected
+
+
+def test_backends_give_raw_commit_messages(backend):
+    revision_range = f"{commits[0].hexsha}...{commits[1].hexsha}"
+
+    [(sha, message)] = backend.commit_messages(revision_range)
+
+    assert message.strip() == "second\n\nmore detail"
+
+
+def test_backends_walk_children_before_parents(backend):
+    revision_range = f"{commits[0].hexsha}...{commits[-1].hexsha}"
+
+    assert list(backend.topo_commits(revision_range)) == [
+        (commit.hexsha, [parent.hexsha for parent in commit.parents], commit.message)
+        for commit in reversed(commits[1:])
+    ]
+
+
+def test_backends_know_which_branches_exist(backend):
+    assert backend.branch_exists("master")
+    assert not backend.branch_exists("did-you-know-that-cashews-came-from-a-fruit?")
+    assert branch_exists(tmp_dirpath, "master", backend=backend)
+
+
+def test_shas_are_the_same_with_every_backend(backend):
+    default_shas = SHAs(tmp_dirpath, fetch_before=False)
+    backend_shas = SHAs(tmp_dirpath, fetch_before=False, backend=backend)
+
+    for compact in (True, False):
+        backend_shas.compact = compact
+        assert backend_shas.get_shas(
+            commits[0].hexsha, commits[-1].hexsha
+        ) == default_shas.get_shas(commits[0].hexsha, commits[-1].hexsha)
+
+
+def test_cat_file_backend_reuses_one_process():
+    backend = CatFileGitBackend(tmp_dirpath)
+
+    assert backend.commit_message(commits[0].hexsha).strip() == "first"
+    batch_process = backend._batch
+    assert backend.branch_exists("master")
+    assert backend.commit_message("nonexistant sha") is None
+    assert backend._batch is batch_process
+
+    backend.close()
+
+
+def test_cat_file_backend_stays_in_sync_after_a_name_with_a_newline():
+    backend = CatFileGitBackend(tmp_dirpath)
+
+    assert not backend.branch_exists("nope\nmaster")
+    assert not backend.branch_exists("nope")
+    assert backend.branch_exists("master")
+    assert not backend.revision_exists("deadbeef")
+    assert backend.revision_exists(commits[0].hexsha)
+
+    backend.close()
+
+
+def test_cat_file_backend_restarts_git_when_an_answer_is_for_another_request():
+    backend = CatFileGitBackend(tmp_dirpath)
+    assert backend.branch_exists("master")
+    # an answer left unread, as if an earlier request had been split in two
+    backend._batch.stdin.write(b"refs/heads/master\n")
+    backend._batch.stdin.flush()
+    batch_process = backend._batch
+
+    assert not backend.branch_exists("nope")
+    assert backend.commit_message(commits[0].hexsha).strip() == "first"
+    assert backend._batch is not batch_process
+
+    backend.close()
+
+
+def test_asyncio_backend_walks_like_the_subprocess_backend():
+    revision_range = f"{commits[0].hexsha}...{commits[-1].hexsha}"
+    subprocess_backend = SubprocessGitBackend(tmp_dirpath)
+
+    def walk(backend):
+        # stopping early stops git
+        rev_list = backend.rev_list(revision_range)
+        next(rev_list)
+        rev_list.close()
+
+        return (
+            list(backend.rev_list(revision_range)),
+            list(backend.commit_messages(revision_range)),
+            list(backend.topo_commits(revision_range)),
+        )
+
+    async def walk_from_a_thread():
+        backend = AsyncioGitBackend(tmp_dirpath, asyncio.get_event_loop())
+        return await asyncio.get_event_loop().run_in_executor(None, walk, backend)
+
+    assert asyncio.run(walk_from_a_thread()) == walk(subprocess_backend)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        make_git_backend("svn", tmp_dirpath)
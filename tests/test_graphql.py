@@ -1,5 +1,11 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
-from rocket_releaser.graphql import GraphQL, BadReturnStatus
+import requests
+from rocket_releaser.graphql import GraphQL, BadReturnStatus, github_graphql_url
 
 g = GraphQL("")
 
@@ -12,7 +18,7 @@ def test_run_query_returns_json_when_good_status_code(mocker):
         def json():
             return "mock json"
 
-    mocker.patch("requests.post", return_value=MockResponse())
+    mocker.patch("requests.Session.post", return_value=MockResponse())
 
     response = g.run_query("")
 
@@ -20,6 +26,8 @@ def test_run_query_returns_json_when_good_status_code(mocker):
 
 
 def test_run_query_raises_error_when_bad_status_code(mocker):
+    mocker.patch("time.sleep")
+
     class MockResponse:
         status_code = 500
 
@@ -27,7 +35,178 @@ def test_run_query_raises_error_when_bad_status_code(mocker):
         def json():
             return "mock json"
 
-    mocker.patch("requests.post", return_value=MockResponse())
+    mocker.patch("requests.Session.post", return_value=MockResponse())
 
     with pytest.raises(BadReturnStatus):
         response = g.run_query("")
+
+
+class StubGitHubHandler(BaseHTTPRequestHandler):
+    """answers every query with its own variables, rate limiting the first request"""
+
+    requests_seen = 0
+    client_ports = set()
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubGitHubHandler.requests_seen += 1
+        StubGitHubHandler.client_ports.add(self.client_address[1])
+
+        if StubGitHubHandler.requests_seen == 1:
+            self.send_response(403)
+            body = b'{"message": "You have exceeded a secondary rate limit"}'
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        # respond slower to earlier queries so results come back out of order
+        time.sleep(0.05 / (1 + body["variables"]["i"]))
+        response = json.dumps({"data": body["variables"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    StubGitHubHandler.requests_seen = 0
+    StubGitHubHandler.client_ports = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGitHubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_run_query_gives_up_after_max_rate_limit_retries(mocker):
+    class MockResponse:
+        status_code = 403
+        headers = {"Retry-After": "0"}
+        text = ""
+
+    mocker.patch("requests.Session.post", return_value=MockResponse())
+    graph_ql = GraphQL("", max_rate_limit_retries=2)
+
+    with pytest.raises(BadReturnStatus):
+        graph_ql.run_query("")
+
+    assert requests.Session.post.call_count == 3
+
+
+def test_run_query_waits_out_rate_limited_errors(mocker):
+    sleep = mocker.patch("time.sleep")
+    rate_limited = {
+        "errors": [{"type": "RATE_LIMITED", "message": "API rate limit exceeded"}]
+    }
+
+    class MockResponse:
+        status_code = 200
+        headers = {}
+
+        def __init__(self, result):
+            self.result = result
+
+        def json(self):
+            return self.result
+
+    mocker.patch(
+        "requests.Session.post",
+        side_effect=[MockResponse(rate_limited), MockResponse({"data": {"ok": True}})],
+    )
+    graph_ql = GraphQL("", rate_limit_wait=7)
+
+    assert graph_ql.run_query("") == {"data": {"ok": True}}
+    assert requests.Session.post.call_count == 2
+    assert 6 < sleep.call_args[0][0] <= 7
+
+
+def test_run_query_does_not_retry_permission_errors(mocker):
+    class MockResponse:
+        status_code = 403
+        headers = {}
+        text = "Resource not accessible by integration"
+
+    mocker.patch("requests.Session.post", return_value=MockResponse())
+
+    with pytest.raises(BadReturnStatus):
+        g.run_query("")
+
+    assert requests.Session.post.call_count == 1
+
+
+def test_run_query_reuses_connections(stub_server):
+    graph_ql = GraphQL(stub_server)
+
+    for i in range(4):
+        graph_ql.run_query("", {"i": i})
+
+    # every query (and the rate limit retry) went over the same connection
+    assert len(StubGitHubHandler.client_ports) == 1
+
+
+def test_run_query_retries_server_errors_and_connection_resets(mocker):
+    class MockResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return "mock json"
+
+    class MockErrorResponse:
+        status_code = 502
+
+    mocker.patch("time.sleep")
+    mocker.patch(
+        "requests.Session.post",
+        side_effect=[
+            requests.exceptions.ConnectionError("connection reset"),
+            MockErrorResponse(),
+            MockResponse(),
+        ],
+    )
+
+    assert GraphQL("").run_query("") == "mock json"
+
+
+def test_run_query_doesnt_retry_no_retry_statuses(mocker):
+    class MockErrorResponse:
+        status_code = 504
+
+    mocker.patch("time.sleep")
+    mocker.patch("requests.Session.post", return_value=MockErrorResponse())
+
+    with pytest.raises(BadReturnStatus) as e:
+        GraphQL("").run_query("", no_retry_statuses=(502, 504))
+
+    assert e.value.status_code == 504
+    assert requests.Session.post.call_count == 1
+
+
+def test_run_query_raises_error_when_retries_run_out(mocker):
+    mocker.patch("time.sleep")
+    mocker.patch(
+        "requests.Session.post",
+        side_effect=requests.exceptions.ConnectionError("connection reset"),
+    )
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        GraphQL("", max_retries=2).run_query("")
+
+    assert requests.Session.post.call_count == 3
+
+
+def test_github_graphql_url():
+    assert github_graphql_url() == "https://api.github.com/graphql"
+    assert (
+        github_graphql_url("https://github.company.com/")
+        == "https://github.company.com/api/graphql"
+    )
@@ -0,0 +1,79 @@
+import subprocess
+import sys
+from os import path
+from typing import Dict, List
+
+import pytest
+from rocket_releaser.lazy import LazyModule
+
+HEAVY_MODULES = {"github3", "jira", "slacker", "requests"}
+
+
+def import_times(args: List[str]) -> Dict[str, int]:
+    """
+    runs python -X importtime with args
+
+    :return: dict mapping every module imported to its cumulative import time in microseconds
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        # the repo root, so -m finds rocket_releaser & the CLI runs against this repo
+        cwd=path.dirname(path.dirname(path.abspath(__file__))),
+    )
+    times = {}
+    for line in process.stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def heavy_modules(times: Dict[str, int]) -> set:
+    return {name.split(".")[0] for name in times} & HEAVY_MODULES
+
+
+def test_lazy_module_imports_on_first_use():
+    json = LazyModule("json")
+
+    assert json.dumps([1]) == "[1]"
+    assert "json" in repr(json)
+
+
+def test_lazy_module_missing_attribute():
+    with pytest.raises(AttributeError):
+        LazyModule("json").not_there
+
+
+def test_importing_release_notes_doesnt_import_clients():
+    times = import_times(["-c", "import rocket_releaser.release_notes"])
+
+    assert "rocket_releaser.release_notes" in times
+    assert not heavy_modules(times)
+
+
+def test_bad_arguments_dont_import_clients():
+    times = import_times(["-m", "rocket_releaser"])
+
+    assert not heavy_modules(times)
+
+
+def test_dry_run_without_labels_only_imports_requests():
+    times = import_times(
+        [
+            "-m",
+            "rocket_releaser",
+            "github token",
+            "0782415",
+            "0782415",
+            "org_name",
+            "repo_name",
+            "--dont_label_tickets",
+            "--skip-fetch",
+            "--dry_run",
+        ]
+    )
+
+    assert heavy_modules(times) == {"requests"}
@@ -0,0 +1,138 @@
+from unittest.mock import Mock
+
+from rocket_releaser import release_notes
+from rocket_releaser.changelog import ChangeLog
+from rocket_releaser.concurrency import concurrent_imap
+from rocket_releaser.pipeline import iter_merged_pull_request_dicts, run_pipeline
+from rocket_releaser.prs import PRs
+import pytest
+
+pull_request_dicts = [
+    {
+        "number": 1,
+        "title": "closes [ENG-1]",
+        "body": "RELEASES\n- fixes [ENG-1] crash\n\nQA\n- check it",
+        "merged": True,
+    },
+    {
+        "number": 2,
+        "title": "new page",
+        "body": "RELEASES\n- [ENG-2] new page",
+        "merged": True,
+    },
+    {"number": 3, "title": "docs", "body": "no release notes", "merged": True},
+]
+
+
+class StreamGraphQL:
+    """answers associatedPRs queries with one PR per sha, recording when it was asked"""
+
+    def __init__(self, events):
+        self.events = events
+
+    def run_query(self, query, variables={}, no_retry_statuses=()):
+        aliases = [key for key in variables if key not in ("repo", "owner")]
+        self.events.append(("query", [variables[alias] for alias in aliases]))
+        repository = {}
+        for alias in aliases:
+            number = int(variables[alias])
+            node = dict(pull_request_dicts[number - 1], merged=number != 3)
+            repository[alias] = {"associatedPullRequests": {"edges": [{"node": node}]}}
+        return {"data": {"repository": repository}}
+
+
+def test_concurrent_imap_is_lazy_and_ordered():
+    read = []
+
+    def items():
+        for i in range(10):
+            read.append(i)
+            yield i
+
+    results = concurrent_imap(lambda i: i * 2, items(), max_concurrency=3)
+    assert next(results) == 0
+    assert len(read) < 10
+    assert list(results) == [i * 2 for i in range(1, 10)]
+
+
+def test_prs_are_looked_up_while_shas_are_read():
+    events = []
+
+    def deploy_shas():
+        for sha in ("1", "2", "3"):
+            events.append(("sha", sha))
+            yield sha
+
+    prs = PRs(
+        "",
+        "org",
+        "repo",
+        chunk_size=2,
+        max_concurrency=1,
+        graph_ql=StreamGraphQL(events),
+    )
+    found = list(iter_merged_pull_request_dicts(deploy_shas(), prs))
+
+    assert [pr["number"] for pr in found] == [1, 2]
+    assert events == [
+        ("sha", "1"),
+        ("sha", "2"),
+        ("query", ["1", "2"]),
+        ("sha", "3"),
+        ("query", ["3"]),
+    ]
+
+
+def test_pipeline_matches_batch_changelog():
+    changelog = ChangeLog([], "org", "repo")
+    run_pipeline(iter(pull_request_dicts), changelog)
+
+    streamed = release_notes.format_changelog(
+        changelog, "staging", "abc", "def", 0, "org", "repo"
+    )
+    batch = release_notes.turn_changelog_into_string(
+        pull_request_dicts, "staging", "abc", "def", 0, "org", "repo"
+    )
+    # first line has the time
+    assert streamed.split("\n")[1:] == batch.split("\n")[1:]
+
+
+def test_pipeline_labels_streamed_prs():
+    ticket_labeler = Mock()
+    labeled = []
+
+    def label_tickets(env_name, vpc_name, dry_run=False):
+        labeled.extend(ticket_labeler.pull_request_dicts)
+        return 2
+
+    ticket_labeler.label_tickets.side_effect = label_tickets
+
+    changelog = ChangeLog([], "org", "repo")
+    num_jira_tickets = run_pipeline(
+        iter(pull_request_dicts), changelog, ticket_labeler, "staging", "staging"
+    )
+
+    assert num_jira_tickets == 2
+    assert labeled == pull_request_dicts
+    assert changelog.pull_request_dicts == pull_request_dicts
+
+
+def test_pipeline_stops_labeling_when_finding_prs_fails():
+    ticket_labeler = Mock()
+    labeled = []
+
+    def label_tickets(env_name, vpc_name, dry_run=False):
+        for pr in ticket_labeler.pull_request_dicts:
+            labeled.append(pr)
+        return 1
+
+    ticket_labeler.label_tickets.side_effect = label_tickets
+
+    def failing_prs():
+        yield pull_request_dicts[0]
+        raise ValueError("GitHub is down")
+
+    with pytest.raises(ValueError):
+        run_pipeline(failing_prs(), ChangeLog([], "org", "repo"), ticket_labeler)
+
+    assert labeled == [pull_request_dicts[0]]
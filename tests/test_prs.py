@@ -1,26 +1,89 @@
+import re
+import tempfile
+
+from rocket_releaser.cache import Cache
+from rocket_releaser.graphql import BadReturnStatus
 from rocket_releaser.prs import PRs
 import pytest
 from pytest_mock import MockFixture
 
 
 class MockGraphQL:
+    """
+    answers aliased associatedPRs queries with the same PR for every sha,
+    and pullRequests queries with a PR for every number
+    """
 
-    val = {
-        "data": {
-            "repository": {
-                "commit": {"associatedPullRequests": {"edges": [{"node": None}]}}
-            }
-        }
-    }
+    def __init__(self):
+        self.node = None
+        self.queries = []
+        self.max_shas = None
+        self.sha_errors = {}
+        self.missing_numbers = set()
+        self.query_texts = []
+        self.query_error = None
 
     def set_return_val(self, number, body):
-        node = {"number": number, "body": body}
-        self.val["data"]["repository"]["commit"]["associatedPullRequests"]["edges"][0][
-            "node"
-        ] = node
+        self.node = {
+            "id": f"PR_{number}",
+            "title": f"PR {number}",
+            "number": number,
+            "body": body,
+            "merged": True,
+        }
+
+    def run_query(self, query, variables={}, no_retry_statuses=()):
+        aliases = [key for key in variables if key not in ("repo", "owner")]
+        self.queries.append([variables[alias] for alias in aliases])
+        self.query_texts.append(query)
+        # PR's only come with the fields asked for, which are on lines of their own
+        fields = set(re.findall(r"^\s+(\w+)$", query, re.MULTILINE))
+
+        if self.query_error:
+            return {"data": None, "errors": [self.query_error]}
 
-    def run_query(self, *args, **kwargs):
-        return self.val
+        if self.max_shas and len(aliases) > self.max_shas:
+            return {"errors": [{"type": "MAX_NODE_LIMIT_EXCEEDED", "message": "x"}]}
+
+        result = {"data": {"repository": {}}}
+        if query.startswith("query pullRequests"):
+            for alias in aliases:
+                number = variables[alias]
+                if number in self.missing_numbers:
+                    result["data"]["repository"][alias] = None
+                    result.setdefault("errors", []).append(
+                        {"path": ["repository", alias], "message": "not a PR"}
+                    )
+                else:
+                    pr = {
+                        "id": f"PR_{number}",
+                        "title": f"PR {number}",
+                        "number": number,
+                        "body": f"PR {number}",
+                        "merged": True,
+                    }
+                    result["data"]["repository"][alias] = {
+                        field: value for field, value in pr.items() if field in fields
+                    }
+            return result
+
+        for alias in aliases:
+            sha = variables[alias]
+            if sha in self.sha_errors:
+                result["data"]["repository"][alias] = None
+                result.setdefault("errors", []).append(
+                    {"path": ["repository", alias], "message": self.sha_errors[sha]}
+                )
+            else:
+                node = {
+                    field: value
+                    for field, value in self.node.items()
+                    if field in fields
+                }
+                result["data"]["repository"][alias] = {
+                    "associatedPullRequests": {"edges": [{"node": node}]}
+                }
+        return result
 
 
 m = MockGraphQL()
@@ -30,8 +93,10 @@ p = PRs("fake token", "15five", "repoName")
 @pytest.fixture(autouse=True)
 def mock_graphql(mocker: MockFixture):
     global p
+    global m
 
-    mocker.patch("rocket_releaser.prs.GraphQL", return_value=m)
+    m = MockGraphQL()
+    mocker.patch("rocket_releaser.prs.GraphQL", side_effect=lambda *args, **kwargs: m)
 
     yield
 
@@ -47,3 +112,178 @@ def test_pull_request_dicts_should_have_correct_content():
     assert pull_request_dicts[0]["number"] == 12
     assert pull_request_dicts[0]["body"] == "test"
     assert pull_request_dicts[0]["deploy_sha"] == "fake sha"
+
+
+def test_pull_request_dicts_batches_shas_into_chunks():
+    m.set_return_val(12, "test")
+
+    prs = PRs("fake token", "15five", "repoName", chunk_size=2)
+    pull_request_dicts = prs.pull_request_dicts(["a", "b", "c", "b"])
+
+    assert sorted(m.queries) == [["a", "b"], ["c"]]
+    # same PR for every sha should only show up once
+    assert len(pull_request_dicts) == 1
+    assert pull_request_dicts[0]["deploy_sha"] == "a"
+
+
+def test_pull_request_dicts_splits_rejected_chunks():
+    m.set_return_val(12, "test")
+    m.max_shas = 1
+
+    prs = PRs("fake token", "15five", "repoName", chunk_size=4)
+    pull_request_dicts = prs.pull_request_dicts(["a", "b", "c"])
+
+    assert sorted(shas for shas in m.queries if len(shas) == 1) == [["a"], ["b"], ["c"]]
+    assert len(pull_request_dicts) == 1
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        {"type": "RATE_LIMITED", "message": "API rate limit exceeded"},
+        {"message": "Bad credentials"},
+    ],
+)
+def test_pull_request_dicts_doesnt_split_chunks_rejected_for_other_reasons(
+    error, caplog
+):
+    m.query_error = error
+
+    prs = PRs("fake token", "15five", "repoName", chunk_size=4)
+    pull_request_dicts = prs.pull_request_dicts(["a", "b", "c"])
+
+    assert m.queries == [["a", "b", "c"]]
+    assert pull_request_dicts == []
+    assert error["message"] in caplog.text
+
+
+def test_pull_request_dicts_logs_per_sha_errors(caplog):
+    m.set_return_val(12, "test")
+    m.sha_errors = {"a": "Could not resolve to a commit"}
+
+    pull_request_dicts = p.pull_request_dicts(["a", "b"])
+
+    assert "error with sha a: Could not resolve to a commit" in caplog.text
+    assert pull_request_dicts[0]["deploy_sha"] == "b"
+
+
+def test_pull_request_dicts_splits_on_timeout(mocker: MockFixture):
+    m.set_return_val(12, "test")
+    run_query = m.run_query
+
+    def timeout_for_big_queries(query, variables={}, no_retry_statuses=()):
+        if len(variables) > 3:
+            # splittable queries aren't retried
+            assert 502 in no_retry_statuses
+            raise BadReturnStatus("timeout", 502)
+        return run_query(query, variables)
+
+    m.run_query = timeout_for_big_queries
+
+    assert len(p.pull_request_dicts(["a", "b"])) == 1
+
+
+def test_pull_request_dicts_only_looks_up_uncached_shas():
+    m.set_return_val(12, "test")
+    cache = Cache(tempfile.mkdtemp())
+
+    PRs("fake token", "15five", "repoName", cache=cache).pull_request_dicts(["a"])
+    pull_request_dicts = PRs(
+        "fake token", "15five", "repoName", cache=cache
+    ).pull_request_dicts(["a", "b"])
+
+    assert sorted(m.queries) == [["a"], ["b"]]
+    assert len(pull_request_dicts) == 1
+    assert pull_request_dicts[0]["deploy_sha"] == "a"
+
+
+def test_pull_request_dicts_by_commit_fetches_prs_by_number():
+    m.set_return_val(12, "test")
+    m.missing_numbers = {9}
+
+    pull_request_dicts = list(
+        p.iter_pull_request_dicts_by_commit(
+            [("merge", 5), ("side", 5), ("plain", None), ("issue", 9)]
+        )
+    )
+
+    # PR 5 once for both its commits, then the commits history didn't explain by sha
+    assert m.queries == [[5, 9], ["plain", "issue"]]
+    assert [pr["number"] for pr in pull_request_dicts] == [5, 12]
+    assert pull_request_dicts[0]["deploy_sha"] == "merge"
+    assert pull_request_dicts[1]["deploy_sha"] == "plain"
+
+
+@pytest.mark.parametrize("chunk_size", [50, 1])
+def test_every_commit_of_a_number_without_a_pr_is_looked_up_by_sha(chunk_size):
+    m.set_return_val(12, "test")
+    m.missing_numbers = {7}
+
+    pull_request_dicts = list(
+        PRs(
+            "fake token", "15five", "repoName", chunk_size=chunk_size
+        ).iter_pull_request_dicts_by_commit(
+            [("s1", 7), ("s2", 7), ("s3", 7), ("s4", None)]
+        )
+    )
+
+    looked_up_shas = [sha for query in m.queries for sha in query if sha != 7]
+    assert sorted(looked_up_shas) == ["s1", "s2", "s3", "s4"]
+    assert m.queries.count([7]) == 1
+    assert [pr["number"] for pr in pull_request_dicts] == [12]
+
+
+def test_pull_request_dicts_by_commit_only_fetches_uncached_prs():
+    cache = Cache(None)
+
+    list(
+        PRs(
+            "fake token", "15five", "repoName", cache=cache
+        ).iter_pull_request_dicts_by_commit([("a", 5)])
+    )
+    pull_request_dicts = list(
+        PRs(
+            "fake token", "15five", "repoName", cache=cache
+        ).iter_pull_request_dicts_by_commit([("a", 5), ("b", 6)])
+    )
+
+    assert m.queries == [[5], [6]]
+    assert [pr["number"] for pr in pull_request_dicts] == [5, 6]
+
+
+def test_two_phase_fetches_bodies_once_per_merged_pr():
+    m.set_return_val(12, "test")
+
+    prs = PRs("fake token", "15five", "repoName", chunk_size=2, two_phase=True)
+    pull_request_dicts = prs.pull_request_dicts(["a", "b", "c"])
+
+    assert sorted(m.queries, key=str) == [["a", "b"], ["c"], [12]]
+    [associated_query, _, pull_requests_query] = sorted(m.query_texts)
+    assert "body" not in associated_query
+    assert "body" in pull_requests_query
+    assert pull_request_dicts == [
+        {
+            "id": "PR_12",
+            "title": "PR 12",
+            "number": 12,
+            "body": "PR 12",
+            "merged": True,
+            "deploy_sha": "a",
+        }
+    ]
+
+
+def test_titles_profile_never_fetches_bodies():
+    m.set_return_val(12, "test")
+    m.missing_numbers = {9}
+
+    prs = PRs("fake token", "15five", "repoName", field_profile="titles")
+    pull_request_dicts = list(prs.iter_pull_request_dicts_by_commit([("a", 9)]))
+
+    assert not any("body" in query for query in m.query_texts)
+    assert "body" not in pull_request_dicts[0]
+
+
+def test_unknown_field_profile_is_rejected():
+    with pytest.raises(ValueError):
+        PRs("fake token", "15five", "repoName", field_profile="everything")
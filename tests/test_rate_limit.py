@@ -0,0 +1,167 @@
+import time
+from email.utils import formatdate
+
+import requests
+
+from rocket_releaser.rate_limit import RateLimiter, rate_limited_wait_seconds
+
+
+def response(status_code, headers={}, body=b""):
+    resp = requests.Response()
+    resp.status_code = status_code
+    resp.headers.update(headers)
+    resp._content = body
+    return resp
+
+
+def test_wait_doesnt_wait_with_plenty_of_budget_left(mocker):
+    sleep = mocker.patch("time.sleep")
+    limiter = RateLimiter()
+    limiter.wait("core")
+    limiter.update("core", 5000, 4000, time.time() + 3600)
+    limiter.wait("core", 2)
+
+    sleep.assert_not_called()
+    assert limiter.budget("core")["remaining"] == 3998
+
+
+def test_wait_holds_requests_until_the_reset_once_the_budget_is_used_up(mocker):
+    sleep = mocker.patch("time.sleep")
+    limiter = RateLimiter()
+    limiter.update("core", 5000, 50, time.time() + 60)
+
+    limiter.wait("core")
+
+    assert 59 < sleep.call_args[0][0] <= 60
+
+
+def test_wait_spreads_requests_out_when_the_budget_is_low(mocker):
+    sleep = mocker.patch("time.sleep")
+    limiter = RateLimiter()
+    limiter.update("graphql", 1000, 20, time.time() + 10)
+
+    for _ in range(3):
+        limiter.wait("graphql")
+
+    # 10 spendable requests left over 10s
+    waits = [call[0][0] for call in sleep.call_args_list]
+    assert len(waits) == 2
+    assert 0.9 < waits[0] <= 1 < waits[1] < 2.5
+
+
+def test_update_keeps_the_lower_count_within_a_window():
+    limiter = RateLimiter()
+    reset_at = time.time() + 60
+    limiter.update("core", 5000, 100, reset_at)
+    limiter.update("core", 5000, 200, reset_at)
+    assert limiter.budget("core")["remaining"] == 100
+
+    limiter.update("core", 5000, 4999, reset_at + 3600)
+    assert limiter.budget("core")["remaining"] == 4999
+
+
+def test_update_from_headers_and_graphql():
+    limiter = RateLimiter()
+    limiter.update_from_headers(
+        {
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "4321",
+            "X-RateLimit-Reset": "1893456000",
+            "X-RateLimit-Resource": "search",
+        },
+        "core",
+    )
+    limiter.update_from_headers({}, "core")
+    limiter.update_from_graphql(
+        "associatedPRs",
+        {
+            "cost": 3,
+            "limit": 5000,
+            "remaining": 4000,
+            "resetAt": "2030-01-01T00:00:00Z",
+        },
+    )
+
+    assert limiter.budget("search") == {
+        "limit": 5000,
+        "remaining": 4321,
+        "reset_at": 1893456000,
+        "next_at": 0.0,
+    }
+    assert limiter.budget("core") is None
+    assert limiter.budget("graphql")["reset_at"] == 1893456000
+    assert limiter.cost("associatedPRs") == 3
+    assert limiter.cost("pullRequests") == 1
+
+
+def test_rate_limited_holds_everyone_and_spaces_requests_out(mocker):
+    sleep = mocker.patch("time.sleep")
+    limiter = RateLimiter(min_spacing=0.5)
+    limiter.rate_limited(2)
+    # responses to requests in flight during the same pause don't space them out further
+    limiter.rate_limited(1)
+
+    limiter.wait("core")
+    limiter.wait("graphql")
+
+    first, second = [call[0][0] for call in sleep.call_args_list]
+    assert 1.9 < first <= 2
+    assert 2.4 < second <= 2.5
+
+
+def test_responses_that_arent_rate_limited_bring_requests_closer_again(mocker):
+    sleep = mocker.patch("time.sleep")
+    limiter = RateLimiter(min_spacing=0.5)
+    limiter.rate_limited(0)
+    for _ in range(50):
+        limiter.speed_up()
+
+    limiter.wait("core")
+    limiter.wait("core")
+
+    sleep.assert_not_called()
+
+
+def test_rate_limited_wait_seconds():
+    assert rate_limited_wait_seconds(response(200)) is None
+    assert rate_limited_wait_seconds(response(403)) is None
+    assert rate_limited_wait_seconds(response(429, {"Retry-After": "3"})) == 3
+    reset = str(int(time.time()) + 30)
+    wait = rate_limited_wait_seconds(
+        response(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": reset})
+    )
+    assert 28 < wait <= 30
+
+
+def test_rate_limited_wait_seconds_without_a_wait_in_the_headers():
+    secondary = response(
+        403, body=b'{"message": "You have exceeded a secondary rate limit"}'
+    )
+    assert rate_limited_wait_seconds(secondary) == 60
+    assert rate_limited_wait_seconds(secondary, default_wait=5) == 5
+    assert rate_limited_wait_seconds(response(429)) == 60
+    assert (
+        rate_limited_wait_seconds(response(403, body=b"Must have push access")) is None
+    )
+
+
+def test_rate_limited_wait_seconds_parses_http_date_retry_after():
+    retry_at = formatdate(time.time() + 30, usegmt=True)
+    wait = rate_limited_wait_seconds(response(429, {"Retry-After": retry_at}))
+    assert 28 < wait <= 30
+
+    past = formatdate(time.time() - 30, usegmt=True)
+    assert rate_limited_wait_seconds(response(429, {"Retry-After": past})) == 0
+    assert rate_limited_wait_seconds(response(429, {"Retry-After": "soon"})) == 60
+
+
+def test_instrument_session_pauses_on_a_secondary_rate_limit(mocker):
+    limiter = RateLimiter()
+    rate_limited = mocker.patch.object(limiter, "rate_limited")
+    session = requests.Session()
+    limiter.instrument_session(session, "core")
+
+    [hook] = session.hooks["response"]
+    hook(response(403, body=b"secondary rate limit"))
+
+    rate_limited.assert_called_once_with(60)
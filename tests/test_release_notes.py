@@ -1,4 +1,10 @@
+import asyncio
+import json
+import tempfile
+import threading
+
 from rocket_releaser import release_notes
+from rocket_releaser.prs import PRs
 import pytest
 from pytest_mock import MockFixture
 from unittest.mock import Mock
@@ -58,7 +64,9 @@ bla bla bla
         "merged": False,
     }
 
-    mocker.patch("rocket_releaser.prs.PRs.pull_request_dicts", return_value=[mock_pr_1])
+    mocker.patch(
+        "rocket_releaser.prs.PRs.iter_pull_request_dicts", return_value=[mock_pr_1]
+    )
     slack_text = release_notes.release_notes(
         "github_token",
         "0782415",
@@ -73,6 +81,84 @@ bla bla bla
     assert "0 PRs found" in slack_text
 
 
+def test_async_release_notes(mocker):
+    mock_pr = {"number": 1, "title": "Fix it", "body": "", "merged": True}
+    mocker.patch(
+        "rocket_releaser.prs.PRs.iter_pull_request_dicts", return_value=[mock_pr]
+    )
+
+    slack_text = asyncio.run(
+        release_notes.async_release_notes(
+            "github_token",
+            "0782415",
+            "8038fc3",
+            "org_name",
+            "repo_name",
+            label_tickets=False,
+            dry_run=True,
+            fetch_before=False,
+        )
+    )
+    assert "1 PRs found" in slack_text
+
+
+def test_release_notes_inside_a_running_event_loop(mocker):
+    mock_pr = {"number": 1, "title": "Fix it", "body": "", "merged": True}
+    mocker.patch(
+        "rocket_releaser.prs.PRs.iter_pull_request_dicts", return_value=[mock_pr]
+    )
+
+    async def caller():
+        return release_notes.release_notes(
+            "github_token",
+            "0782415",
+            "8038fc3",
+            "org_name",
+            "repo_name",
+            label_tickets=False,
+            dry_run=True,
+            fetch_before=False,
+        )
+
+    assert "1 PRs found" in asyncio.run(caller())
+
+
+def test_release_notes_posted_before_labeling(mocker):
+    mock_pr = {"number": 1, "title": "[ENG-1] Fix it", "body": "", "merged": True}
+    mocker.patch(
+        "rocket_releaser.prs.PRs.iter_pull_request_dicts", return_value=[mock_pr]
+    )
+    posted = threading.Event()
+    post = mocker.patch(
+        "rocket_releaser.release_notes.post_deployment_message_to_slack",
+        side_effect=lambda *args: posted.set(),
+    )
+
+    def label_tickets(env_name, vpc_name, dry_run=False):
+        list(ticket_labeler.pull_request_dicts)
+        assert posted.wait(5), "release notes weren't posted until labeling was done"
+        return 3
+
+    ticket_labeler = Mock(label_tickets=label_tickets, jira_token="jira token")
+
+    slack_text = release_notes.release_notes(
+        "github_token",
+        "0782415",
+        "8038fc3",
+        "org_name",
+        "repo_name",
+        slack_webhook_key="fake slack key",
+        fetch_before=False,
+        ticket_labeler=ticket_labeler,
+        post_before_labeling=True,
+    )
+
+    [notes], [tickets_found] = [call[0][1:2] for call in post.call_args_list]
+    assert "Labeling jira tickets" in notes and "1 PRs found" in notes
+    assert "3 jira tickets found" in tickets_found
+    assert slack_text == notes + "\n" + tickets_found
+
+
 def test_turn_changelog_into_string_has_qa_notes():
     mock_pr_1 = {
         "number": 1,
@@ -137,3 +223,156 @@ bla bla bla
         [mock_pr_1], "preview", "", "", 55, "org_name", "repo_name"
     )
     assert "55" in changelog_str
+
+
+def make_targets(*repo_names):
+    return [
+        {
+            "org_name": "org_name",
+            "repo_name": repo_name,
+            "repo_dir": ".",
+            "from_revision": "0782415",
+            "to_revision": "8038fc3",
+        }
+        for repo_name in repo_names
+    ]
+
+
+def test_multi_repo_release_notes_labels_shared_tickets_once(mocker):
+    prs_by_repo = {
+        "api": [{"number": 1, "title": "[ENG-1] api", "body": "", "merged": True}],
+        "web": [
+            {"number": 1, "title": "[ENG-1] web", "body": "", "merged": True},
+            {"number": 2, "title": "[ENG-2] web", "body": "", "merged": True},
+        ],
+    }
+    mocker.patch.object(
+        PRs,
+        "iter_pull_request_dicts",
+        autospec=True,
+        side_effect=lambda prs, deploy_shas: iter(prs_by_repo[prs.repo_name]),
+    )
+    label_tickets = mocker.spy(release_notes.TicketLabeler, "label_tickets")
+
+    slack_text = release_notes.multi_repo_release_notes(
+        "github_token",
+        make_targets("api", "web"),
+        jira_token="jira_token",
+        fetch_before=False,
+        dry_run=True,
+    )
+
+    assert "2 jira tickets found" in slack_text
+    assert "3 PRs found" in slack_text
+    assert "*org_name/api (" in slack_text and "*org_name/web (" in slack_text
+    # a labeler per repo for the PR's, & one for every repo's tickets
+    assert label_tickets.call_count == 3
+
+
+def test_multi_repo_release_notes_combined_output(mocker):
+    mocker.patch.object(
+        PRs,
+        "iter_pull_request_dicts",
+        autospec=True,
+        side_effect=lambda prs, deploy_shas: iter(
+            [
+                {
+                    "number": 1,
+                    "title": "",
+                    "body": f"RELEASES\n{prs.repo_name} change\n",
+                    "merged": True,
+                }
+            ]
+        ),
+    )
+
+    slack_text = release_notes.multi_repo_release_notes(
+        "github_token",
+        make_targets("api", "web"),
+        label_tickets=False,
+        fetch_before=False,
+        dry_run=True,
+        output="combined",
+    )
+
+    features = slack_text.split("*Features*")[1]
+    assert "api change" in features and "web change" in features
+    assert slack_text.count("*Features*") == 1
+
+
+def test_main_with_config(mocker):
+    multi_repo_release_notes = mocker.patch(
+        "rocket_releaser.release_notes.multi_repo_release_notes"
+    )
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as config_file:
+        json.dump({"targets": make_targets("api", "web")}, config_file)
+        config_file.flush()
+
+        release_notes.main(["github token", "--config", config_file.name])
+
+    args, kwargs = multi_repo_release_notes.call_args
+    assert args == ("github token", make_targets("api", "web"))
+    assert kwargs["output"] == "per_repo"
+
+
+def test_load_targets_requires_repo_keys():
+    targets = make_targets("api")
+    del targets[0]["repo_dir"]
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as config_file:
+        json.dump({"targets": targets}, config_file)
+        config_file.flush()
+
+        with pytest.raises(ValueError, match="repo_dir"):
+            release_notes.load_targets(config_file.name)
+
+
+def test_release_notes_posted_once_without_a_jira_token(mocker):
+    mocker.patch("rocket_releaser.prs.PRs.iter_pull_request_dicts", return_value=[])
+    post = mocker.patch(
+        "rocket_releaser.release_notes.post_deployment_message_to_slack"
+    )
+
+    slack_text = release_notes.release_notes(
+        "github_token",
+        "0782415",
+        "8038fc3",
+        "org_name",
+        "repo_name",
+        slack_webhook_key="fake slack key",
+        fetch_before=False,
+        post_before_labeling=True,
+    )
+
+    assert post.call_count == 1
+    assert "0 jira tickets found" in slack_text
+    assert "Labeling jira tickets" not in slack_text
+
+
+def test_labeling_is_waited_for_when_posting_before_it_fails(mocker):
+    mocker.patch("rocket_releaser.prs.PRs.iter_pull_request_dicts", return_value=[])
+    mocker.patch(
+        "rocket_releaser.release_notes.post_deployment_message_to_slack",
+        side_effect=RuntimeError("slack is down"),
+    )
+    labeled = threading.Event()
+
+    def label_tickets(env_name, vpc_name, dry_run=False):
+        list(ticket_labeler.pull_request_dicts)
+        labeled.set()
+        return 0
+
+    ticket_labeler = Mock(label_tickets=label_tickets, jira_token="jira token")
+
+    with pytest.raises(RuntimeError, match="slack is down"):
+        release_notes.release_notes(
+            "github_token",
+            "0782415",
+            "8038fc3",
+            "org_name",
+            "repo_name",
+            slack_webhook_key="fake slack key",
+            fetch_before=False,
+            ticket_labeler=ticket_labeler,
+            post_before_labeling=True,
+        )
+    assert labeled.is_set()
@@ -0,0 +1,175 @@
+import http.client
+import json
+import socket
+import tempfile
+import threading
+from os import path
+
+import pytest
+import requests
+from rocket_releaser import stats
+from rocket_releaser.server import ReleaseNotesService, is_valid_revision, make_server
+
+REQUEST = {
+    "org_name": "org_name",
+    "repo_name": "repo_name",
+    "repo_dir": ".",
+    "from_revision": "0782415",
+    "to_revision": "8038fc3",
+    "label_tickets": False,
+}
+
+
+@pytest.fixture
+def service():
+    service = ReleaseNotesService("github token", ["."])
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def mock_release_notes(mocker):
+    def release_notes(*args, **kwargs):
+        with stats.stage("format_changelog"):
+            return f"notes for {args[3]}/{args[4]}"
+
+    return mocker.patch(
+        "rocket_releaser.server.release_notes", side_effect=release_notes
+    )
+
+
+def serve(server):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_release_notes_returns_text_and_stats(service, mock_release_notes):
+    response = service.release_notes(REQUEST)
+
+    assert response["text"] == "notes for org_name/repo_name"
+    assert "format_changelog" in response["stats"]["stages"]
+    kwargs = mock_release_notes.call_args[1]
+    assert kwargs["graph_ql"] is service.graph_ql
+    assert kwargs["cache"] is service.cache
+
+
+def test_clients_are_reused_between_requests(service, mock_release_notes):
+    service.release_notes(REQUEST)
+    service.release_notes(dict(REQUEST, env_name="staging"))
+
+    first, second = [call[1] for call in mock_release_notes.call_args_list]
+    assert first["git_backend"] is second["git_backend"]
+
+
+def test_identical_requests_are_coalesced(service, mocker):
+    started = threading.Event()
+    finish = threading.Event()
+
+    def release_notes(*args, **kwargs):
+        started.set()
+        finish.wait(5)
+        return "notes"
+
+    mock_release_notes = mocker.patch(
+        "rocket_releaser.server.release_notes", side_effect=release_notes
+    )
+
+    responses = []
+    first = threading.Thread(
+        target=lambda: responses.append(service.release_notes(REQUEST))
+    )
+    first.start()
+    started.wait(5)
+    second = threading.Thread(
+        target=lambda: responses.append(service.release_notes(dict(REQUEST)))
+    )
+    second.start()
+    # give the second request time to find the first one pending
+    second.join(0.2)
+    finish.set()
+    first.join(5)
+    second.join(5)
+
+    assert mock_release_notes.call_count == 1
+    assert len(responses) == 2 and responses[0] is responses[1]
+
+
+@pytest.mark.parametrize(
+    "request_, error",
+    [
+        ([], "JSON object"),
+        ({"org_name": "org_name"}, "missing"),
+        (dict(REQUEST, github_token="x"), "unknown request keys github_token"),
+        (dict(REQUEST, fetch_mode="sometimes"), "fetch_mode"),
+        (dict(REQUEST, repo_dir="/"), "repo_dir / isn't served"),
+        (dict(REQUEST, search_branch="--upload-pack=touch pwned;"), "search_branch"),
+        (dict(REQUEST, from_revision="--output=/tmp/x"), "from_revision"),
+        (dict(REQUEST, to_revision=["8038fc3"]), "to_revision"),
+        (dict(REQUEST, from_revision="nope\nHEAD"), "from_revision"),
+        (dict(REQUEST, to_revision="8038fc3 1"), "to_revision"),
+        (dict(REQUEST, from_revision="0782415..HEAD"), "from_revision"),
+        (dict(REQUEST, search_branch="master\x00"), "search_branch"),
+        (dict(REQUEST, search_branch="HEAD~1"), "search_branch"),
+        (dict(REQUEST, search_branch="feature/.hidden"), "search_branch"),
+        (dict(REQUEST, search_branch="release.lock"), "search_branch"),
+        (dict(REQUEST, dry_run="false"), "dry_run should be true or false"),
+        (dict(REQUEST, label_tickets=0), "label_tickets should be true or false"),
+        (dict(REQUEST, env_name=["prod"]), "env_name should be a string"),
+    ],
+)
+def test_bad_requests(service, request_, error):
+    with pytest.raises(ValueError, match=error):
+        service.release_notes(request_)
+
+
+@pytest.mark.parametrize(
+    "revision", ["0782415", "v1.2.0", "origin/master", "HEAD~2", "8038fc3^", "HEAD^2~1"]
+)
+def test_good_revisions(revision):
+    assert is_valid_revision(revision)
+
+
+def test_http(service, mock_release_notes):
+    server = make_server(service, port=0)
+    serve(server)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        response = requests.post(url + "/release_notes", json=REQUEST)
+        assert response.status_code == 200
+        assert response.json()["text"] == "notes for org_name/repo_name"
+
+        response = requests.post(url + "/release_notes", data="not json")
+        assert response.status_code == 400
+
+        mock_release_notes.side_effect = RuntimeError("git broke")
+        response = requests.post(url + "/release_notes", json=REQUEST)
+        assert response.status_code == 500
+        assert response.json() == {"error": "git broke"}
+
+        assert requests.get(url + "/health").json() == {"status": "ok"}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="needs unix sockets")
+def test_unix_socket(service, mock_release_notes):
+    socket_path = path.join(tempfile.mkdtemp(), "rocket_releaser.sock")
+    server = make_server(service, socket_path=socket_path)
+    serve(server)
+
+    class UnixConnection(http.client.HTTPConnection):
+        def connect(self):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path)
+
+    try:
+        connection = UnixConnection("localhost")
+        connection.request("POST", "/release_notes", json.dumps(REQUEST))
+        response = connection.getresponse()
+        assert response.status == 200
+        assert json.loads(response.read())["text"] == "notes for org_name/repo_name"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -116,8 +116,78 @@ def test_old_commit_in_shas():
     # ^ sanity check
 
 
+def test_iter_shas_streams_same_shas_as_get_shas():
+    commit_random_file()
+    head = repo.head.commit.hexsha
+
+    sha_iterator = shas.iter_shas(first_commit.hexsha, head)
+
+    assert next(sha_iterator) == head
+    assert [head] + list(sha_iterator) == shas.get_shas(first_commit.hexsha, head)
+
+
+def test_compact_shas_match_full_shas():
+    # commit every message in the fixtures, minus the rev-list "commit" headers
+    for msg in [cherry_pick_commit_msg] + commit_msgs.split("commit ")[1:]:
+        body = msg.split("\n", 1)[1]
+        repo.git.commit("--allow-empty", "-m", body)
+    head = repo.head.commit.hexsha
+
+    compact_shas = SHAs(tmp_dirpath, compact=True)
+    full_shas = shas.get_shas(first_commit.hexsha, head)
+
+    assert "c8e9114beabca79e4497f9ea40499c80cebe902a" in full_shas
+    assert compact_shas.get_shas(first_commit.hexsha, head) == full_shas
+
+
+def test_iter_shas_with_prs_reads_prs_from_merge_and_squash_subjects():
+    repo_dir = tempfile.mkdtemp()
+    pr_repo = Repo.init(repo_dir)
+    pr_repo.git.config("user.email", "test_user@example.com")
+    pr_repo.git.config("user.name", "test_user")
+
+    def commit(message):
+        pr_repo.git.commit("--allow-empty", "-m", message)
+        return pr_repo.head.commit.hexsha
+
+    base = commit("base")
+    pr_repo.git.checkout("-b", "feature")
+    feature_commits = [commit("feature 1"), commit("feature 2")]
+    pr_repo.git.checkout("master")
+    squashed = commit("Fix the thing (#7)")
+    pr_repo.git.merge(
+        "--no-ff", "-m", "Merge pull request #5 from org/feature", "feature"
+    )
+    merge = pr_repo.head.commit.hexsha
+    plain = commit(
+        "hotfix\n\n(cherry picked from commit c8e9114beabca79e4497f9ea40499c80cebe902a)"
+    )
+
+    shas_with_prs = list(
+        SHAs(repo_dir, fetch_before=False).iter_shas_with_prs(base, plain)
+    )
+
+    assert dict(shas_with_prs) == {
+        plain: None,
+        "c8e9114beabca79e4497f9ea40499c80cebe902a": None,
+        merge: 5,
+        feature_commits[0]: 5,
+        feature_commits[1]: 5,
+        squashed: 7,
+    }
+    assert sorted(sha for sha, _ in shas_with_prs) == sorted(
+        SHAs(repo_dir, fetch_before=False).get_shas(base, plain)
+    )
+
+    pr_repo.close()
+    shutil.rmtree(repo_dir)
+
+
 def test_not_in_range():
     assert not shas.get_shas("nonexistant sha", "nonexistant sha")
+    assert not SHAs(tmp_dirpath, compact=True).get_shas(
+        "nonexistant sha", "nonexistant sha"
+    )
 
 
 def test_branch_exists():
@@ -127,5 +197,70 @@ def test_branch_exists():
     )
 
 
+def make_origin():
+    """bare repo to fetch from, with three commits pushed to master"""
+    origin_dir = tempfile.mkdtemp()
+    origin = Repo.init(origin_dir, bare=True)
+    origin.git.config("uploadpack.allowFilter", "true")
+
+    work = Repo.clone_from(origin_dir, tempfile.mkdtemp())
+    work.git.config("user.email", "test_user@example.com")
+    work.git.config("user.name", "test_user")
+    for i in range(3):
+        work.git.commit("--allow-empty", "-m", f"change {i}")
+    work.git.push("origin", "HEAD:master")
+    return origin_dir, work
+
+
+def push_commit(work):
+    work.git.commit("--allow-empty", "-m", "new commit")
+    work.git.push("origin", "HEAD:master")
+    return work.head.commit.hexsha
+
+
+def test_smart_fetch_skips_when_revisions_are_local(mocker):
+    origin_dir, work = make_origin()
+    clone = Repo.clone_from(origin_dir, tempfile.mkdtemp())
+
+    smart_shas = SHAs(clone.working_tree_dir, fetch_mode="smart")
+    mocker.spy(smart_shas.backend, "fetch")
+
+    my_shas = smart_shas.get_shas("HEAD~1", "HEAD")
+
+    assert my_shas == [work.head.commit.hexsha]
+    assert smart_shas.backend.fetch.call_count == 0
+
+
+def test_smart_fetch_fetches_missing_revisions():
+    origin_dir, work = make_origin()
+    clone = Repo.clone_from(origin_dir, tempfile.mkdtemp())
+    old_sha = clone.head.commit.hexsha
+    new_sha = push_commit(work)
+
+    smart_shas = SHAs(
+        clone.working_tree_dir, fetch_mode="smart", fetch_filter="blob:none"
+    )
+
+    assert smart_shas.fetch(old_sha, new_sha) == "partial fetch (blob:none)"
+    assert smart_shas.get_shas(old_sha, new_sha) == [new_sha]
+
+
+def test_smart_fetch_deepens_shallow_clone():
+    origin_dir, work = make_origin()
+    # clone only has the last commit, so it can't tell where the first one split off
+    old_sha = work.commit("HEAD~2").hexsha
+    clone = Repo.clone_from(f"file://{origin_dir}", tempfile.mkdtemp(), depth=1)
+    new_sha = push_commit(work)
+
+    smart_shas = SHAs(clone.working_tree_dir, fetch_mode="smart", deepen_by=1)
+
+    assert "deepened shallow clone" in smart_shas.fetch(old_sha, new_sha)
+    assert smart_shas.get_shas(old_sha, new_sha) == [
+        new_sha,
+        work.commit("HEAD~1").hexsha,
+        work.commit("HEAD~2").hexsha,
+    ]
+
+
 def teardown_module():
     repo.close()
@@ -0,0 +1,106 @@
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+from rocket_releaser import stats
+from rocket_releaser.cache import Cache
+from rocket_releaser.graphql import GraphQL
+from rocket_releaser.git_backends import SubprocessGitBackend
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = b'{"data": {}}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_stats_collector_adds_up_everything_recorded():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cache = Cache(tempfile.mkdtemp())
+    cache.set_associated_prs("15five", "repo", {"a": []})
+
+    collector = stats.StatsCollector()
+    with stats.collecting(collector):
+        with stats.stage("lookups"):
+            graph_ql = GraphQL(f"http://127.0.0.1:{server.server_address[1]}/graphql")
+            graph_ql.run_query("query { viewer { login } }")
+            graph_ql.run_query("query { viewer { login } }")
+            cache.get_associated_prs("15five", "repo", ["a", "b"])
+            SubprocessGitBackend(tempfile.mkdtemp()).branch_exists("master")
+    server.shutdown()
+
+    # recorded after the collector was removed
+    with stats.stage("lookups"):
+        pass
+
+    collected = collector.to_dict()
+    assert list(collected["stages"]) == ["lookups"]
+    http = collected["http"]["github_graphql"]
+    assert http["requests"] == 2
+    assert http["errors"] == 0
+    assert http["bytes_received"] == 2 * len(b'{"data": {}}')
+    assert http["bytes_sent"] > 0
+    assert sum(http["latency_histogram_ms"].values()) == 2
+    assert collected["git"]["commands"] == 1
+    assert collected["caches"]["associated_prs"] == {
+        "hits": 1,
+        "misses": 1,
+        "hit_rate": 0.5,
+    }
+
+    summary = collector.summary()
+    assert "lookups:" in summary
+    assert "github_graphql: 2 requests (0 errors)" in summary
+    assert "associated_prs: 1 hits, 1 misses (50%)" in summary
+
+
+def test_broken_collectors_dont_break_the_run(caplog):
+    class BrokenCollector(stats.Collector):
+        def stage(self, name, seconds):
+            raise ValueError("oops")
+
+    with stats.collecting(BrokenCollector()):
+        with stats.stage("fine"):
+            pass
+
+    assert "stats collector" in caplog.text
+
+
+def test_stats_json_is_written(mocker):
+    mocker.patch("github3.GitHub")
+    mocker.patch("jira.JIRA")
+    mocker.patch("rocket_releaser.slack.slacker")
+    from rocket_releaser import release_notes
+
+    stats_path = path.join(tempfile.mkdtemp(), "stats.json")
+    release_notes.main(
+        [
+            "github token",
+            "0782415",
+            "8038fc3",
+            "org_name",
+            "repo_name",
+            "--skip-fetch",
+            "--stats-json",
+            stats_path,
+        ]
+    )
+
+    with open(stats_path) as stats_file:
+        written = json.load(stats_file)
+    assert {"release_notes", "pull_request_dicts", "format_changelog"} <= set(
+        written["stages"]
+    )
+    assert written["git"]["commands"] > 0
@@ -1,8 +1,14 @@
+import json
+
+import jira
+import requests
+from rocket_releaser.cache import Cache
 from rocket_releaser.ticket_labeler import TicketLabeler
 import pytest
 from pytest_mock import MockFixture
 from unittest.mock import Mock
 from rocket_releaser.prs import PRs
+from rocket_releaser.rate_limit import RateLimiter
 
 
 @pytest.fixture(autouse=True)
@@ -298,3 +304,499 @@ def test_get_jira_ticket_maps_for_multiple_issue_string():
     assert jira_ticket_info[1]["transition"] == "fixes"
     assert jira_ticket_info[2]["issue"] == "ENG-4567"
     assert jira_ticket_info[2]["transition"] is None
+
+
+def test_concurrent_labeling_keeps_transition_before_label(mocker: MockFixture):
+    pull_request_dicts = [
+        {"number": 5, "title": "closes [ENG-666]"},
+        {"number": 6, "title": "fixes [ENG-667]"},
+        {"number": 7, "title": "more for [ENG-666]"},
+    ]
+
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+        max_concurrency=4,
+    )
+    calls = []
+    mocker.patch.object(
+        t, "mark_in_review_jira_ticket", side_effect=lambda issue: calls.append(issue)
+    )
+    mocker.patch.object(
+        t,
+        "label_jira_ticket",
+        side_effect=lambda issue, name, label: calls.append((name, label)),
+    )
+    t.jira.issue.side_effect = lambda name: name
+
+    numTickets = t.label_tickets("preview", "preview")
+
+    assert numTickets == 2
+    assert t.gh.issue.call_count == 3
+    eng_666_calls = [call for call in calls if "ENG-666" in call]
+    assert eng_666_calls == [
+        "ENG-666",
+        ("ENG-666", "preview"),
+        ("ENG-666", "preview"),
+    ]
+
+
+def test_concurrent_labeling_logs_errors_per_ticket(mocker: MockFixture, caplog):
+    pull_request_dicts = [
+        {"number": 5, "title": "closes [ENG-666]"},
+        {"number": 6, "title": "fixes [ENG-667]"},
+    ]
+
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+        max_concurrency=4,
+    )
+    mocker.patch.object(
+        t, "label_jira_ticket", side_effect=ValueError("labels can't have spaces!")
+    )
+
+    numTickets = t.label_tickets("staging", "staging")
+
+    assert numTickets == 2
+    assert "error with closes [ENG-666]" in caplog.text
+    assert "error with fixes [ENG-667]" in caplog.text
+
+
+def test_jira_tickets_are_fetched_in_pages(mocker: MockFixture):
+    pull_request_dicts = [
+        {"number": i, "title": f"closes [ENG-{i}]"} for i in range(1, 151)
+    ]
+
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+    )
+    mocker.patch.object(t, "label_jira_ticket")
+
+    def search_issues(jql, maxResults, fields, validate_query=True):
+        keys = jql[len("key in (") : -1].split(", ")
+        return [Mock(key=key) for key in keys]
+
+    t.jira.search_issues.side_effect = search_issues
+
+    numTickets = t.label_tickets("staging", "staging")
+
+    assert numTickets == 150
+    assert t.jira.search_issues.call_count == 2
+    assert (
+        t.jira.search_issues.call_args[1]["fields"] == "labels,status,project,issuetype"
+    )
+    assert t.jira.issue.call_count == 0
+    assert t.label_jira_ticket.call_count == 150
+
+
+def test_jira_tickets_missing_from_search_are_fetched_one_at_a_time(
+    mocker: MockFixture,
+):
+    pull_request_dicts = [
+        {"number": 5, "title": "closes [ENG-666]"},
+        {"number": 6, "title": "fixes [ENG-667]"},
+    ]
+
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+    )
+    mocker.patch.object(t, "label_jira_ticket")
+    t.jira.search_issues.return_value = [Mock(key="ENG-666")]
+
+    assert t.label_tickets("staging", "staging") == 2
+    t.jira.issue.assert_called_once_with("ENG-667")
+
+
+def test_a_bad_key_only_splits_its_search_page(mocker: MockFixture):
+    pull_request_dicts = [
+        {"number": i, "title": f"fixes [ENG-{i}]"} for i in range(1, 9)
+    ] + [{"number": 9, "title": "fixes UTF-8"}]
+
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+    )
+    mocker.patch.object(t, "label_jira_ticket")
+
+    def search_issues(jql, maxResults, fields, validate_query=True):
+        keys = jql[len("key in (") : -1].split(", ")
+        if "UTF-8" in keys:
+            raise jira.exceptions.JIRAError("The issue key 'UTF-8' is invalid")
+        return [Mock(key=key) for key in keys]
+
+    t.jira.search_issues.side_effect = search_issues
+
+    assert t.label_tickets("staging", "staging") == 9
+    assert t.jira.search_issues.call_args[1]["validate_query"] is False
+    # 9 keys, then halves until UTF-8 is on its own
+    assert t.jira.search_issues.call_count <= 9
+    t.jira.issue.assert_called_once_with("UTF-8")
+
+
+def make_bulk_labeler(num_tickets: int) -> TicketLabeler:
+    pull_request_dicts = [
+        {"number": i, "title": f"fixes [ENG-{i}]"} for i in range(1, num_tickets + 1)
+    ]
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+        bulk_jira_labels=True,
+    )
+    t.jira._options = {"server": "https://foo.atlassian.net"}
+    t.jira.search_issues.return_value = []
+    return t
+
+
+def test_bulk_jira_labels_edits_all_tickets_in_one_task(mocker: MockFixture):
+    t = make_bulk_labeler(3)
+    mocker.patch.object(t, "label_jira_ticket")
+    t.jira._session.post.return_value.json.return_value = {"taskId": "10"}
+    t.jira._session.get.return_value.json.return_value = {"status": "COMPLETE"}
+
+    assert t.label_tickets("staging", "staging") == 3
+
+    assert t.label_jira_ticket.call_count == 0
+    (url,) = t.jira._session.post.call_args[0]
+    assert url == "https://foo.atlassian.net/rest/api/3/bulk/issues/fields"
+    body = json.loads(t.jira._session.post.call_args[1]["data"])
+    assert body["selectedIssueIdsOrKeys"] == ["ENG-1", "ENG-2", "ENG-3"]
+    assert body["editedFieldsInput"]["labelsFields"][0]["labels"] == [
+        {"name": "staging"}
+    ]
+    t.jira._session.get.assert_called_once_with(
+        "https://foo.atlassian.net/rest/api/3/bulk/queue/10"
+    )
+
+
+def test_bulk_jira_labels_logs_failed_tickets(mocker: MockFixture, caplog):
+    t = make_bulk_labeler(2)
+    t.jira._session.post.return_value.json.return_value = {"taskId": "10"}
+    t.jira._session.get.return_value.json.return_value = {
+        "status": "COMPLETE",
+        "failedAccessibleIssues": {"ENG-2": ["Issue is closed"]},
+    }
+
+    t.label_tickets("staging", "staging")
+
+    assert "error with ENG-2: Issue is closed" in caplog.text
+
+
+def test_bulk_jira_labels_falls_back_to_one_ticket_at_a_time(mocker: MockFixture):
+    t = make_bulk_labeler(2)
+    t.jira._session.post.side_effect = jira.exceptions.JIRAError(status_code=404)
+    t.jira._get_url.side_effect = lambda path: "https://foo.atlassian.net/" + path
+
+    t.label_tickets("staging", "staging")
+
+    assert sorted(call[0][0] for call in t.jira._session.put.call_args_list) == [
+        "https://foo.atlassian.net/issue/ENG-1",
+        "https://foo.atlassian.net/issue/ENG-2",
+    ]
+    assert json.loads(t.jira._session.put.call_args[1]["data"]) == {
+        "update": {"labels": [{"add": "staging"}]}
+    }
+
+
+@pytest.mark.parametrize(
+    "status_code, body",
+    [(500, {"errorMessages": ["Internal server error"]}), (200, {}), (200, None)],
+)
+def test_bulk_jira_labels_falls_back_when_the_task_isnt_submitted(
+    mocker: MockFixture, status_code, body
+):
+    t = make_bulk_labeler(2)
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b"<html>" if body is None else json.dumps(body).encode()
+    t.jira._session.post.return_value = response
+    t.jira._get_url.side_effect = lambda path: "https://foo.atlassian.net/" + path
+
+    t.label_tickets("staging", "staging")
+
+    assert t.jira._session.get.call_count == 0
+    assert sorted(call[0][0] for call in t.jira._session.put.call_args_list) == [
+        "https://foo.atlassian.net/issue/ENG-1",
+        "https://foo.atlassian.net/issue/ENG-2",
+    ]
+
+
+def test_bulk_jira_labels_skipped_on_dry_run(mocker: MockFixture):
+    t = make_bulk_labeler(2)
+
+    t.label_tickets("staging", "staging", dry_run=True)
+
+    assert t.jira._session.post.call_count == 0
+    assert t.jira._session.put.call_count == 0
+
+
+class MockLabelGraphQL:
+    """answers label id queries & aliased addLabelsToLabelable mutations"""
+
+    def __init__(self, label_id="LA_1", pr_errors=None, mutation_error=None):
+        self.label_id = label_id
+        self.pr_errors = pr_errors or {}
+        self.mutation_error = mutation_error
+        self.labeled = []
+        self.num_queries = 0
+        self.rate_limiter = RateLimiter()
+
+    def run_query(self, query, variables={}, no_retry_statuses=()):
+        self.num_queries += 1
+        if query.lstrip().startswith("query labelId"):
+            label = {"id": self.label_id} if self.label_id else None
+            return {"data": {"repository": {"label": label}}}
+
+        assert variables["labelIds"] == [self.label_id]
+        if self.mutation_error:
+            return {"data": None, "errors": [{"message": self.mutation_error}]}
+        result = {"data": {}}
+        for alias, pr_id in variables.items():
+            if alias == "labelIds":
+                continue
+            if pr_id in self.pr_errors:
+                result.setdefault("errors", []).append(
+                    {"path": [alias], "message": self.pr_errors[pr_id]}
+                )
+            else:
+                self.labeled.append(pr_id)
+        return result
+
+    def share_connection_pool(self, session):
+        pass
+
+
+def make_graphql_labeler(pull_request_dicts, graph_ql) -> TicketLabeler:
+    return TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        graph_ql=graph_ql,
+        pr_label_backend="graphql",
+    )
+
+
+def test_graphql_pr_labels_are_batched():
+    pull_request_dicts = [
+        {"number": i, "title": "foo", "id": f"PR_{i}"} for i in range(150)
+    ]
+    graph_ql = MockLabelGraphQL()
+
+    make_graphql_labeler(pull_request_dicts, graph_ql).label_tickets(
+        "staging", "staging"
+    )
+
+    # label id lookup + 2 chunks of mutations
+    assert graph_ql.num_queries == 3
+    assert sorted(graph_ql.labeled) == sorted(pr["id"] for pr in pull_request_dicts)
+
+
+def test_graphql_pr_labels_fall_back_to_rest_without_ids():
+    pull_request_dicts = [
+        {"number": 1, "title": "foo", "id": "PR_1"},
+        {"number": 2, "title": "bar"},
+    ]
+    graph_ql = MockLabelGraphQL()
+
+    t = make_graphql_labeler(pull_request_dicts, graph_ql)
+    t.label_tickets("staging", "staging")
+
+    assert graph_ql.labeled == ["PR_1"]
+    t.gh.issue.assert_called_once_with("", "", 2)
+
+
+def test_graphql_pr_labels_fall_back_to_rest_for_new_labels():
+    pull_request_dicts = [{"number": 1, "title": "foo", "id": "PR_1"}]
+    graph_ql = MockLabelGraphQL(label_id=None)
+
+    t = make_graphql_labeler(pull_request_dicts, graph_ql)
+    t.label_tickets("staging", "staging")
+
+    assert graph_ql.labeled == []
+    t.gh.issue.assert_called_once_with("", "", 1)
+
+
+def test_graphql_pr_label_errors_are_logged_per_pr(caplog):
+    pull_request_dicts = [
+        {"number": 1, "title": "foo", "id": "PR_1"},
+        {"number": 2, "title": "bar", "id": "PR_2"},
+    ]
+    graph_ql = MockLabelGraphQL(pr_errors={"PR_2": "Resource not accessible"})
+
+    make_graphql_labeler(pull_request_dicts, graph_ql).label_tickets(
+        "staging", "staging"
+    )
+
+    assert graph_ql.labeled == ["PR_1"]
+    assert "Error during labeling pr #2: Resource not accessible" in caplog.text
+
+
+def test_graphql_pr_labels_fall_back_to_rest_when_the_mutation_is_rejected():
+    pull_request_dicts = [
+        {"number": 1, "title": "foo", "id": "PR_1"},
+        {"number": 2, "title": "bar", "id": "PR_2"},
+    ]
+    graph_ql = MockLabelGraphQL(mutation_error="Something went wrong")
+
+    t = make_graphql_labeler(pull_request_dicts, graph_ql)
+    t.label_tickets("staging", "staging")
+
+    assert graph_ql.labeled == []
+    assert sorted(call[0][2] for call in t.gh.issue.call_args_list) == [1, 2]
+
+
+def test_unknown_pr_label_backend():
+    with pytest.raises(ValueError):
+        TicketLabeler("", [], "", "", pr_label_backend="carrier pigeon")
+
+
+def make_issue(key: str, status: str, project="ENG", issue_type="Story") -> Mock:
+    issue = Mock(key=key)
+    issue.fields.project.key = project
+    issue.fields.issuetype.name = issue_type
+    issue.fields.status.name = status
+    return issue
+
+
+WORKFLOW = {
+    "In Progress": [{"id": "771", "name": "Code Review", "to": {"name": "In Review"}}],
+    "Open": [{"id": "851", "name": "Close", "to": {"name": "Closed"}}],
+    "Closed": [{"id": "861", "name": "Deployed", "to": {"name": "Deployed"}}],
+}
+
+
+def test_transitions_are_looked_up_once_per_workflow_status():
+    t = TicketLabeler("", [], "", "", "fakeJiraToken")
+    t.jira.transitions.side_effect = lambda issue: WORKFLOW[issue.fields.status.name]
+    issues = [make_issue(f"ENG-{i}", "In Progress") for i in range(3)]
+
+    for issue in issues:
+        t.mark_in_review_jira_ticket(issue)
+
+    assert t.jira.transitions.call_count == 1
+    assert [call[0][1] for call in t.jira.transition_issue.call_args_list] == [
+        "771"
+    ] * 3
+    assert all(issue.fields.status.name == "In Review" for issue in issues)
+
+    # other issue types may be on other workflows
+    t.mark_in_review_jira_ticket(make_issue("ENG-4", "In Progress", issue_type="Bug"))
+    assert t.jira.transitions.call_count == 2
+
+
+def test_transitions_are_cached_between_runs(tmp_path):
+    cache = Cache(str(tmp_path))
+    looked_up = []
+
+    def transitions(issue):
+        looked_up.append(issue.key)
+        return WORKFLOW[issue.fields.status.name]
+
+    for key in ("ENG-1", "ENG-2"):
+        t = TicketLabeler("", [], "", "", "fakeJiraToken", cache=cache)
+        t.jira.transitions.side_effect = transitions
+        t.mark_in_review_jira_ticket(make_issue(key, "In Progress"))
+
+    assert looked_up == ["ENG-1"]
+
+
+def test_cached_transitions_arent_shared_between_jira_servers(tmp_path):
+    cache = Cache(str(tmp_path))
+    looked_up = []
+
+    def transitions(issue):
+        looked_up.append(issue.key)
+        return WORKFLOW[issue.fields.status.name]
+
+    for key, jira_url in (
+        ("ENG-1", "https://foo.atlassian.net"),
+        ("ENG-2", "https://bar.atlassian.net"),
+    ):
+        t = TicketLabeler("", [], "", "", "fakeJiraToken", "", jira_url, cache=cache)
+        t.jira.transitions.side_effect = transitions
+        t.mark_in_review_jira_ticket(make_issue(key, "In Progress"))
+
+    assert looked_up == ["ENG-1", "ENG-2"]
+
+
+def test_mark_deployed_tracks_status_locally():
+    t = TicketLabeler("", [], "", "", "fakeJiraToken")
+    t.jira.transitions.side_effect = lambda issue: WORKFLOW[issue.fields.status.name]
+    issue = make_issue("ENG-1", "Open")
+
+    t.mark_deployed_jira_ticket(issue)
+
+    assert [call[0][1] for call in t.jira.transition_issue.call_args_list] == [
+        "851",
+        "861",
+    ]
+    assert issue.fields.status.name == "Deployed"
+    assert t.jira.issue.call_count == 0
+
+
+def test_missing_transition_raises():
+    t = TicketLabeler("", [], "", "", "fakeJiraToken")
+    t.jira.transitions.return_value = []
+
+    with pytest.raises(ValueError):
+        t.mark_in_review_jira_ticket(make_issue("ENG-1", "In Progress"))
+
+
+def test_github_url_uses_github_enterprise(mocker: MockFixture):
+    enterprise = mocker.patch("github3.GitHubEnterprise")
+
+    t = TicketLabeler("token", [], "org", "repo", github_url="http://localhost:8000")
+
+    enterprise.assert_called_once_with("http://localhost:8000", token="token")
+    assert t.gh is enterprise.return_value
+
+
+def test_jira_only_doesnt_label_prs(mocker: MockFixture):
+    pull_request_dicts = [{"number": 5, "title": "[ENG-1] foo", "body": ""}]
+    t = TicketLabeler(
+        "",
+        pull_request_dicts,
+        "",
+        "",
+        "fakeJiraToken",
+        "bob@company.com",
+        "https://foo.atlassian.net",
+        jira_only=True,
+    )
+    label_pr_or_issue = mocker.patch.object(t, "label_pr_or_issue")
+
+    assert t.label_tickets("staging", "staging") == 1
+    label_pr_or_issue.assert_not_called()